@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -23,9 +24,7 @@ if not DEBUG:
     SECURE_SSL_REDIRECT = True
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
-    
-    # Для защиты медиа-файлов через X-Accel-Redirect (если настроил в Nginx)
-    # USE_X_ACCEL = True
+
 
 ALLOWED_HOSTS = os.getenv(
     "ALLOWED_HOSTS",
@@ -192,6 +191,78 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# Общий кеш в Redis (тот же сервис, что и у Celery, но база 1): счётчики
+# попыток пароля, квоты, QR и т.д. видны всем воркерам и узлам.
+# Ключи: "<KEY_PREFIX>:<VERSION>:<область>:<...>", где область — quota, qr,
+# auth, ... (см. места использования). Увеличение CACHE_VERSION разом
+# «сбрасывает» весь кеш после несовместимых изменений.
+# Пустой CACHE_URL (локально без Redis) и тесты — LocMem в процессе
+CACHE_URL = os.getenv("CACHE_URL", "redis://redis:6379/1")
+TESTING = sys.argv[1:2] == ["test"]
+
+if CACHE_URL and not TESTING:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "tezshare",
+            "VERSION": int(os.getenv("CACHE_VERSION", 1)),
+            "TIMEOUT": 300,
+            "OPTIONS": {
+                # Пул соединений на процесс
+                "max_connections": int(os.getenv("CACHE_MAX_CONNECTIONS", 50)),
+                "socket_connect_timeout": 2,
+                "socket_timeout": 2,
+                "health_check_interval": 30,
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "KEY_PREFIX": "tezshare",
+            "TIMEOUT": 300,
+        }
+    }
+
+# Очереди: otp — письма с кодами (должны уходить сразу), crypto — шифрование
+# (CPU, долгие задачи), maintenance — очистка по расписанию. У каждой очереди
+# свой воркер в docker-compose.yml, поэтому очередь из шифрований не задерживает OTP
+CELERY_TASK_DEFAULT_QUEUE = "maintenance"
+CELERY_TASK_ROUTES = {
+    "users.tasks.send_otp_email_task": {"queue": "otp"},
+    "main.tasks.encrypt_*": {"queue": "crypto"},
+    "main.tasks.mark_batch_ready_task": {"queue": "crypto"},
+}
+# Долгие задачи: воркер берёт по одной задаче на процесс
+# (у воркера otp значение переопределено в docker-compose.yml)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Расписание (celery beat). expires — пропущенный запуск не копится в очереди
+CELERY_BEAT_SCHEDULE = {
+    "cleanup-expired-files": {
+        "task": "main.tasks.cleanup_expired_files",
+        "schedule": 10 * 60,
+        "options": {"expires": 10 * 60},
+    },
+    "evict-plain-cache": {
+        "task": "main.tasks.evict_plain_cache",
+        "schedule": 10 * 60,
+        "options": {"expires": 10 * 60},
+    },
+    "rebuild-code-filter": {
+        "task": "main.tasks.rebuild_code_filter",
+        "schedule": 60 * 60,
+        "options": {"expires": 60 * 60},
+    },
+    "collect-garbage": {
+        "task": "main.tasks.collect_garbage",
+        "schedule": 30 * 60,
+        "options": {"expires": 30 * 60},
+    },
+}
+
 #Проверяем режим: реальная отправка или в консоль
 EMAIL_LIVE_MODE = os.getenv("EMAIL_LIVE_MODE", "False") == "True"
 
@@ -220,6 +291,64 @@ TEZSHARE_USER_LIMIT_MB = 1000
 TEZSHARE_GUEST_MAX_SIZE = TEZSHARE_GUEST_LIMIT_MB * 1024 * 1024
 TEZSHARE_USER_MAX_SIZE = TEZSHARE_USER_LIMIT_MB * 1024 * 1024
 
+# Размер кадра потокового шифрования (main/crypto.py).
+# Память воркера при шифровании/расшифровке ограничена парой кадров.
+TEZSHARE_FRAME_SIZE = 64 * 1024
+
+# Смещения и размеры чанков должны быть кратны этому блоку (main/uploads.py)
+TEZSHARE_UPLOAD_UNIT = TEZSHARE_FRAME_SIZE
+
+# Фильтр Блума живых short_code (main/codefilter.py): на сколько кодов
+# рассчитан (~1.2 МБ на миллион при 1% ложных срабатываний)
+TEZSHARE_CODE_FILTER_CAPACITY = int(os.getenv("TEZSHARE_CODE_FILTER_CAPACITY", 2_000_000))
+
+# Размер чанка: клиент начинает с предпочтительного и подстраивает его по
+# скорости, но не больше максимального (кратно TEZSHARE_UPLOAD_UNIT и меньше
+# client_max_body_size в nginx). Одновременных запросов на файл — не больше MAX_PARALLEL
+TEZSHARE_CHUNK_SIZE = 1024 * 1024
+TEZSHARE_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+TEZSHARE_UPLOAD_MAX_PARALLEL = 6
+
+# Шифровать чанки сразу при приёме: открытый текст не попадает на диск,
+# а финализация сводится к rename без работы Celery
+TEZSHARE_ENCRYPT_ON_RECEIVE = os.getenv("TEZSHARE_ENCRYPT_ON_RECEIVE", "True") == "True"
+# Срок действия токена сессии загрузки (секунды): чанки с токеном не трогают БД
+TEZSHARE_UPLOAD_SESSION_TTL = 24 * 60 * 60
+# Блок, занятый запросом дольше этого (секунды), считается брошенным (запрос
+# убит посреди чанка) и может быть записан заново. Больше таймаутов nginx и воркера
+TEZSHARE_UPLOAD_CLAIM_TIMEOUT = 10 * 60
+
+# Пароль страницы скачивания: попыток с одного IP за окно (секунды),
+# после чего до конца окна — отказ (main/views.py, download_page_view)
+TEZSHARE_PASSWORD_ATTEMPTS = 5
+TEZSHARE_PASSWORD_LOCKOUT = 60
+
+# Дедупликация: одинаковое содержимое хранится на диске один раз (main/blobs.py)
+TEZSHARE_DEDUP = os.getenv("TEZSHARE_DEDUP", "False") == "True"
+
+# Очистка истёкших батчей (main/sweeper.py): размер страницы, пауза между
+# страницами (сек), бюджет одного запуска (сек) и потоки для удаления файлов
+TEZSHARE_SWEEP_PAGE_SIZE = 500
+TEZSHARE_SWEEP_PAUSE = 0.5
+TEZSHARE_SWEEP_MAX_SECONDS = 5 * 60
+TEZSHARE_SWEEP_WORKERS = 8
+# Сборка мусора в temp_uploads: загрузка без активности дольше срока токена
+# сессии уже не может продолжиться. Если свободного места меньше порога,
+# удаляются и более свежие брошенные загрузки (не моложе PRESSURE_AGE, сек)
+TEZSHARE_STALE_UPLOAD_AGE = TEZSHARE_UPLOAD_SESSION_TTL
+TEZSHARE_GC_MIN_FREE_BYTES = int(os.getenv("TEZSHARE_GC_MIN_FREE_BYTES", 5 * 1024 ** 3))
+TEZSHARE_GC_PRESSURE_AGE = 60 * 60
+
+# Отдача файлов через nginx (X-Accel-Redirect): Django только проверяет доступ,
+# байты отдаёт nginx из кеша расшифрованных файлов (main/plaincache.py)
+USE_X_ACCEL = os.getenv("USE_X_ACCEL", "False") == "True"
+TEZSHARE_PLAIN_CACHE_TTL = int(os.getenv("TEZSHARE_PLAIN_CACHE_TTL", 30 * 60))  # секунды
+TEZSHARE_PLAIN_CACHE_MAX_BYTES = int(os.getenv("TEZSHARE_PLAIN_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
+# Запуск под ASGI (uvicorn, docker-compose.asgi.yml): загрузка и скачивание
+# обслуживаются async-версиями представлений (main/async_views.py)
+TEZSHARE_ASGI = os.getenv("TEZSHARE_ASGI", "False") == "True"
+
 JAZZMIN_SETTINGS = {
     "site_title": "TezShare Admin",
     "site_header": "TezShare",
@@ -10,6 +10,9 @@ echo "PostgreSQL started"
 # Выполняем миграции
 python manage.py migrate
 
+# Фильтр коротких кодов (main/codefilter.py)
+python manage.py rebuild_code_filter
+
 # Собираем статику (для CSS/JS)
 python manage.py collectstatic --noinput
 
@@ -1,6 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.contrib import admin
 
-from .models import ChunkedUpload, FileBatch, SharedFile
+from . import pagecache, sweeper
+from .blobs import dedup_stats
+from .models import Blob, ChunkedUpload, FileBatch, SharedFile
+
+
+def _delete_files(file_ids):
+    # obj.delete() не уменьшает ссылки блобов — удаляем как очистка (main/sweeper.py)
+    if not file_ids:
+        return
+    batch_uuids = set(FileBatch.objects.filter(files__id__in=file_ids).values_list("url_uuid", flat=True))
+    with ThreadPoolExecutor(max_workers=settings.TEZSHARE_SWEEP_WORKERS) as pool:
+        sweeper.delete_files(file_ids, pool)
+    # Удаление мимо сигналов — кеш страницы сбрасываем сами
+    for url_uuid in batch_uuids:
+        pagecache.invalidate(url_uuid)
 
 
 # Класс для отображения файлов прямо внутри батча (инлайн-редактирование)
@@ -25,6 +42,25 @@ class FileBatchAdmin(admin.ModelAdmin):
     # Добавляем список файлов внутрь страницы батча
     inlines = [SharedFileInline]
 
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, FileBatch.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        # Каскад не уменьшает ссылки блобов — удаляем как очистка (main/sweeper.py)
+        batches = dict(queryset.values_list("id", "url_uuid"))
+        with ThreadPoolExecutor(max_workers=settings.TEZSHARE_SWEEP_WORKERS) as pool:
+            sweeper.delete_batches(list(batches), pool)
+        for url_uuid in batches.values():
+            pagecache.invalidate(url_uuid)
+
+    def save_formset(self, request, form, formset, change):
+        # Файлы, удалённые в инлайне, — через sweeper, остальное как обычно
+        instances = formset.save(commit=False)
+        for obj in instances:
+            obj.save()
+        formset.save_m2m()
+        _delete_files([obj.pk for obj in formset.deleted_objects])
+
     # Метод для визуального отображения статуса (истек срок или нет)
     @admin.display(boolean=True, description="Активен")
     def is_active(self, obj):
@@ -40,6 +76,30 @@ class SharedFileAdmin(admin.ModelAdmin):
     list_filter = ("batch__created_at",)
     readonly_fields = ("file_hash", "file_size")
 
+    def delete_model(self, request, obj):
+        _delete_files([obj.pk])
+
+    def delete_queryset(self, request, queryset):
+        _delete_files(list(queryset.values_list("id", flat=True)))
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ("content_hash", "size", "ref_count", "created_at")
+    search_fields = ("content_hash",)
+    readonly_fields = ("content_hash", "size", "file", "ref_count", "created_at")
+    exclude = ("encryption_key",)
+
+    def changelist_view(self, request, extra_context=None):
+        # Коэффициент дедупликации прямо в заголовке списка
+        stats = dedup_stats()
+        extra_context = {
+            **(extra_context or {}),
+            "title": f"Блобы: коэффициент дедупликации {stats['ratio']}, "
+                     f"сэкономлено {round(stats['saved_bytes'] / (1024 * 1024), 2)} MB",
+        }
+        return super().changelist_view(request, extra_context)
+
 
 @admin.register(ChunkedUpload)
 class ChunkedUploadAdmin(admin.ModelAdmin):
@@ -47,8 +107,7 @@ class ChunkedUploadAdmin(admin.ModelAdmin):
     readonly_fields = ("upload_id", "temp_file_path", "offset", "total_size")
 
     def progress_bar(self, obj):
-        percent = int((obj.offset / obj.total_size) * 100) if obj.total_size > 0 else 0
-        return f"{percent}% ({obj.offset} bytes)"
+        return f"{obj.progress_percent}% ({obj.received_bytes} bytes)"
 
     progress_bar.short_description = "Прогресс"
 
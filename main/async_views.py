@@ -0,0 +1,141 @@
+"""
+Async (ASGI) versiyalari: yuklab olish va chunk qabul qilish (multipart va raw).
+
+Sekin mobil mijozlar sinxron gunicorn workerlarini band qilib qo'ymasligi
+uchun: baza — async ORM, fayl o'qish/yozish va shifrlash — oqim hovuzida
+(thread_sensitive=False, ya'ni parallel), javob esa async iterator orqali
+uzatiladi. Bitta uvicorn jarayoni minglab uzatishni ushlab tura oladi.
+
+TEZSHARE_ASGI=True bo'lsa main/urls.py shu ko'rinishlarni ulaydi
+(docker-compose.asgi.yml ga qarang). Mantiq views.py dagi bilan bir xil —
+faqat bazaga murojaat va bloklovchi I/O ajratilgan.
+"""
+import os
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+
+from . import uploads, views
+from .models import FileBatch, SharedFile
+
+
+def _in_thread(func):
+    # Bloklovchi I/O: umumiy "sync" oqimda emas, hovuzda parallel bajariladi
+    return sync_to_async(func, thread_sensitive=False)
+
+
+async def _aiter_in_thread(iterator):
+    """Sinxron generatorni (kadrlarni ochish, disk) oqim hovuzida aylantiradi."""
+    iterator = iter(iterator)
+    sentinel = object()
+    step = _in_thread(next)
+    while (chunk := await step(iterator, sentinel)) is not sentinel:
+        yield chunk
+
+
+def _make_async(response):
+    if isinstance(response, StreamingHttpResponse) and not response.is_async:
+        response.streaming_content = _aiter_in_thread(response.streaming_content)
+    return response
+
+
+async def _check_access(request, batch):
+    if batch.expires_at < timezone.now():
+        return HttpResponse("Muddat tugadi", status=410)
+    if batch.password and not await request.session.aget(f"auth_batch_{batch.id}"):
+        return HttpResponse("Kirish taqiqlangan. Parolni kiriting.", status=403)
+    return None
+
+
+async def decrypt_file_view(request, file_id):
+    try:
+        shared_file = await SharedFile.objects.select_related("batch").aget(id=file_id)
+    except SharedFile.DoesNotExist:
+        raise Http404("Fayl topilmadi")
+
+    denied = await _check_access(request, shared_file.batch)
+    if denied:
+        return denied
+    return _make_async(await _in_thread(views._file_response)(request, shared_file))
+
+
+async def download_batch_zip(request, url_uuid):
+    try:
+        batch = await FileBatch.objects.aget(url_uuid=url_uuid)
+    except FileBatch.DoesNotExist:
+        raise Http404("Batch topilmadi")
+
+    denied = await _check_access(request, batch)
+    if denied:
+        return denied
+    # Fayllar ro'yxatini oldindan olamiz: oqimdagi generator bazaga murojaat qilmaydi
+    files = [sf async for sf in batch.files.all()]
+    return _make_async(await _in_thread(views._zip_response)(batch, files))
+
+
+async def chunked_upload_view(request):
+    if request.method != "POST":
+        # Sahifa (GET) — oddiy sinxron ko'rinish
+        return await sync_to_async(views.chunked_upload_view)(request)
+
+    # Multipart tahlili vaqtinchalik faylni o'qiydi — hovuzda
+    post, files = await _in_thread(lambda: (request.POST, request.FILES))()
+
+    upload_id = os.path.basename(post.get("upload_id", ""))
+    file_chunk = files.get("chunk")
+    try:
+        offset = int(post.get("offset", 0))
+    except (ValueError, TypeError):
+        return JsonResponse({"status": "error", "message": "Noto'g'ri offset"}, status=400)
+
+    if not upload_id or file_chunk is None:
+        return JsonResponse({"status": "error", "message": "Chunk topilmadi"}, status=400)
+
+    if post.get("token") or request.headers.get("X-Upload-Token"):
+        # Token: bazasiz, imzo tekshiruvi — event loopning o'zida
+        session, error = views._session_for_chunk(request, post, upload_id, None)
+    else:
+        session, error = await sync_to_async(views._session_for_chunk)(
+            request, post, upload_id, post.get("filename")
+        )
+    if error:
+        return error
+
+    data = await _in_thread(file_chunk.read)()
+    try:
+        await _in_thread(views._store_chunk)(session, offset, data)
+    except uploads.ChunkError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=e.status)
+
+    return JsonResponse({"status": "continue", "progress": offset + file_chunk.size})
+
+
+@require_http_methods(["PUT"])
+async def raw_chunk_upload_view(request):
+    """
+    views.raw_chunk_upload_view ning async varianti: upload.js token bo'lsa
+    har bir chunkni shu yerga yuboradi. Sinxron ko'rinish ASGI ostida yagona
+    umumiy oqimda ishlaydi — barcha chunklar navbatga tizilib qolardi.
+    """
+    parsed = views._raw_chunk_headers(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    upload_id, offset, length, filename = parsed
+
+    post = {"total_size": request.headers.get("Upload-Length")}
+    if request.headers.get("X-Upload-Token"):
+        session, error = views._session_for_chunk(request, post, upload_id, filename)
+    else:
+        session, error = await sync_to_async(views._session_for_chunk)(request, post, upload_id, filename)
+    if error:
+        return error
+
+    # Tana (uvicorn uni vaqtinchalik faylga yig'ib qo'ygan) hovuzda o'qiladi va yoziladi
+    try:
+        await _in_thread(views._store_chunk_stream)(session, offset, length, request)
+    except uploads.ChunkError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=e.status)
+
+    return JsonResponse({"status": "continue", "progress": offset + length})
@@ -0,0 +1,192 @@
+"""
+Дедупликация содержимого (TEZSHARE_DEDUP).
+
+Блоб — зашифрованный файл, адресуемый хешем содержимого, посчитанным при
+загрузке (main/utils.py). Одинаковое содержимое хранится один раз, а
+SharedFile ссылаются на него; ref_count считает ссылки. Файл блоба
+удаляется только когда истекает последняя ссылка на него (main/sweeper.py).
+
+Адрес блоба (content_hash) берётся из <upload>.sums и не расходится с
+данными: блоки загрузки пишутся один раз, данные и хеши листьев — из
+одних и тех же байтов (main/uploads.py), так что подсунуть под чужой хеш
+другое содержимое нельзя.
+
+Ключ блоба случайный (ключ первой загрузки) и хранится только в БД,
+поэтому совпадение хешей не раскрывается через шифротекст.
+
+Проверка до загрузки (issue_challenge / verify_possession): клиент
+присылает хеш, а сервер просит доказать владение — хеши нескольких
+случайных листей с одноразовым nonce. Вызов выдаётся на любой хеш, и
+при любой неудаче ответ один — «загружайте» (и работа та же: без блоба
+проверяется подставной файл), так что по хешу нельзя узнать, есть ли
+чужой файл на сервере.
+"""
+import hashlib
+import hmac
+import io
+import logging
+import os
+import secrets
+from collections import Counter
+from functools import lru_cache
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import F, Sum
+
+from . import uploads
+from .crypto import DecryptedFile, DecryptionError, encrypt_stream
+from .models import Blob, SharedFile
+from .utils import HASH_LEAF_SIZE
+
+CHALLENGE_SALT = "tezshare.blobs.challenge"
+CHALLENGE_MAX_AGE = 10 * 60
+CHALLENGE_LEAVES = 4
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return settings.TEZSHARE_DEDUP
+
+
+def attach(shared_file, blob):
+    """
+    Связывает файл с блобом: тот же путь и ключ, +1 ссылка. Строка блоба
+    блокируется, как и в release_orphans: блоб без ссылок либо уже удалён
+    (Blob.DoesNotExist), либо получит ссылку раньше, чем его проверят.
+    Вызывать внутри транзакции.
+    """
+    blob = Blob.objects.select_for_update().get(pk=blob.pk)
+    Blob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1)
+    shared_file.blob = blob
+    shared_file.file.name = blob.file.name
+    shared_file.encryption_key = blob.encryption_key
+
+
+def store_encrypted(shared_file, path, content_hash, size, encryption_key):
+    """
+    Готовый зашифрованный временный файл -> блоб. Если такое содержимое
+    уже есть, временный файл просто удаляется. Вызывать внутри транзакции.
+    """
+    blob, created = Blob.objects.select_for_update().get_or_create(
+        content_hash=content_hash,
+        defaults={"size": size, "encryption_key": encryption_key},
+    )
+    if created:
+        blob.file.name = uploads.promote(
+            path, blob.file.field.generate_filename(blob, f"{content_hash}.enc")
+        )
+        blob.save(update_fields=["file"])
+    else:
+        # Как и promote — только после фиксации, иначе откат потеряет загрузку
+        transaction.on_commit(lambda: uploads.discard(path))
+    attach(shared_file, blob)
+    return blob
+
+
+def find(content_hash):
+    return Blob.objects.filter(content_hash=content_hash).exclude(file="").first()
+
+
+def release_orphans(blob_ids=None, unlink=True):
+    """
+    Удаляет блобы без ссылок (и их файлы). Возвращает пути файлов;
+    с unlink=False файлы удаляет вызывающий (пакетная очистка, main/sweeper.py).
+    """
+    removed = []
+    with transaction.atomic():
+        orphans = Blob.objects.select_for_update().filter(ref_count__lte=0)
+        if blob_ids is not None:
+            orphans = orphans.filter(pk__in=list(blob_ids))
+        for blob in orphans:
+            # Строки SharedFile ещё могут ссылаться (PROTECT) — отвязываем
+            SharedFile.objects.filter(blob=blob).update(blob=None)
+            removed.append(blob.file.path if blob.file else None)
+            blob.delete()
+
+    removed = [path for path in removed if path]
+    for path in removed if unlink else ():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def dedup_stats():
+    """Логический объём (все ссылки) против физического (блобы на диске)."""
+    logical = SharedFile.objects.filter(blob__isnull=False).aggregate(total=Sum("file_size"))["total"] or 0
+    physical = Blob.objects.aggregate(total=Sum("size"))["total"] or 0
+    return {
+        "blobs": Blob.objects.count(),
+        "logical_bytes": logical,
+        "physical_bytes": physical,
+        "saved_bytes": max(logical - physical, 0),
+        "ratio": round(logical / physical, 2) if physical else 1.0,
+    }
+
+
+def issue_challenge(upload_id, content_hash, size):
+    """Случайные листья и nonce; всё подписано, на сервере ничего не храним."""
+    leaf_count = max(1, -(-size // HASH_LEAF_SIZE))
+    leaves = sorted(secrets.SystemRandom().sample(range(leaf_count), min(CHALLENGE_LEAVES, leaf_count)))
+    nonce = secrets.token_hex(16)
+    token = signing.dumps(
+        {"u": upload_id, "h": content_hash, "s": size, "l": leaves, "n": nonce},
+        salt=CHALLENGE_SALT,
+    )
+    return {"token": token, "leaves": leaves, "nonce": nonce, "leaf_size": HASH_LEAF_SIZE}
+
+
+def leaf_proof(nonce, data):
+    return hashlib.sha256(nonce.encode() + bytes(data)).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _decoy():
+    """Ключ и зашифрованный лист из нулей — подставной блоб для verify_possession."""
+    key = Fernet.generate_key()
+    return key, b"".join(encrypt_stream(key, io.BytesIO(bytes(HASH_LEAF_SIZE))))
+
+
+def verify_possession(token, proofs):
+    """
+    Проверяет ответ на вызов. Возвращает (upload_id, blob), если клиент
+    действительно владеет содержимым, иначе None.
+    """
+    try:
+        challenge = signing.loads(token, salt=CHALLENGE_SALT, max_age=CHALLENGE_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    leaves = challenge["l"]
+    if not isinstance(proofs, list) or len(proofs) != len(leaves):
+        return None
+
+    blob = find(challenge["h"])
+    if blob is not None and blob.size == challenge["s"]:
+        key, open_file, stored_size = blob.encryption_key, lambda: blob.file.open("rb"), blob.file.size
+    else:
+        # Блоба нет — та же работа над подставным файлом, чтобы по времени
+        # ответа нельзя было узнать, есть ли такое содержимое на сервере
+        blob = None
+        key, data = _decoy()
+        open_file, stored_size = lambda: io.BytesIO(data), len(data)
+
+    valid = True
+    try:
+        with open_file() as f:
+            plain = DecryptedFile(key, f, stored_size)
+            for index, proof in zip(leaves, proofs):
+                start = (index if blob else 0) * HASH_LEAF_SIZE
+                data = b"".join(plain.iter_range(start, start + HASH_LEAF_SIZE))
+                # Без раннего выхода: проверяются все листья
+                valid &= hmac.compare_digest(leaf_proof(challenge["n"], data), str(proof))
+    except (OSError, DecryptionError) as e:
+        logger.error(f"Блоб {blob.id if blob else '-'} не читается: {e}")
+        return None
+    if blob is None or not valid:
+        return None
+    return challenge["u"], blob
@@ -0,0 +1,175 @@
+"""
+Фильтр Блума живых short_code: подобранный наугад код отсекается без
+запроса к базе.
+
+Битовый массив лежит в Redis (общий для всех воркеров; проверка и
+добавление — Lua-скрипты, один запрос). Без Redis (кеш LocMem) фильтр
+выключен: копия в памяти одного процесса не видела бы коды, созданные
+другими процессами, и отсекала бы живые. Новый код добавляется в
+FileBatch.save() после фиксации транзакции (код показывается пользователю
+только после неё). Удалить код из фильтра Блума нельзя, поэтому истёкшие
+коды уходят при перестройке (rebuild): при старте (entrypoint.sh) и по
+расписанию. Пока фильтра нет, он отвечает «может быть» — код ищется в базе
+как раньше, ложных отказов не бывает.
+
+Найденные коды кешируются ненадолго (resolve): url_uuid и нужен ли пароль.
+"""
+import hashlib
+import logging
+import math
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CODE_RE = re.compile(r"[A-Z0-9]{6}")
+# Доля ложных срабатываний при заполнении до TEZSHARE_CODE_FILTER_CAPACITY
+ERROR_RATE = 0.01
+LOOKUP_TTL = 60
+
+# Бит i — старший бит байта i // 8, как у SETBIT/GETBIT в Redis.
+# Добавление пишет и в готовый фильтр, и в строящийся (KEYS[2]), если они есть
+_ADD_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for _, bit in ipairs(ARGV) do redis.call('SETBIT', key, bit, 1) end
+    end
+end
+return 1
+"""
+_CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 1 end
+for _, bit in ipairs(ARGV) do
+    if redis.call('GETBIT', KEYS[1], bit) == 0 then return 0 end
+end
+return 1
+"""
+
+_redis = None
+_scripts = {}
+
+
+def _size():
+    """(число бит, число хешей) для заданной ёмкости."""
+    capacity = settings.TEZSHARE_CODE_FILTER_CAPACITY
+    bits = math.ceil(-capacity * math.log(ERROR_RATE) / math.log(2) ** 2)
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+def _positions(code):
+    bits, hashes = _size()
+    digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    first = int.from_bytes(digest[:8], "big")
+    step = int.from_bytes(digest[8:], "big") | 1
+    return [(first + i * step) % bits for i in range(hashes)]
+
+
+def _set_bits(array, positions):
+    for bit in positions:
+        array[bit >> 3] |= 0x80 >> (bit & 7)
+
+
+def _uses_redis():
+    return settings.CACHES["default"]["BACKEND"].endswith("RedisCache")
+
+
+def _key():
+    bits, hashes = _size()
+    return cache.make_key(f"codes:bloom:{bits}:{hashes}")
+
+
+def _client():
+    global _redis
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis.from_url(settings.CACHE_URL, socket_timeout=2, socket_connect_timeout=2)
+        _scripts["add"] = _redis.register_script(_ADD_SCRIPT)
+        _scripts["check"] = _redis.register_script(_CHECK_SCRIPT)
+    return _redis
+
+
+def _run(script, code):
+    _client()
+    keys = [_key(), f"{_key()}:build"] if script == "add" else [_key()]
+    return _scripts[script](keys=keys, args=_positions(code))
+
+
+def _build():
+    from .models import FileBatch
+
+    bits, _ = _size()
+    array = bytearray(-(-bits // 8))
+    live = FileBatch.objects.filter(expires_at__gte=timezone.now()).exclude(short_code="")
+    for code in live.values_list("short_code", flat=True).iterator(chunk_size=10000):
+        _set_bits(array, _positions(code))
+    return array
+
+
+def rebuild():
+    """
+    Строит фильтр заново по живым батчам (истёкшие коды выпадают).
+    Пустой «строящийся» ключ создаётся до чтения базы: коды, добавленные
+    после этого (add — после фиксации транзакции), попадают и в него,
+    так что при подмене ключа ни один живой код не теряется.
+    """
+    if not _uses_redis():
+        return
+
+    key = _key()
+    build, loaded = f"{key}:build", f"{key}:loaded"
+    client = _client()
+    with client.lock(f"{key}:lock", timeout=10 * 60):
+        bits, _ = _size()
+        client.delete(build)
+        client.setbit(build, bits - 1, 0)
+        client.set(loaded, bytes(_build()))
+        client.bitop("OR", build, build, loaded)
+        client.rename(build, key)
+        client.delete(loaded)
+
+
+def add(code):
+    """Добавляет новый код. Если фильтра ещё нет — ничего не делает."""
+    if not code or not _uses_redis():
+        return
+    try:
+        _run("add", code)
+    except Exception as e:
+        logger.error(f"Не удалось добавить {code} в фильтр кодов: {e}")
+        # Иначе код отсекался бы до перестройки: без фильтра — поиск в базе
+        try:
+            _client().delete(_key())
+        except Exception:
+            pass
+
+
+def might_exist(code):
+    """False — кода точно нет; True — может быть (или фильтр недоступен)."""
+    if not _uses_redis():
+        return True
+    try:
+        return bool(_run("check", code))
+    except Exception as e:
+        logger.warning(f"Фильтр кодов недоступен: {e}")
+        return True
+
+
+def resolve(code):
+    """(url_uuid, нужен ли пароль) для живого кода или None."""
+    from .models import FileBatch
+
+    if not CODE_RE.fullmatch(code) or not might_exist(code):
+        return None
+    key = f"codes:lookup:{code}"
+    found = cache.get(key)
+    if found is None:
+        row = FileBatch.objects.filter(short_code=code).values_list("url_uuid", "password").first()
+        if row is None:
+            return None
+        found = (row[0], bool(row[1]))
+        cache.set(key, found, LOOKUP_TTL)
+    return found
@@ -0,0 +1,230 @@
+"""
+Потоковый формат шифрования файлов TezShare (версия 2).
+
+Файл = заголовок (16 байт) + кадры. Каждый кадр — до ``frame_size`` байт
+открытого текста, зашифрованных AES-256-GCM с собственным тегом (16 байт).
+Nonce кадра = префикс из заголовка (7 байт) + номер кадра (4 байта) + флаг
+последнего кадра (1 байт), поэтому кадры нельзя переставить, подменить
+или незаметно обрезать.
+
+Старые файлы (целиком в Fernet) начинаются с "gAAAAA" и читаются как раньше.
+"""
+import io
+import os
+import struct
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+
+MAGIC = b"TZS\x02"
+HEADER_SIZE = 16
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+
+# MAGIC (4) + frame_size (4, big-endian) + nonce prefix (7) + reserved (1)
+_HEADER = struct.Struct(">4sI7sx")
+_COUNTER = struct.Struct(">IB")
+
+
+class DecryptionError(Exception):
+    """Кадр не прошёл проверку подлинности или файл повреждён."""
+
+
+def _derive_key(master_key):
+    """Из ключа батча (Fernet) получаем отдельный 256-битный ключ для AES-GCM."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"tezshare:stream:v2",
+    ).derive(bytes(master_key))
+
+
+class FrameCipher:
+    """Шифрует и расшифровывает отдельные кадры одного файла."""
+
+    def __init__(self, master_key, nonce_prefix=None, frame_size=None):
+        self.frame_size = frame_size or settings.TEZSHARE_FRAME_SIZE
+        self.nonce_prefix = nonce_prefix or os.urandom(NONCE_PREFIX_SIZE)
+        self._aead = AESGCM(_derive_key(master_key))
+
+    @classmethod
+    def for_upload(cls, master_key, frame_size=None):
+        """
+        Шифр для шифрования при приёме чанков: префикс nonce выводится из
+        ключа загрузки, поэтому любой процесс получает тот же заголовок.
+        Nonce кадра определяется (ключ, номер кадра), поэтому кадр можно
+        зашифровать только один раз: main/uploads.py не перезаписывает
+        блоки, уже отмеченные в карте (_claim).
+        """
+        nonce_prefix = HKDF(
+            algorithm=hashes.SHA256(),
+            length=NONCE_PREFIX_SIZE,
+            salt=None,
+            info=b"tezshare:stream:v2:nonce",
+        ).derive(bytes(master_key))
+        return cls(master_key, nonce_prefix=nonce_prefix, frame_size=frame_size)
+
+    @classmethod
+    def from_header(cls, master_key, header):
+        if len(header) != HEADER_SIZE or not is_framed(header):
+            raise DecryptionError("Неизвестный формат файла")
+        _, frame_size, nonce_prefix = _HEADER.unpack(header)
+        return cls(master_key, nonce_prefix=nonce_prefix, frame_size=frame_size)
+
+    @property
+    def header(self):
+        return _HEADER.pack(MAGIC, self.frame_size, self.nonce_prefix)
+
+    @property
+    def sealed_size(self):
+        """Размер полного кадра на диске."""
+        return self.frame_size + TAG_SIZE
+
+    def _nonce(self, index, last):
+        return self.nonce_prefix + _COUNTER.pack(index, 1 if last else 0)
+
+    def seal(self, index, data, last):
+        return self._aead.encrypt(self._nonce(index, last), data, self.header)
+
+    def open(self, index, data, last):
+        try:
+            return self._aead.decrypt(self._nonce(index, last), data, self.header)
+        except Exception:
+            raise DecryptionError(f"Кадр {index} повреждён")
+
+
+def is_framed(head):
+    """Проверяет маркер версии в первых байтах файла."""
+    return bytes(head[: len(MAGIC)]) == MAGIC
+
+
+def frame_count(stored_size, frame_size):
+    """Сколько кадров в файле данного размера (минимум один, даже для пустого)."""
+    body = stored_size - HEADER_SIZE
+    return max(1, -(-body // (frame_size + TAG_SIZE)))
+
+
+def stored_size_for(plain_size, frame_size):
+    """Размер зашифрованного файла для открытого текста данного размера."""
+    frames = max(1, -(-plain_size // frame_size))
+    return HEADER_SIZE + plain_size + frames * TAG_SIZE
+
+
+def plain_size(stored_size, frame_size):
+    """Размер открытого текста по размеру зашифрованного файла."""
+    return stored_size - HEADER_SIZE - frame_count(stored_size, frame_size) * TAG_SIZE
+
+
+def encrypt_stream(master_key, fileobj, frame_size=None):
+    """
+    Генератор: заголовок, затем зашифрованные кадры.
+    В памяти одновременно не больше двух кадров, независимо от размера файла.
+    """
+    cipher = FrameCipher(master_key, frame_size=frame_size)
+    yield cipher.header
+
+    index = 0
+    data = fileobj.read(cipher.frame_size)
+    while True:
+        # Читаем на кадр вперёд, чтобы знать, какой кадр последний
+        following = fileobj.read(cipher.frame_size) if data else b""
+        last = not following
+        yield cipher.seal(index, data, last)
+        if last:
+            break
+        data = following
+        index += 1
+
+
+def decrypt_stream(master_key, fileobj, stored_size, start=0, end=None):
+    """
+    Генератор открытого текста в диапазоне [start, end).
+    Расшифровываются только кадры, покрывающие запрошенные байты.
+    """
+    fileobj.seek(0)
+    cipher = FrameCipher.from_header(master_key, fileobj.read(HEADER_SIZE))
+    total = plain_size(stored_size, cipher.frame_size)
+    end = total if end is None else min(end, total)
+    last_index = frame_count(stored_size, cipher.frame_size) - 1
+
+    if start >= end:
+        # Пустой диапазон: всё равно проверяем единственный кадр пустого файла
+        if total == 0:
+            cipher.open(0, fileobj.read(cipher.sealed_size), True)
+        return
+
+    first = start // cipher.frame_size
+    fileobj.seek(HEADER_SIZE + first * cipher.sealed_size)
+    for index in range(first, (end - 1) // cipher.frame_size + 1):
+        sealed = fileobj.read(cipher.sealed_size)
+        data = cipher.open(index, sealed, index == last_index)
+        frame_start = index * cipher.frame_size
+        yield data[max(start - frame_start, 0) : end - frame_start]
+
+
+class DecryptedFile:
+    """
+    Открытый текст зашифрованного файла любого формата: потоковый v2
+    или старый Fernet. Размер известен заранее, любой диапазон можно
+    прочитать без расшифровки остального файла (для v2).
+    """
+
+    def __init__(self, master_key, fileobj, stored_size):
+        self.master_key = master_key
+        self.fileobj = fileobj
+        self.stored_size = stored_size
+
+        head = fileobj.read(len(MAGIC))
+        self.framed = is_framed(head)
+        if self.framed:
+            fileobj.seek(0)
+            cipher = FrameCipher.from_header(master_key, fileobj.read(HEADER_SIZE))
+            self.size = plain_size(stored_size, cipher.frame_size)
+            self._legacy = None
+        else:
+            # Старый формат: весь файл — один токен Fernet, только целиком в памяти
+            try:
+                self._legacy = Fernet(master_key).decrypt(head + fileobj.read())
+            except Exception:
+                raise DecryptionError("Shifrni ochishda xatolik")
+            self.size = len(self._legacy)
+
+    def iter_range(self, start=0, end=None):
+        if self._legacy is not None:
+            yield self._legacy[start:end]
+            return
+        yield from decrypt_stream(self.master_key, self.fileobj, self.stored_size, start, end)
+
+    def __iter__(self):
+        return self.iter_range()
+
+
+def iter_plaintext(master_key, fileobj, stored_size):
+    """Открытый текст файла любого формата: потоковый v2 или старый Fernet."""
+    yield from DecryptedFile(master_key, fileobj, stored_size)
+
+
+class StreamReader(io.RawIOBase):
+    """Файлоподобная обёртка над генератором байтов (для storage.save)."""
+
+    def __init__(self, iterator):
+        self._iterator = iter(iterator)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._iterator)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
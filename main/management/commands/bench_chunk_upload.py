@@ -0,0 +1,97 @@
+import os
+import time
+import tracemalloc
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from main import uploads, views
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнение приёма чанков: multipart (chunked_upload_view) и «сырое» тело "
+        "(raw_chunk_upload_view). Показывает МБ/с на один процесс и пик выделенной "
+        "памяти Python на чанк. Запросы вызываются напрямую, без middleware."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=64, help="Сколько чанков на прогон")
+        parser.add_argument("--chunk-size", type=int, default=settings.TEZSHARE_CHUNK_SIZE)
+        parser.add_argument("--repeat", type=int, default=3, help="Прогонов, берётся лучший")
+
+    def handle(self, *args, chunks, chunk_size, repeat, **options):
+        unit = uploads.unit_size()
+        chunk_size = max(unit, chunk_size // unit * unit)
+        total_size = chunks * chunk_size
+        data = os.urandom(chunk_size)
+        factory = RequestFactory()
+        self.stdout.write(
+            f"{chunks} чанков по {chunk_size} байт, шифрование при приёме: "
+            f"{settings.TEZSHARE_ENCRYPT_ON_RECEIVE}"
+        )
+
+        def multipart_requests(upload_id, token):
+            for index in range(chunks):
+                request = factory.post("/upload/", {
+                    "chunk": SimpleUploadedFile("chunk", data),
+                    "upload_id": upload_id,
+                    "offset": index * chunk_size,
+                    "token": token,
+                })
+                yield views.chunked_upload_view, request
+
+        def raw_requests(upload_id, token):
+            for index in range(chunks):
+                request = factory.generic(
+                    "PUT", "/upload/raw/", data, content_type="application/octet-stream",
+                    headers={"X-Upload-Id": upload_id, "X-Upload-Token": token, "Upload-Offset": str(index * chunk_size)},
+                )
+                yield views.raw_chunk_upload_view, request
+
+        for name, build in (("multipart", multipart_requests), ("raw", raw_requests)):
+            best = None
+            for attempt in range(repeat):
+                upload_id = f"bench_{name}_{attempt}"
+                prepared = list(build(upload_id, self._token(upload_id, total_size)))
+                started = time.perf_counter()
+                self._run(prepared)
+                elapsed = time.perf_counter() - started
+                uploads.discard(uploads.temp_path(upload_id))
+                best = elapsed if best is None else min(best, elapsed)
+
+            # Память — отдельным прогоном: tracemalloc замедляет работу
+            upload_id = f"bench_{name}_mem"
+            prepared = list(build(upload_id, self._token(upload_id, total_size)))
+            tracemalloc.start()
+            peak = 0
+            while prepared:
+                # Разобранный запрос держит чанк в памяти — отпускаем его сразу
+                view, request = prepared.pop()
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                self._run([(view, request)])
+                del request
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            tracemalloc.stop()
+            uploads.discard(uploads.temp_path(upload_id))
+
+            self.stdout.write(
+                f"{name:>9}: {total_size / best / 1024 ** 2:8.1f} МБ/с, "
+                f"пик памяти на чанк {peak / 1024:8.0f} КБ"
+            )
+
+    def _token(self, upload_id, total_size):
+        key = Fernet.generate_key() if settings.TEZSHARE_ENCRYPT_ON_RECEIVE else None
+        return uploads.issue_session_token(upload_id, total_size, key)
+
+    def _run(self, prepared):
+        for view, request in prepared:
+            request.user = AnonymousUser()
+            response = view(request)
+            if response.status_code != 200:
+                raise RuntimeError(response.content.decode())
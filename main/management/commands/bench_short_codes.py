@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from main import shortcodes
+from main.models import FileBatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер выдачи short_code (main/shortcodes.py): время на код при заданном "
+        "числе живых батчей. Всё выполняется в транзакции и откатывается."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--live", type=int, default=0, help="Сколько живых батчей создать перед замером")
+        parser.add_argument("--count", type=int, default=1_000_000, help="Сколько кодов выдать")
+        parser.add_argument("--steps", type=int, default=10, help="На сколько отрезков разбить замер")
+
+    def handle(self, *args, live, count, steps, **options):
+        with transaction.atomic():
+            if live:
+                self._populate(live)
+            self.stdout.write(f"Живых батчей: {FileBatch.objects.count()}")
+
+            seen = set()
+            step = max(1, count // steps)
+            started = time.perf_counter()
+            mark = started
+            while len(seen) < count:
+                codes = shortcodes.reserve_block()
+                seen.update(codes)
+                if len(seen) // step != (len(seen) - len(codes)) // step:
+                    now = time.perf_counter()
+                    self.stdout.write(
+                        f"{len(seen):>10} кодов: {(now - mark) / step * 1e6:.2f} мкс/код"
+                    )
+                    mark = now
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Итого {len(seen)} уникальных кодов за {elapsed:.2f} с "
+                f"({elapsed / len(seen) * 1e6:.2f} мкс/код, блок {shortcodes.BLOCK_SIZE})"
+            )
+            transaction.set_rollback(True)
+
+    def _populate(self, live):
+        expires_at = timezone.now() + timezone.timedelta(days=1)
+        created = 0
+        while created < live:
+            codes = shortcodes.reserve_block(min(shortcodes.BLOCK_SIZE, live - created))
+            FileBatch.objects.bulk_create(
+                FileBatch(short_code=code, encryption_key=b"", expires_at=expires_at) for code in codes
+            )
+            created += len(codes)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main import codefilter
+
+
+class Command(BaseCommand):
+    help = "Перестраивает фильтр коротких кодов (main/codefilter.py) по живым батчам."
+
+    def handle(self, *args, **options):
+        codefilter.rebuild()
+        self.stdout.write("Фильтр кодов перестроен")
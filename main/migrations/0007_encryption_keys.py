@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_feedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='encryption_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sharedfile',
+            name='encryption_key',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
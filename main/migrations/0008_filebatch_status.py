@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_encryption_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filebatch',
+            name='expected_files',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='filebatch',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Обрабатывается'), ('ready', 'Готов'), ('failed', 'Ошибка')], default='ready', max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_shortcodesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sharedfile',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+    ]
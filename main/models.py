@@ -4,13 +4,18 @@ from datetime import timedelta
 from cryptography.fernet import Fernet
 from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
-from .utils import generate_short_code
+from . import codefilter, shortcodes, uploads
 
 
 class FileBatch(models.Model):
+    class Status(models.TextChoices):
+        PROCESSING = "processing", "Обрабатывается"
+        READY = "ready", "Готов"
+        FAILED = "failed", "Ошибка"
+
     owner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     ip_address = models.GenericIPAddressField(null=True, blank=True, db_index=True)
 
@@ -28,9 +33,14 @@ class FileBatch(models.Model):
 
     encryption_key = models.BinaryField()
     created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField(null=True, blank=True)
+    # Индекс: очистка выбирает истёкшие батчи страницами (main/sweeper.py)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
     password = models.CharField(max_length=128, blank=True, null=True)  # Хеш пароля
 
+    # Фоновое шифрование: файлы появляются по одному, батч готов, когда готовы все
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.READY)
+    expected_files = models.PositiveIntegerField(default=0)
+
     def set_batch_password(self, raw_password):
         self.password = make_password(raw_password)
 
@@ -40,12 +50,14 @@ class FileBatch(models.Model):
         return check_password(raw_password, self.password)
 
     def save(self, *args, **kwargs):
-        # 1. Генерация уникального short_code (для ввода ручками)
+        # 1. Уникальный short_code (для ввода ручками), см. main/shortcodes.py
         if not self.short_code:
-            new_code = generate_short_code()
-            while FileBatch.objects.filter(short_code=new_code).exists():
-                new_code = generate_short_code()
-            self.short_code = new_code
+            self.short_code = shortcodes.allocate()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "short_code" in update_fields:
+            # Фильтр кодов (main/codefilter.py): код проходит, как только его увидят
+            code = self.short_code
+            transaction.on_commit(lambda: codefilter.add(code))
 
         # 2. Срок хранения
         if not self.expires_at:
@@ -66,6 +78,27 @@ class FileBatch(models.Model):
         return f"Batch {self.short_code} (UUID: {self.url_uuid})"
 
 
+class ShortCodeSequence(models.Model):
+    """Счётчик для main/shortcodes.py: одна строка, номера выдаются блоками."""
+    next_value = models.BigIntegerField(default=0)
+
+
+class Blob(models.Model):
+    """
+    Общее зашифрованное содержимое (дедупликация): одинаковые файлы
+    хранятся на диске один раз, SharedFile ссылаются на блоб.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField(default=0)
+    file = models.FileField(upload_to="blobs/%Y/%m/%d/", blank=True)
+    encryption_key = models.BinaryField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Blob {self.content_hash[:12]} ({self.ref_count} refs)"
+
+
 class SharedFile(models.Model):
     batch = models.ForeignKey(FileBatch, related_name="files", on_delete=models.CASCADE)
     file = models.FileField(upload_to="encrypted_uploads/%Y/%m/%d/")
@@ -73,6 +106,19 @@ class SharedFile(models.Model):
     file_hash = models.CharField(max_length=64, blank=True, null=True)
     relative_path = models.CharField(max_length=500, blank=True, default="")
     file_size = models.BigIntegerField(default=0)
+    # Показывается на странице скачивания; у старых файлов пусто
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    # Свой ключ файла (шифрование при приёме чанков); пусто — ключ батча
+    encryption_key = models.BinaryField(null=True, blank=True)
+
+    # Если задан, file указывает на общий файл блоба (удалять через main.blobs)
+    blob = models.ForeignKey(Blob, related_name="shared_files", on_delete=models.PROTECT, null=True, blank=True)
+
+    @property
+    def key(self):
+        """Ключ, которым зашифрован файл."""
+        return self.encryption_key or self.batch.encryption_key
 
     def __str__(self):
         return f"{self.relative_path or self.original_name}"
@@ -88,23 +134,36 @@ class ChunkedUpload(models.Model):
     filename = models.CharField(max_length=255)
     total_size = models.BigIntegerField()
 
-    # Сколько байт мы уже получили и записали на диск
+    # Устарело: чанки пишутся параллельно, полученные байты считаются по карте
+    # (см. received_bytes и main/uploads.py)
     offset = models.BigIntegerField(default=0)
 
     # Путь к временному файлу, который мы "дописываем"
     temp_file_path = models.CharField(max_length=500)
 
+    # Ключ загрузки: если задан, чанки шифруются сразу при приёме
+    encryption_key = models.BinaryField(null=True, blank=True)
+
+    # Содержимое уже есть на сервере (проверка хеша до загрузки): чанков не будет
+    blob = models.ForeignKey("Blob", on_delete=models.SET_NULL, null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Загрузка {self.filename} ({self.offset}/{self.total_size})"
+        return f"Загрузка {self.filename} ({self.received_bytes}/{self.total_size})"
+
+    @property
+    def received_bytes(self):
+        if self.blob_id:
+            return self.total_size
+        return uploads.received_bytes(self.temp_file_path, self.total_size)
 
     @property
     def progress_percent(self):
         if self.total_size == 0:
             return 0
-        return int((self.offset / self.total_size) * 100)
+        return int((self.received_bytes / self.total_size) * 100)
 
 
 
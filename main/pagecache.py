@@ -0,0 +1,78 @@
+"""
+Yuklab olish sahifasi (/d/<uuid>/) uchun keshlangan ma'lumot.
+
+Mashhur havolaning har bir ochilishi batch, fayllar ro'yxati va hajmlarni
+bazadan qayta o'qimasligi uchun sahifaga kerak bo'lgan hamma narsa bitta
+lug'at sifatida keshda saqlanadi (kalit — url_uuid). Shablon uni batch va
+fayl obyektlari o'rnida ishlatadi.
+
+Eskirtish — signallar orqali (main/signals.py): fayl qo'shilganda yoki
+o'chirilganda, batch saqlanganda yoki o'chirilganda, tranzaksiya
+tasdiqlangandan keyin. update() signal bermaydi — bunday joylar
+invalidate() ni o'zi chaqiradi. Kesh muddati batch muddatidan oshmaydi,
+shuning uchun muddati tugagan (sweeper o'chirgan) batchlar ham o'zi
+yo'qoladi; muddat tugashi keshdagi expires_at bo'yicha tekshiriladi.
+
+Har bir yozuvda ETag va Last-Modified bor: qayta ochilganda 304 qaytadi.
+"""
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+# Ko'p ochiladigan havolalar shuncha vaqt bazaga murojaat qilmaydi
+CACHE_TIMEOUT = 10 * 60
+
+
+def _key(url_uuid):
+    return f"page:batch:{url_uuid}"
+
+
+def _build(url_uuid):
+    from .models import FileBatch
+
+    batch = FileBatch.objects.filter(url_uuid=url_uuid).first()
+    if batch is None:
+        return None
+    page = {
+        "id": batch.id,
+        "url_uuid": batch.url_uuid,
+        "short_code": batch.short_code,
+        "status": batch.status,
+        "expected_files": batch.expected_files,
+        "comment": batch.comment,
+        "expires_at": batch.expires_at,
+        "has_password": bool(batch.password),
+        "files": [
+            {"id": sf.id, "original_name": sf.original_name, "file_size": sf.file_size, "created_at": sf.created_at}
+            for sf in batch.files.only("id", "original_name", "file_size", "created_at")
+        ],
+    }
+    # Qayta qurilgan, lekin o'zgarmagan sahifa ETag'i o'sha-o'sha qoladi
+    digest = hashlib.blake2b(json.dumps(page, default=str, sort_keys=True).encode(), digest_size=12)
+    page["etag"] = digest.hexdigest()
+    page["modified"] = timezone.now().replace(microsecond=0)
+    return page
+
+
+def get(url_uuid):
+    """Sahifa ma'lumoti (lug'at) yoki batch bo'lmasa None."""
+    key = _key(url_uuid)
+    page = cache.get(key)
+    if page is None:
+        page = _build(url_uuid)
+        if page is None:
+            return None
+        timeout = CACHE_TIMEOUT
+        if page["expires_at"] is not None:
+            timeout = min(timeout, int((page["expires_at"] - timezone.now()).total_seconds()))
+        if timeout > 0:
+            cache.set(key, page, timeout)
+    return page
+
+
+def invalidate(url_uuid):
+    """Tranzaksiya tasdiqlangach keshni o'chiradi (undan oldin o'qigan eski holatni yozib qo'ymasin)."""
+    transaction.on_commit(lambda: cache.delete(_key(url_uuid)))
@@ -0,0 +1,154 @@
+"""
+Кеш расшифрованных файлов для отдачи через nginx (USE_X_ACCEL).
+
+Django только проверяет доступ (срок, пароль) и отвечает заголовком
+X-Accel-Redirect, а байты отдаёт nginx через sendfile из
+MEDIA_ROOT/plain_cache — эта папка внутри internal-локации /media/,
+снаружи она недоступна. Файл расшифровывается в кеш один раз, и весь
+класс, скачивающий один и тот же батч, читает его уже без Python.
+
+При промахе файл отдаётся потоком, как раньше, и по пути пишется в кеш
+(tee): первый байт не ждёт расшифровки всего файла. Запись — во временный
+файл, затем os.replace, поэтому nginx никогда не видит недописанный файл.
+Заполняет кеш один процесс (файл .lock), остальные просто отдают поток. Открытый текст хранится
+недолго: evict() удаляет записи старше TEZSHARE_PLAIN_CACHE_TTL и
+самые старые при превышении TEZSHARE_PLAIN_CACHE_MAX_BYTES, а при удалении
+батча его записи удаляет main/sweeper.py.
+"""
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+
+LOCK_SUFFIX = ".lock"
+PARTIAL_SUFFIX = ".partial"
+# Заполнение дольше этого считаем упавшим — замок можно снять
+LOCK_TIMEOUT = 30 * 60
+
+
+def enabled():
+    return settings.USE_X_ACCEL
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, "plain_cache")
+
+
+def file_entry(file_id):
+    return f"f{file_id}.bin"
+
+
+def zip_entry(batch_id):
+    return f"b{batch_id}.zip"
+
+
+def entry_path(name):
+    return os.path.join(cache_dir(), name)
+
+
+def accel_path(name):
+    """Внутренний URI для X-Accel-Redirect (локация /media/ в nginx)."""
+    return f"{settings.MEDIA_URL}plain_cache/{quote(name)}"
+
+
+def lookup(name):
+    """Путь к готовой записи (и отметка последнего обращения) или None."""
+    path = entry_path(name)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def _acquire(lock, retry=True):
+    try:
+        return os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        try:
+            if not retry or time.time() - os.stat(lock).st_mtime < LOCK_TIMEOUT:
+                return None
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+        return _acquire(lock, retry=False)
+
+
+def tee(name, chunks, complete=None):
+    """
+    Генератор: отдаёт куски chunks и попутно пишет их в кеш, так что
+    промах не задерживает первый байт. Запись появляется только после
+    последнего куска и если complete() (по умолчанию — всегда) истинно;
+    при ошибке или обрыве соединения недописанный файл удаляется. Если
+    запись уже заполняет другой процесс — просто отдаёт куски.
+    """
+    os.makedirs(cache_dir(), mode=0o700, exist_ok=True)
+    path = entry_path(name)
+    lock = path + LOCK_SUFFIX
+    fd = _acquire(lock)
+    if fd is None:
+        yield from chunks
+        return
+
+    # Своё имя: медленный клиент может держать замок дольше LOCK_TIMEOUT
+    partial = f"{path}.{os.getpid()}-{threading.get_ident()}{PARTIAL_SUFFIX}"
+    try:
+        with open(partial, "wb") as out:
+            for chunk in chunks:
+                out.write(chunk)
+                yield chunk
+        if complete is None or complete():
+            os.replace(partial, path)
+    finally:
+        os.close(fd)
+        for leftover in (partial, lock):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+
+def evict(ttl=None, max_bytes=None):
+    """
+    Удаляет записи без обращений дольше ttl, затем самые старые, пока
+    кеш не уложится в max_bytes. Возвращает число удалённых файлов.
+    """
+    ttl = settings.TEZSHARE_PLAIN_CACHE_TTL if ttl is None else ttl
+    max_bytes = settings.TEZSHARE_PLAIN_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+
+    entries = []
+    removed = 0
+    try:
+        scan = list(os.scandir(cache_dir()))
+    except FileNotFoundError:
+        return 0
+    for entry in scan:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        in_progress = entry.name.endswith((LOCK_SUFFIX, PARTIAL_SUFFIX))
+        age = now - stat.st_mtime
+        if age > (LOCK_TIMEOUT if in_progress else ttl):
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        elif not in_progress:
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
@@ -0,0 +1,50 @@
+"""
+QR-kodlar: /d/<uuid>/qr.png va /d/<uuid>/qr.svg.
+
+Finalize endi rasm chizmaydi va diskka yozmaydi — javobda faqat shu manzil.
+Rasm birinchi so'rovda chiziladi va keshda saqlanadi (kalit — format va
+havoladan olingan xesh, kesh esa LRU: LocMem yoki Redis). Havola
+o'zgarmaydi, shuning uchun brauzerga immutable va ETag bilan beriladi.
+"""
+import hashlib
+import io
+
+import qrcode
+from django.core.cache import cache
+from qrcode.image.svg import SvgPathImage
+
+CONTENT_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# Batch bir kun yashaydi — rasmni undan uzoq saqlash shart emas
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _digest(url, fmt):
+    return hashlib.sha256(f"{fmt}:{url}".encode()).hexdigest()[:32]
+
+
+def etag(url, fmt):
+    return f'"{_digest(url, fmt)}"'
+
+
+def render(url, fmt="png"):
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(url)
+    qr.make(fit=True)
+    if fmt == "svg":
+        img = qr.make_image(image_factory=SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+    buffered = io.BytesIO()
+    img.save(buffered)
+    return buffered.getvalue()
+
+
+def lookup(url, fmt):
+    """Keshdagi tayyor rasm yoki None."""
+    return cache.get(f"qr:{_digest(url, fmt)}")
+
+
+def fill(url, fmt):
+    data = render(url, fmt)
+    cache.set(f"qr:{_digest(url, fmt)}", data, CACHE_TIMEOUT)
+    return data
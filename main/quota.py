@@ -0,0 +1,108 @@
+"""
+Oylik yuklash limitlari (nechta batch yaratish mumkin).
+
+Har bir chunk yoki sahifa uchun COUNT so'rovi o'rniga hisoblagich keshda
+saqlanadi: kalit — oy + foydalanuvchi yoki IP. Batch yaratilganda
+(finalize_batch_view, batch_slot) hisoblagich atomar oshiriladi (cache.incr —
+Redisda INCR), kesh bo'sh bo'lsa bazadan qayta hisoblanadi. Kalit oy oxirida
+o'zi o'chadi.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import FileBatch
+
+USER_MONTHLY_BATCHES = 10
+GUEST_MONTHLY_BATCHES = 5
+
+
+def _month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ttl(now):
+    """Oy oxirigacha qolgan soniyalar (+ bir soat zaxira)."""
+    start = _month_start(now)
+    next_month = (start + timezone.timedelta(days=32)).replace(day=1)
+    return int((next_month - now).total_seconds()) + 3600
+
+
+def _key(now, user, ip):
+    who = f"u:{user.pk}" if user is not None and user.is_authenticated else f"ip:{ip}"
+    return f"quota:{now:%Y%m}:{who}"
+
+
+def _count_from_db(now, user, ip):
+    batches = FileBatch.objects.filter(created_at__gte=_month_start(now))
+    if user is not None and user.is_authenticated:
+        return batches.filter(owner=user).count()
+    return batches.filter(owner__isnull=True, ip_address=ip).count()
+
+
+def client_ip(request):
+    return request.META.get("REMOTE_ADDR")
+
+
+def limits(request):
+    """(oylik batchlar soni, fayl hajmi limiti, limit matni) foydalanuvchi turiga qarab."""
+    if request.user.is_authenticated:
+        return USER_MONTHLY_BATCHES, settings.TEZSHARE_USER_MAX_SIZE, settings.TEZSHARE_USER_LIMIT_MB
+    return GUEST_MONTHLY_BATCHES, settings.TEZSHARE_GUEST_MAX_SIZE, settings.TEZSHARE_GUEST_LIMIT_MB
+
+
+def used(request):
+    """Shu oyda yaratilgan batchlar soni (keshdan, bo'lmasa bazadan)."""
+    now = timezone.now()
+    key = _key(now, request.user, client_ip(request))
+    value = cache.get(key)
+    if value is None:
+        value = _count_from_db(now, request.user, client_ip(request))
+        # add: parallel so'rov allaqachon yozgan bo'lsa, uni bosib ketmaymiz
+        cache.add(key, value, _ttl(now))
+    return value
+
+
+def remaining(request):
+    return limits(request)[0] - used(request)
+
+
+@contextmanager
+def batch_slot(request):
+    """
+    Finalize uchun: oylik hisoblagichdan bitta batchni atomar band qiladi
+    (cache.incr — Redisda INCR). Limit sessiya ochilganda tekshiriladi,
+    lekin undan oldin ochilgan parallel sessiyalar birgalikda limitdan
+    oshmasligi uchun finalize ham shu yerdan o'tadi. Limit tugagan bo'lsa
+    False beriladi. Blok xato bilan tugasa (tranzaksiya bekor bo'ldi) —
+    band qilingan joy qaytariladi, yangi batch esa shu bilan hisobga olingan.
+    """
+    now = timezone.now()
+    user, ip = request.user, client_ip(request)
+    key = _key(now, user, ip)
+    used(request)  # kalit keshda bo'lmasa, bazadan to'ldiriladi
+    try:
+        value = cache.incr(key)
+    except ValueError:
+        value = _count_from_db(now, user, ip) + 1
+        cache.set(key, value, _ttl(now))
+
+    if value > limits(request)[0]:
+        _release(key)
+        yield False
+        return
+    try:
+        yield True
+    except BaseException:
+        _release(key)
+        raise
+
+
+def _release(key):
+    try:
+        cache.decr(key)
+    except ValueError:
+        # Kalit yo'q — keyingi so'rov bazadan qayta hisoblaydi
+        pass
@@ -0,0 +1,95 @@
+"""
+Выдача short_code без повторных попыток.
+
+Коды — это номера из общего счётчика (ShortCodeSequence), переставленные
+сетью Фейстеля с ключом от SECRET_KEY: соседние номера дают непохожие
+коды, а перестановка взаимно однозначна, поэтому коды не повторяются.
+36^6 = (36^3)^2, так что сеть работает ровно на пространстве кодов (две
+половины по 36^3) и cycle-walking не нужен.
+
+Процесс берёт у счётчика сразу блок номеров (два запроса на BLOCK_SIZE
+кодов) и одним запросом отбрасывает коды, занятые живыми батчами
+(старые случайные коды, а после полного круга счётчика — ещё не удалённые
+батчи). Коды удалённых батчей так и переиспользуются. Дальше выдача — из
+памяти, без обращения к базе.
+"""
+import hashlib
+import string
+import threading
+from collections import deque
+from functools import lru_cache
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.crypto import salted_hmac
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+HALF = len(ALPHABET) ** (CODE_LENGTH // 2)
+SPACE = HALF * HALF
+ROUNDS = 4
+# Не больше 999: столько параметров в одном запросе допускает SQLite
+BLOCK_SIZE = 500
+SALT = "tezshare.shortcodes"
+
+_pool = deque()
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _key():
+    return salted_hmac(SALT, "feistel", algorithm="sha256").digest()
+
+
+def _round(index, value):
+    digest = hashlib.blake2b(value.to_bytes(4, "big"), key=_key(), person=bytes([index]) * 16, digest_size=8)
+    return int.from_bytes(digest.digest(), "big") % HALF
+
+
+def permute(number):
+    """Перестановка [0, SPACE) -> [0, SPACE)."""
+    left, right = divmod(number, HALF)
+    for index in range(ROUNDS):
+        left, right = right, (left + _round(index, right)) % HALF
+    return left * HALF + right
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def reserve_block(size=BLOCK_SIZE):
+    """Забирает у счётчика size номеров и возвращает свободные коды из них."""
+    from .models import FileBatch, ShortCodeSequence
+
+    with transaction.atomic():
+        ShortCodeSequence.objects.filter(pk=1).update(next_value=F("next_value") + size)
+        end = ShortCodeSequence.objects.values_list("next_value", flat=True).get(pk=1)
+    codes = [encode(permute(number % SPACE)) for number in range(end - size, end)]
+    taken = set(FileBatch.objects.filter(short_code__in=codes).values_list("short_code", flat=True))
+    return [code for code in codes if code not in taken]
+
+
+def _extend(codes):
+    with _lock:
+        _pool.extend(codes)
+
+
+def allocate():
+    """Следующий свободный short_code."""
+    with _lock:
+        if _pool:
+            return _pool.popleft()
+
+    codes = []
+    while not codes:
+        codes = reserve_block()
+    code = codes.pop(0)
+    # Внутри транзакции блок можно раздавать только после её фиксации: при
+    # откате счётчик вернётся назад и те же номера получит другой процесс
+    transaction.on_commit(lambda: _extend(codes))
+    return code
@@ -0,0 +1,22 @@
+"""Yuklab olish sahifasi keshini eskirtish (main/pagecache.py)."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import pagecache
+from .models import FileBatch, SharedFile
+
+
+@receiver([post_save, post_delete], sender=FileBatch)
+def batch_changed(sender, instance, **kwargs):
+    pagecache.invalidate(instance.url_uuid)
+
+
+@receiver([post_save, post_delete], sender=SharedFile)
+def file_changed(sender, instance, **kwargs):
+    # Odatda batch obyekti allaqachon biriktirilgan — qo'shimcha so'rov yo'q
+    if SharedFile.batch.is_cached(instance):
+        url_uuid = instance.batch.url_uuid
+    else:
+        url_uuid = FileBatch.objects.filter(pk=instance.batch_id).values_list("url_uuid", flat=True).first()
+    if url_uuid is not None:
+        pagecache.invalidate(url_uuid)
@@ -0,0 +1,319 @@
+"""
+Пакетная очистка истёкших батчей.
+
+Вместо batch.delete() по одному (каскад, запрос файлов на каждый батч,
+os.remove по одному файлу) истёкшие ID выбираются страницами по индексу
+expires_at, строки удаляются двумя DELETE ... WHERE id IN (...) без
+каскадного сборщика, а файлы удаляются пулом потоков.
+
+Очистки могут идти одновременно (задача перезапускает себя, beat,
+удаление батча по одному), поэтому страница удаляется в одной транзакции:
+батчи блокируются (select_for_update), файлы перечитываются уже под
+блокировкой, и ссылки общих блобов (main/blobs.py) уменьшаются только на
+строки, удалённые этой транзакцией. Второй процесс дождётся блокировки и
+не найдёт строк. Файлы на диске удаляются после фиксации (on_commit): при
+откате строки не указывают на уже удалённые файлы.
+Админка удаляет батчи и отдельные файлы тем же путём (delete_batches,
+delete_files): каскад Django не уменьшал бы ссылки блобов.
+
+Там же сборка мусора, который не привязан к батчам: брошенные загрузки в
+temp_uploads (collect_uploads) и QR-коды удалённых батчей (collect_qr_codes).
+Время последней активности загрузки — самое позднее из
+ChunkedUpload.updated_at и mtime её файлов: чанки с токеном сессии базу не
+трогают, но файлы обновляют.
+"""
+import logging
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import blobs, plaincache, uploads
+from .models import Blob, ChunkedUpload, FileBatch, SharedFile
+
+logger = logging.getLogger(__name__)
+
+QR_PREFIX = "qr_"
+QR_SUFFIX = ".png"
+
+
+def _unlink(path):
+    """Удаляет файл и возвращает освобождённые байты (0, если файла уже нет)."""
+    try:
+        size = os.stat(path).st_size
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        logger.error(f"Не удалось удалить {path}: {e}")
+        return 0
+
+
+def _unlink_all(paths, pool):
+    try:
+        return sum(pool.map(_unlink, paths))
+    except RuntimeError:
+        # Внешняя транзакция зафиксировалась уже после закрытия пула
+        return sum(map(_unlink, paths))
+
+
+def _raw_delete(queryset):
+    # Один DELETE без загрузки объектов и без сигналов — каскад делаем сами
+    return queryset._raw_delete(queryset.db)
+
+
+def _release_files(rows):
+    """
+    После удаления строк SharedFile (id, file, blob_id): уменьшает ссылки
+    блобов на эти строки и возвращает пути файлов, которые нужно удалить
+    (свои файлы, копии в кеше nginx, блобы без ссылок).
+    """
+    refs = Counter(blob_id for _, _, blob_id in rows if blob_id)
+    for blob_id, count in refs.items():
+        Blob.objects.filter(pk=blob_id).update(ref_count=F("ref_count") - count)
+
+    paths = [default_storage.path(name) for _, name, blob_id in rows if name and not blob_id]
+    # Расшифрованные копии в кеше nginx (main/plaincache.py)
+    paths += [plaincache.entry_path(plaincache.file_entry(file_id)) for file_id, _, _ in rows]
+    if refs:
+        paths += blobs.release_orphans(refs.keys(), unlink=False)
+    return paths
+
+
+def delete_batches(batch_ids, pool):
+    """
+    Удаляет батчи и их файлы. Возвращает (батчей, файлов, байт); байты
+    считаются при удалении файлов, то есть после фиксации — внутри внешней
+    транзакции они ещё не известны (0).
+    """
+    freed = []
+    with transaction.atomic():
+        locked = list(
+            FileBatch.objects.select_for_update()
+            .filter(id__in=batch_ids)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        if not locked:
+            return 0, 0, 0
+        rows = list(
+            SharedFile.objects.filter(batch_id__in=locked).values_list("id", "file", "blob_id")
+        )
+        files = _raw_delete(SharedFile.objects.filter(batch_id__in=locked))
+        batches = _raw_delete(FileBatch.objects.filter(id__in=locked))
+
+        paths = _release_files(rows)
+        paths += [plaincache.entry_path(plaincache.zip_entry(batch_id)) for batch_id in locked]
+        transaction.on_commit(lambda: freed.append(_unlink_all(paths, pool)))
+
+    return batches, files, sum(freed)
+
+
+def delete_files(file_ids, pool):
+    """
+    Удаляет отдельные файлы батчей (админка) так же, как delete_batches:
+    строки блокируются, ссылки блобов уменьшаются только на удалённые
+    строки. Возвращает (файлов, байт).
+    """
+    freed = []
+    with transaction.atomic():
+        locked = list(
+            SharedFile.objects.select_for_update()
+            .filter(id__in=file_ids)
+            .order_by("id")
+            .values_list("id", "file", "blob_id", "batch_id")
+        )
+        if not locked:
+            return 0, 0
+        files = _raw_delete(SharedFile.objects.filter(id__in=[row[0] for row in locked]))
+
+        paths = _release_files([row[:3] for row in locked])
+        # ZIP батча собран и с удалённым файлом
+        paths += [plaincache.entry_path(plaincache.zip_entry(batch_id)) for batch_id in {row[3] for row in locked}]
+        transaction.on_commit(lambda: freed.append(_unlink_all(paths, pool)))
+
+    return files, sum(freed)
+
+
+def sweep(now=None, page_size=None, max_seconds=None, pause=None, workers=None):
+    """
+    Удаляет истёкшие батчи страницами по page_size. Останавливается, когда
+    истёкших не осталось или истёк бюджет max_seconds (тогда remaining=True
+    и задачу можно просто запустить снова). pause — пауза между страницами,
+    чтобы не забивать диск и базу.
+    """
+    now = now or timezone.now()
+    page_size = page_size or settings.TEZSHARE_SWEEP_PAGE_SIZE
+    max_seconds = settings.TEZSHARE_SWEEP_MAX_SECONDS if max_seconds is None else max_seconds
+    pause = settings.TEZSHARE_SWEEP_PAUSE if pause is None else pause
+    workers = workers or settings.TEZSHARE_SWEEP_WORKERS
+
+    started = time.monotonic()
+    totals = Counter()
+    remaining = False
+    expired = FileBatch.objects.filter(expires_at__lt=now).order_by("expires_at", "id")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            ids = list(expired.values_list("id", flat=True)[:page_size])
+            if not ids:
+                break
+            batches, files, freed = delete_batches(ids, pool)
+            totals.update(batches=batches, files=files, bytes=freed)
+
+            if max_seconds and time.monotonic() - started >= max_seconds:
+                remaining = expired.exists()
+                break
+            if pause:
+                time.sleep(pause)
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    report = {
+        "batches": totals["batches"],
+        "files": totals["files"],
+        "bytes": totals["bytes"],
+        "seconds": round(elapsed, 2),
+        "batches_per_s": round(totals["batches"] / elapsed, 1),
+        "files_per_s": round(totals["files"] / elapsed, 1),
+        "bytes_per_s": round(totals["bytes"] / elapsed),
+        "remaining": remaining,
+    }
+    logger.info(f"Очистка: {report}")
+    return report
+
+
+def _disk_free():
+    return shutil.disk_usage(settings.MEDIA_ROOT).free
+
+
+def _scan_temp_uploads():
+    """
+    Файлы temp_uploads, сгруппированные по upload_id (вместе с .map, .sums и .claims):
+    {upload_id: [последнее изменение, занято байт, [пути]]}.
+    """
+    groups = {}
+    try:
+        scan = list(os.scandir(uploads.temp_dir()))
+    except FileNotFoundError:
+        return groups
+    for entry in scan:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        name = entry.name
+        for suffix in (uploads.MAP_SUFFIX, uploads.SUMS_SUFFIX, uploads.CLAIMS_SUFFIX):
+            if name.endswith(suffix):
+                name = name[: -len(suffix)]
+        group = groups.setdefault(name, [0, 0, []])
+        group[0] = max(group[0], stat.st_mtime)
+        # Файлы разреженные: считаем реально занятые блоки, а не размер
+        group[1] += stat.st_blocks * 512
+        group[2].append(entry.path)
+    return groups
+
+
+def _drop_uploads(upload_ids, groups):
+    freed = 0
+    for upload_id in upload_ids:
+        if upload_id in groups:
+            freed += groups[upload_id][1]
+            for path in groups[upload_id][2]:
+                _unlink(path)
+    ChunkedUpload.objects.filter(upload_id__in=upload_ids).delete()
+    return freed
+
+
+def collect_uploads(max_age=None, min_free=None, pressure_age=None):
+    """
+    Удаляет загрузки без активности дольше max_age (строку ChunkedUpload и
+    файлы) и файлы без строки старше pressure_age. Если свободного места
+    меньше min_free — дополнительно удаляет самые старые из оставшихся
+    загрузок (не моложе pressure_age), пока место не освободится.
+    """
+    max_age = settings.TEZSHARE_STALE_UPLOAD_AGE if max_age is None else max_age
+    min_free = settings.TEZSHARE_GC_MIN_FREE_BYTES if min_free is None else min_free
+    pressure_age = settings.TEZSHARE_GC_PRESSURE_AGE if pressure_age is None else pressure_age
+    now = time.time()
+
+    groups = _scan_temp_uploads()
+    rows = dict(ChunkedUpload.objects.values_list("upload_id", "updated_at"))
+    last_seen = {upload_id: groups.get(upload_id, [0])[0] for upload_id in groups.keys() | rows.keys()}
+    for upload_id, updated_at in rows.items():
+        last_seen[upload_id] = max(last_seen[upload_id], updated_at.timestamp())
+
+    stale = [
+        upload_id
+        for upload_id, seen in last_seen.items()
+        if now - seen > (max_age if upload_id in rows else pressure_age)
+    ]
+    freed = _drop_uploads(stale, groups)
+    report = {"uploads": len(stale), "bytes": freed, "pressure": False}
+
+    free = _disk_free()
+    if free >= min_free:
+        return report
+
+    report["pressure"] = True
+    dropped = set(stale)
+    candidates = sorted(
+        (seen, upload_id)
+        for upload_id, seen in last_seen.items()
+        if upload_id not in dropped and upload_id in groups and now - seen > pressure_age
+    )
+    for _, upload_id in candidates:
+        if free >= min_free:
+            break
+        freed = _drop_uploads([upload_id], groups)
+        report["uploads"] += 1
+        report["bytes"] += freed
+        free = _disk_free()
+    if free < min_free:
+        logger.warning(f"Мало места на диске: свободно {free} байт при пороге {min_free}")
+    return report
+
+
+def collect_qr_codes(grace=None):
+    """
+    Удаляет media/qr_codes/qr_<uuid>.png, если батча с таким url_uuid уже нет.
+    Новые QR-коды на диск не пишутся (main/qr.py), здесь дочищаются старые.
+    """
+    grace = settings.TEZSHARE_GC_PRESSURE_AGE if grace is None else grace
+    now = time.time()
+    qr_dir = os.path.join(settings.MEDIA_ROOT, "qr_codes")
+    try:
+        scan = list(os.scandir(qr_dir))
+    except FileNotFoundError:
+        return 0
+
+    candidates = {}
+    for entry in scan:
+        if not (entry.name.startswith(QR_PREFIX) and entry.name.endswith(QR_SUFFIX)):
+            continue
+        try:
+            batch_uuid = uuid.UUID(entry.name[len(QR_PREFIX) : -len(QR_SUFFIX)])
+            if now - entry.stat().st_mtime > grace:
+                candidates[batch_uuid] = entry.path
+        except (ValueError, FileNotFoundError):
+            continue
+
+    removed = 0
+    page_size = settings.TEZSHARE_SWEEP_PAGE_SIZE
+    uuids = list(candidates)
+    for start in range(0, len(uuids), page_size):
+        page = uuids[start : start + page_size]
+        alive = set(FileBatch.objects.filter(url_uuid__in=page).values_list("url_uuid", flat=True))
+        for batch_uuid in page:
+            if batch_uuid not in alive:
+                _unlink(candidates[batch_uuid])
+                removed += 1
+    return removed
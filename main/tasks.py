@@ -1,10 +1,14 @@
 import logging
 import os
 import os
-from celery import shared_task
+from concurrent.futures import ThreadPoolExecutor
+from celery import chord, shared_task
 from cryptography.fernet import Fernet
-from django.core.files.base import ContentFile
+from django.db import transaction
+from django.core.files import File
 from django.conf import settings
+from . import blobs, codefilter, pagecache, plaincache, sweeper, uploads
+from .crypto import StreamReader, encrypt_stream
 from .models import FileBatch, SharedFile, ChunkedUpload
 from celery import shared_task
 from django.utils import timezone
@@ -14,29 +18,25 @@ from .models import FileBatch
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def cleanup_expired_files():
+@shared_task(bind=True)
+def cleanup_expired_files(self):
     """
-    Периодическая задача: удаляет все батчи, время жизни которых истекло.
+    Периодическая задача: удаляет все батчи, время жизни которых истекло
+    (пакетно, см. main/sweeper.py). Если не уложились в бюджет времени —
+    задача ставит себя в очередь снова и продолжает с того же места.
     """
-    now = timezone.now()
-    expired_batches = FileBatch.objects.filter(expires_at__lt=now)
-
-    count = 0
-    for batch in expired_batches:
-        # Удаляем файлы с диска
-        for shared_file in batch.files.all():
-            if shared_file.file and os.path.isfile(shared_file.file.path):
-                try:
-                    os.remove(shared_file.file.path)
-                except Exception as e:
-                    logger.error(f"Ошибка при удалении файла {shared_file.id}: {e}")
+    report = sweeper.sweep()
+    if report["remaining"]:
+        self.apply_async(countdown=settings.TEZSHARE_SWEEP_PAUSE)
 
-        # Удаляем запись из БД (SharedFile удалятся каскадом)
-        batch.delete()
-        count += 1
-
-    return f"Cleanup finished: {count} batches removed."
+    stats = blobs.dedup_stats()
+    return (
+        f"Cleanup finished: {report['batches']} batches, {report['files']} files, "
+        f"{report['bytes']} bytes removed in {report['seconds']}s "
+        f"({report['batches_per_s']} batches/s, {report['files_per_s']} files/s, "
+        f"{report['bytes_per_s']} B/s). "
+        f"Dedup ratio {stats['ratio']} ({stats['saved_bytes']} bytes saved)."
+    )
 
 
 @shared_task
@@ -45,65 +45,149 @@ def delete_batch_files_task(batch_id):
     Фоновая задача для немедленного удаления файлов батча
     (например, после полной выгрузки ZIP или по нажатию кнопки).
     """
-    try:
-        batch = FileBatch.objects.get(id=batch_id)
-        for shared_file in batch.files.all():
-            if shared_file.file and os.path.isfile(shared_file.file.path):
-                os.remove(shared_file.file.path)
-        batch.delete()
+    with ThreadPoolExecutor(max_workers=settings.TEZSHARE_SWEEP_WORKERS) as pool:
+        batches, _, _ = sweeper.delete_batches([batch_id], pool)
+    if batches:
         return f"Batch {batch_id} deleted successfully."
-    except FileBatch.DoesNotExist:
-        return f"Batch {batch_id} already deleted."
+    return f"Batch {batch_id} already deleted."
 
 
 @shared_task
 def cleanup_files():
-    expired = FileBatch.objects.filter(expires_at__lt=timezone.now())
-    for batch in expired:
-        for f in batch.files.all():
-            if os.path.exists(f.file.path):
-                os.remove(f.file.path)
-        batch.delete()
+    # Старое имя задачи (могло остаться в расписании) — та же пакетная очистка
+    return sweeper.sweep()
+
+
+@shared_task
+def collect_garbage():
+    """
+    Периодическая задача: брошенные загрузки в temp_uploads и QR-коды
+    удалённых батчей (main/sweeper.py). При нехватке места на диске
+    удаляет брошенные загрузки, начиная с самых старых.
+    """
+    report = sweeper.collect_uploads()
+    qr_removed = sweeper.collect_qr_codes()
+    return (
+        f"GC finished: {report['uploads']} uploads ({report['bytes']} bytes), "
+        f"{qr_removed} QR codes removed"
+        + (" under disk pressure." if report["pressure"] else ".")
+    )
+
+
+@shared_task
+def rebuild_code_filter():
+    """Перестраивает фильтр кодов (main/codefilter.py): истёкшие коды выпадают."""
+    codefilter.rebuild()
+    return "Code filter rebuilt."
+
+
+@shared_task
+def evict_plain_cache():
+    """Чистит кеш расшифрованных файлов (main/plaincache.py) по TTL и размеру."""
+    removed = plaincache.evict()
+    return f"Plain cache eviction: {removed} files removed."
 
 
 # main/tasks.py (или users/tasks.py)
 
 
+def _store_deduplicated(shared_file, temp_path):
+    """Уже известное содержимое не шифруем повторно — только ссылка на блоб."""
+    blob = blobs.find(shared_file.file_hash)
+    encrypted_path = None
+    if blob is None:
+        key = Fernet.generate_key()
+        encrypted_path = f"{temp_path}.enc"
+        with open(temp_path, "rb") as src, open(encrypted_path, "wb") as dst:
+            for piece in encrypt_stream(key, src):
+                dst.write(piece)
+
+    with transaction.atomic():
+        if encrypted_path:
+            blobs.store_encrypted(
+                shared_file, encrypted_path, shared_file.file_hash, shared_file.file_size, key
+            )
+        else:
+            blobs.attach(shared_file, blob)
+
+
+def _encrypt_upload(batch, item):
+    """
+    Шифрует один временный файл потоково по кадрам (main/crypto.py) и пишет
+    прямо в хранилище, поэтому память воркера не зависит от размера файла.
+    """
+    safe_up_id = os.path.basename(item['up_id'])
+    temp_path = uploads.temp_path(safe_up_id)
+    if not os.path.exists(temp_path):
+        return False
+
+    file_size = os.path.getsize(temp_path)
+    shared_file = SharedFile(
+        batch=batch,
+        original_name=item['real_name'],
+        file_size=file_size,
+        # Хеш уже посчитан по листьям при приёме чанков
+        file_hash=uploads.file_hash(temp_path, file_size),
+    )
+    if blobs.enabled() and shared_file.file_hash:
+        _store_deduplicated(shared_file, temp_path)
+    else:
+        with open(temp_path, "rb") as f:
+            encrypted = StreamReader(encrypt_stream(batch.encryption_key, f))
+            shared_file.file.save(f"{safe_up_id}.enc", File(encrypted), save=False)
+    shared_file.save()
+
+    # Чистим временные данные
+    uploads.discard(temp_path)
+    ChunkedUpload.objects.filter(upload_id=safe_up_id).delete()
+    return True
+
+
+@shared_task
+def encrypt_upload_task(batch_id, item):
+    """
+    Шифрует один файл батча. Запускается параллельно для всех файлов
+    (chord), файл доступен для скачивания сразу после своей задачи.
+    """
+    try:
+        batch = FileBatch.objects.get(id=batch_id)
+        return _encrypt_upload(batch, item)
+    except Exception as e:
+        logger.error(f"Ошибка шифрования {item.get('up_id')} (batch {batch_id}): {e}")
+        return False
+
+
+@shared_task
+def mark_batch_ready_task(results, batch_id):
+    """Завершение chord: все файлы обработаны — батч готов (или с ошибкой)."""
+    status = FileBatch.Status.READY if all(results) else FileBatch.Status.FAILED
+    FileBatch.objects.filter(id=batch_id).update(status=status)
+    # update() не отправляет сигналы — кеш страницы скачивания сбрасываем сами
+    url_uuid = FileBatch.objects.filter(id=batch_id).values_list("url_uuid", flat=True).first()
+    if url_uuid is not None:
+        pagecache.invalidate(url_uuid)
+    return f"Batch {batch_id}: {status}"
+
+
+def dispatch_batch_encryption(batch_id, upload_ids_data):
+    """Каждый файл — отдельная задача, chord отмечает батч готовым."""
+    return chord(
+        encrypt_upload_task.s(batch_id, item) for item in upload_ids_data
+    )(mark_batch_ready_task.s(batch_id))
+
+
 @shared_task
 def encrypt_files_background_task(batch_id, upload_ids_data):
     """
     Фоновое шифрование:
     upload_ids_data — это список словарей [{'up_id': '...', 'real_name': '...'}]
+
+    Последовательный вариант; новые батчи идут через dispatch_batch_encryption.
     """
     try:
         batch = FileBatch.objects.get(id=batch_id)
-        cipher = Fernet(batch.encryption_key)
-
-        for item in upload_ids_data:
-            up_id = item['up_id']
-            real_filename = item['real_name']
-            
-            safe_up_id = os.path.basename(up_id)
-            temp_path = os.path.join(settings.MEDIA_ROOT, "temp_uploads", safe_up_id)
-
-            if os.path.exists(temp_path):
-                with open(temp_path, "rb") as f:
-                    raw_data = f.read()
-                
-                # Шифруем в отдельном процессе Celery
-                encrypted_data = cipher.encrypt(raw_data)
-                
-                SharedFile.objects.create(
-                    batch=batch,
-                    file=ContentFile(encrypted_data, name=f"{safe_up_id}.enc"),
-                    original_name=real_filename,
-                    file_size=len(encrypted_data)
-                )
-                
-                # Чистим временные данные
-                os.remove(temp_path)
-                ChunkedUpload.objects.filter(upload_id=safe_up_id).delete()
-        
+        results = [_encrypt_upload(batch, item) for item in upload_ids_data]
+        mark_batch_ready_task(results, batch_id)
         return f"Batch {batch_id} successfully encrypted."
     except Exception as e:
-        return f"Error encrypting batch {batch_id}: {str(e)}"
\ No newline at end of file
+        return f"Error encrypting batch {batch_id}: {str(e)}"
@@ -3,6 +3,61 @@ import os
 
 register = template.Library()
 
+ICON_MAP = {
+    # Изображения
+    'jpg': 'fas fa-file-image', 'jpeg': 'fas fa-file-image', 'png': 'fas fa-file-image',
+    'gif': 'fas fa-file-image', 'svg': 'fas fa-file-image', 'webp': 'fas fa-file-image',
+    'bmp': 'fas fa-file-image', 'ico': 'fas fa-file-image',
+    
+    # Видео
+    'mp4': 'fas fa-file-video', 'avi': 'fas fa-file-video', 'mov': 'fas fa-file-video',
+    'mkv': 'fas fa-file-video', 'wmv': 'fas fa-file-video', 'flv': 'fas fa-file-video',
+    'webm': 'fas fa-file-video',
+    
+    # Аудио
+    'mp3': 'fas fa-file-audio', 'wav': 'fas fa-file-audio', 'flac': 'fas fa-file-audio',
+    'aac': 'fas fa-file-audio', 'ogg': 'fas fa-file-audio', 'm4a': 'fas fa-file-audio',
+    'wma': 'fas fa-file-audio',
+    
+    # Документы
+    'pdf': 'fas fa-file-pdf', 'doc': 'fas fa-file-word', 'docx': 'fas fa-file-word',
+    'xls': 'fas fa-file-excel', 'xlsx': 'fas fa-file-excel',
+    'ppt': 'fas fa-file-powerpoint', 'pptx': 'fas fa-file-powerpoint',
+    
+    # Архивы
+    'zip': 'fas fa-file-archive', 'rar': 'fas fa-file-archive', '7z': 'fas fa-file-archive',
+    'tar': 'fas fa-file-archive', 'gz': 'fas fa-file-archive', 'bz2': 'fas fa-file-archive',
+    'xz': 'fas fa-file-archive',
+    
+    # Код
+    'html': 'fas fa-file-code', 'css': 'fas fa-file-code', 'js': 'fas fa-file-code',
+    'py': 'fas fa-file-code', 'json': 'fas fa-file-code', 'xml': 'fas fa-file-code',
+    'php': 'fas fa-file-code', 'cpp': 'fas fa-file-code', 'java': 'fas fa-file-code',
+    
+    # Текст
+    'txt': 'fas fa-file-alt', 'md': 'fas fa-file-alt', 'csv': 'fas fa-file-csv',
+}
+
+# Уже сжатые форматы: в ZIP кладём как есть (stored), повторный deflate только тратит CPU
+_PRECOMPRESSED_ICONS = {
+    'fas fa-file-image', 'fas fa-file-video', 'fas fa-file-audio', 'fas fa-file-archive',
+}
+_UNCOMPRESSED_EXTENSIONS = {'bmp', 'svg', 'ico', 'wav', 'tar'}
+PRECOMPRESSED_EXTENSIONS = {
+    ext for ext, icon in ICON_MAP.items()
+    if icon in _PRECOMPRESSED_ICONS and ext not in _UNCOMPRESSED_EXTENSIONS
+} | {'docx', 'xlsx', 'pptx'}
+
+
+def file_extension(filename):
+    return filename.split('.')[-1].lower() if filename and '.' in filename else ''
+
+
+def is_precompressed(filename):
+    """True, если файл уже сжат и его не стоит сжимать в ZIP повторно."""
+    return file_extension(filename) in PRECOMPRESSED_EXTENSIONS
+
+
 @register.filter
 def mul(value, arg):
     """
@@ -23,44 +78,9 @@ def file_icon(filename):
     if not filename:
         return 'fas fa-file'
     
-    ext = filename.split('.')[-1].lower() if '.' in filename else ''
-    
-    icon_map = {
-        # Изображения
-        'jpg': 'fas fa-file-image', 'jpeg': 'fas fa-file-image', 'png': 'fas fa-file-image',
-        'gif': 'fas fa-file-image', 'svg': 'fas fa-file-image', 'webp': 'fas fa-file-image',
-        'bmp': 'fas fa-file-image', 'ico': 'fas fa-file-image',
-        
-        # Видео
-        'mp4': 'fas fa-file-video', 'avi': 'fas fa-file-video', 'mov': 'fas fa-file-video',
-        'mkv': 'fas fa-file-video', 'wmv': 'fas fa-file-video', 'flv': 'fas fa-file-video',
-        'webm': 'fas fa-file-video',
-        
-        # Аудио
-        'mp3': 'fas fa-file-audio', 'wav': 'fas fa-file-audio', 'flac': 'fas fa-file-audio',
-        'aac': 'fas fa-file-audio', 'ogg': 'fas fa-file-audio', 'm4a': 'fas fa-file-audio',
-        'wma': 'fas fa-file-audio',
-        
-        # Документы
-        'pdf': 'fas fa-file-pdf', 'doc': 'fas fa-file-word', 'docx': 'fas fa-file-word',
-        'xls': 'fas fa-file-excel', 'xlsx': 'fas fa-file-excel',
-        'ppt': 'fas fa-file-powerpoint', 'pptx': 'fas fa-file-powerpoint',
-        
-        # Архивы
-        'zip': 'fas fa-file-archive', 'rar': 'fas fa-file-archive', '7z': 'fas fa-file-archive',
-        'tar': 'fas fa-file-archive', 'gz': 'fas fa-file-archive', 'bz2': 'fas fa-file-archive',
-        'xz': 'fas fa-file-archive',
-        
-        # Код
-        'html': 'fas fa-file-code', 'css': 'fas fa-file-code', 'js': 'fas fa-file-code',
-        'py': 'fas fa-file-code', 'json': 'fas fa-file-code', 'xml': 'fas fa-file-code',
-        'php': 'fas fa-file-code', 'cpp': 'fas fa-file-code', 'java': 'fas fa-file-code',
-        
-        # Текст
-        'txt': 'fas fa-file-alt', 'md': 'fas fa-file-alt', 'csv': 'fas fa-file-csv',
-    }
+    ext = file_extension(filename)
     
-    return icon_map.get(ext, 'fas fa-file')
+    return ICON_MAP.get(ext, 'fas fa-file')
 
 
 @register.filter
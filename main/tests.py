@@ -1,3 +1,708 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .crypto import HEADER_SIZE, TAG_SIZE, DecryptedFile, DecryptionError, encrypt_stream
+from . import async_views, blobs, codefilter, quota, shortcodes, sweeper, uploads
+from .models import Blob, ChunkedUpload, FileBatch, SharedFile, ShortCodeSequence
+from .utils import HASH_LEAF_SIZE, TreeHasher
+from .views import MY_FILES_PAGE_SIZE
+from .zipstream import ZipStream
+
+
+class MyFilesQueryCountTests(TestCase):
+    """my_files_view: so'rovlar soni batchlar soniga bog'liq emas (N+1 yo'q)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="owner", email="owner@example.com", password="x")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _create_batches(self, count, files_per_batch=3):
+        for _ in range(count):
+            number = FileBatch.objects.count()
+            batch = FileBatch.objects.create(
+                owner=self.user,
+                encryption_key=b"key",
+                short_code=f"T{number:05d}",
+                expires_at=timezone.now() + timezone.timedelta(days=1),
+            )
+            if number % 2:
+                batch.set_batch_password("secret")
+                batch.save()
+            SharedFile.objects.bulk_create(
+                SharedFile(batch=batch, file=f"encrypted_uploads/{batch.id}_{i}.enc", original_name=f"{i}.txt")
+                for i in range(files_per_batch)
+            )
+
+    def _get_my_files(self):
+        return self.client.get(reverse("my_files"), secure=True)
+
+    def test_query_count_does_not_grow_with_batches(self):
+        self._create_batches(2)
+        with CaptureQueriesContext(connection) as baseline:
+            self.assertEqual(self._get_my_files().status_code, 200)
+
+        self._create_batches(40)
+        with self.assertNumQueries(len(baseline)):
+            response = self._get_my_files()
+
+        self.assertEqual(response.context["total_batches"], 42)
+        self.assertEqual(response.context["total_files_count"], 126)
+        self.assertEqual(response.context["password_count"], 21)
+        self.assertEqual(response.context["batches"][0].file_count, 3)
+        # Sahifalash: bitta sahifada cheklangan miqdordagi batch
+        self.assertEqual(len(response.context["batches"]), MY_FILES_PAGE_SIZE)
+
+
+class DownloadPageCacheTests(TestCase):
+    """download_page_view: issiq havola bazaga bormaydi, o'zgarishda kesh eskiradi."""
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.batch = FileBatch.objects.create(
+                encryption_key=b"key",
+                expires_at=timezone.now() + timezone.timedelta(days=1),
+            )
+            SharedFile.objects.create(batch=self.batch, file="encrypted_uploads/a.enc", original_name="a.txt")
+        self.url = reverse("download_page", args=[self.batch.url_uuid])
+
+    def test_hot_link_makes_no_queries(self):
+        self.client.get(self.url, secure=True)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["files"]), 1)
+        self.assertContains(response, timezone.localtime().strftime("%d.%m.%Y"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, secure=True, headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_file_invalidates_page(self):
+        etag = self.client.get(self.url, secure=True)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            SharedFile.objects.create(batch=self.batch, file="encrypted_uploads/b.enc", original_name="b.txt")
+
+        response = self.client.get(self.url, secure=True, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["files"]), 2)
+
+
+class FrameCryptoTests(SimpleTestCase):
+    """main/crypto.py: kadrli shifrlash — aylanma va buzilishni aniqlash."""
+
+    FRAME = 1024
+
+    def _encrypt(self, data):
+        key = Fernet.generate_key()
+        return key, b"".join(encrypt_stream(key, io.BytesIO(data), frame_size=self.FRAME))
+
+    def _decrypt(self, key, stored, start=0, end=None):
+        return b"".join(DecryptedFile(key, io.BytesIO(stored), len(stored)).iter_range(start, end))
+
+    def test_round_trip(self):
+        for size in (0, 1, self.FRAME, self.FRAME + 1, 5 * self.FRAME + 7):
+            data = os.urandom(size)
+            key, stored = self._encrypt(data)
+            self.assertEqual(self._decrypt(key, stored), data)
+            # Diapazon kadr chegaralarini kesib o'tadi
+            self.assertEqual(self._decrypt(key, stored, 3, size - 3), data[3 : size - 3])
+
+    def test_tampered_frame_is_rejected(self):
+        key, stored = self._encrypt(os.urandom(3 * self.FRAME))
+        tampered = bytearray(stored)
+        tampered[len(stored) // 2] ^= 1
+        with self.assertRaises(DecryptionError):
+            self._decrypt(key, bytes(tampered))
+
+    def test_truncated_and_reordered_frames_are_rejected(self):
+        key, stored = self._encrypt(os.urandom(3 * self.FRAME))
+        header, sealed = stored[:HEADER_SIZE], self.FRAME + TAG_SIZE
+        frames = [stored[HEADER_SIZE + i * sealed : HEADER_SIZE + (i + 1) * sealed] for i in range(3)]
+        with self.assertRaises(DecryptionError):
+            self._decrypt(key, header + frames[0] + frames[1])
+        with self.assertRaises(DecryptionError):
+            self._decrypt(key, header + frames[1] + frames[0] + frames[2])
+
+    def test_wrong_key_is_rejected(self):
+        _, stored = self._encrypt(b"secret")
+        with self.assertRaises(DecryptionError):
+            self._decrypt(Fernet.generate_key(), stored)
+
+
+def _create_encrypted_file(batch, name, data):
+    """Batchga kadrli shifrlangan fayl qo'shadi (diskka, MEDIA_ROOT ichida)."""
+    hasher = TreeHasher()
+    hasher.update(data)
+    shared_file = SharedFile(batch=batch, original_name=name, file_size=len(data), file_hash=hasher.hexdigest())
+    stored = b"".join(encrypt_stream(batch.encryption_key, io.BytesIO(data)))
+    shared_file.file.save(f"{name}.enc", ContentFile(stored), save=False)
+    shared_file.save()
+    return shared_file
+
+
+class RangeDownloadTests(TestCase):
+    """decrypt_file_view: Range va If-Range bo'yicha qisman javoblar."""
+
+    def setUp(self):
+        self.batch = FileBatch.objects.create(
+            encryption_key=Fernet.generate_key(),
+            expires_at=timezone.now() + timezone.timedelta(days=1),
+        )
+        self.data = os.urandom(200_000)
+        self.shared_file = _create_encrypted_file(self.batch, "video.bin", self.data)
+        self.addCleanup(self.shared_file.file.delete, save=False)
+        self.url = reverse("decrypt_file", args=[self.shared_file.id])
+
+    def _get(self, **headers):
+        response = self.client.get(self.url, secure=True, headers=headers)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_download(self):
+        response, body = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(int(response["Content-Length"]), len(self.data))
+        self.assertEqual(body, self.data)
+
+    def test_byte_ranges(self):
+        response, body = self._get(Range="bytes=70000-140000")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 70000-140000/{len(self.data)}")
+        self.assertEqual(body, self.data[70000:140001])
+
+        response, body = self._get(Range="bytes=-10")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[-10:])
+
+    def test_unsatisfiable_range(self):
+        response, _ = self._get(Range=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.data)}")
+
+    def test_if_range(self):
+        etag = self._get()[0]["ETag"]
+        response, body = self._get(Range="bytes=0-9", **{"If-Range": etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.data[:10])
+
+        # Fayl o'zgargan (boshqa ETag) — butun fayl qaytadi
+        response, body = self._get(Range="bytes=0-9", **{"If-Range": '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.data)
+
+
+class ZipStreamTests(SimpleTestCase):
+    """ZipStream arxivi standart zipfile bilan o'qiladi (ZIP64 ham)."""
+
+    def _build(self, entries, **kwargs):
+        stream = ZipStream()
+        parts = []
+        for name, data, size in entries:
+            parts.extend(stream.add(name, [data[:1000], data[1000:]], size=size, **kwargs))
+        parts.extend(stream.finish())
+        return zipfile.ZipFile(io.BytesIO(b"".join(parts)))
+
+    def test_regular_and_unknown_size_entries(self):
+        data = os.urandom(5000)
+        text = "salom dunyo\n".encode() * 500
+        archive = self._build([
+            ("random.bin", data, len(data)),
+            ("matn/fayl.txt", text, None),
+            ("bo'sh.txt", b"", 0),
+        ])
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ["random.bin", "matn/fayl.txt", "bo'sh.txt"])
+        self.assertEqual(archive.read("random.bin"), data)
+        self.assertEqual(archive.read("matn/fayl.txt"), text)
+        self.assertEqual(archive.read("bo'sh.txt"), b"")
+
+    def test_zip64_entry_count(self):
+        # 0xFFFF dan ko'p yozuv — ZIP64 yakuniy yozuvlari majburiy
+        count = 0xFFFF + 10
+        archive = self._build(
+            [(f"{i}.txt", str(i).encode(), None if i % 2 else len(str(i))) for i in range(count)],
+            compress=False,
+        )
+        self.assertEqual(len(archive.infolist()), count)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read(f"{count - 1}.txt"), str(count - 1).encode())
+
+
+class SweeperRefcountTests(TestCase):
+    """Bir-birini qoplagan tozalashlar umumiy blob ssilkalarini ikki marta kamaytirmaydi."""
+
+    def setUp(self):
+        now = timezone.now()
+        self.expired = FileBatch.objects.create(encryption_key=Fernet.generate_key(), expires_at=now - timezone.timedelta(hours=1))
+        self.live = FileBatch.objects.create(encryption_key=Fernet.generate_key(), expires_at=now + timezone.timedelta(days=1))
+        self.blob = Blob.objects.create(content_hash="ab" * 32, size=3, encryption_key=Fernet.generate_key(), ref_count=2)
+        self.blob.file.save("shared.enc", ContentFile(b"enc"), save=True)
+        self.addCleanup(self.blob.file.delete, save=False)
+        for batch in (self.expired, self.live):
+            SharedFile.objects.create(batch=batch, original_name="a.txt", file=self.blob.file.name, blob=self.blob)
+
+    def test_overlapping_runs(self):
+        ids = [self.expired.id]
+        with ThreadPoolExecutor(max_workers=2) as pool, self.captureOnCommitCallbacks(execute=True):
+            first = sweeper.delete_batches(ids, pool)
+            # Eski ro'yxat bilan kelgan ikkinchi tozalash hech narsa topmaydi
+            second = sweeper.delete_batches(ids, pool)
+        self.assertEqual(first[:2], (1, 1))
+        self.assertEqual(second, (0, 0, 0))
+
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.ref_count, 1)
+        self.assertTrue(os.path.exists(self.blob.file.path))
+        self.assertEqual(SharedFile.objects.get(batch=self.live).blob_id, self.blob.id)
+        self.assertFalse(FileBatch.objects.filter(id=self.expired.id).exists())
+
+    def test_admin_deletes_keep_refcounts(self):
+        admin_user = User.objects.create_superuser(username="admin", email="admin@example.com", password="x")
+        self.client.force_login(admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("admin:main_filebatch_delete", args=[self.expired.id]), {"post": "yes"})
+        self.assertEqual(response.status_code, 302)
+        self.blob.refresh_from_db()
+        self.assertEqual(self.blob.ref_count, 1)
+
+        # Oxirgi havola (fayl) o'chirilsa, blob ham o'chadi
+        live_file = SharedFile.objects.get(batch=self.live)
+        path = self.blob.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("admin:main_sharedfile_changelist"),
+                {"action": "delete_selected", "_selected_action": [live_file.id], "post": "yes"},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(SharedFile.objects.filter(id=live_file.id).exists())
+        self.assertFalse(Blob.objects.filter(id=self.blob.id).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_last_reference_removes_blob(self):
+        path = self.blob.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            report = sweeper.sweep(now=timezone.now() + timezone.timedelta(days=2), pause=0)
+            again = sweeper.sweep(now=timezone.now() + timezone.timedelta(days=2), pause=0)
+        self.assertEqual(report["batches"], 2)
+        self.assertEqual(again["batches"], 0)
+        self.assertFalse(Blob.objects.filter(id=self.blob.id).exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class ShortCodeTests(TestCase):
+    """Feistel short_code'lari bloklar orasida ham takrorlanmaydi."""
+
+    def setUp(self):
+        shortcodes._pool.clear()
+        self.addCleanup(shortcodes._pool.clear)
+
+    def test_permute_is_injective(self):
+        sample = list(range(20_000)) + list(range(shortcodes.SPACE - 20_000, shortcodes.SPACE))
+        values = {shortcodes.permute(number) for number in sample}
+        self.assertEqual(len(values), len(sample))
+        self.assertTrue(all(0 <= value < shortcodes.SPACE for value in values))
+
+    def test_unique_across_blocks(self):
+        codes = []
+        with self.captureOnCommitCallbacks(execute=True):
+            # Tranzaksiya ichida har bir chaqiruv yangi blok oladi
+            codes += [shortcodes.allocate() for _ in range(3)]
+        # Keyin qolgan bloklar xotiradan, oxirida yana yangi blok
+        codes += [shortcodes.allocate() for _ in range(3 * shortcodes.BLOCK_SIZE)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == shortcodes.CODE_LENGTH for code in codes))
+
+    def test_skips_codes_of_live_batches(self):
+        start = ShortCodeSequence.objects.get(pk=1).next_value
+        taken = shortcodes.encode(shortcodes.permute(start % shortcodes.SPACE))
+        FileBatch.objects.create(
+            encryption_key=Fernet.generate_key(),
+            expires_at=timezone.now() + timezone.timedelta(days=1),
+            short_code=taken,
+        )
+        codes = shortcodes.reserve_block(10)
+        self.assertEqual(len(codes), 9)
+        self.assertNotIn(taken, codes)
+
+
+@override_settings(TEZSHARE_UPLOAD_UNIT=HASH_LEAF_SIZE)
+class ChunkStreamTests(SimpleTestCase):
+    """write_chunk_stream: chala tana, qayta yuborish va band bloklar."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "upload")
+        self.unit = HASH_LEAF_SIZE
+        self.data = os.urandom(3 * self.unit + 1000)
+        self.total = len(self.data)
+
+    def _write(self, offset, length, body):
+        uploads.write_chunk_stream(self.path, self.total, offset, length, io.BytesIO(body))
+
+    def _stored(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_short_body_releases_units(self):
+        with self.assertRaises(uploads.ChunkError):
+            self._write(0, 2 * self.unit, self.data[: self.unit + 100])
+        self.assertEqual(uploads.received_map(self.path, self.total), b"\x00" * 4)
+
+        # Xuddi shu chunk qayta yuborilsa yoziladi
+        self._write(0, 2 * self.unit, self.data[: 2 * self.unit])
+        self.assertEqual(uploads.received_map(self.path, self.total), bytes([uploads.RECEIVED] * 2 + [0, 0]))
+        self.assertEqual(self._stored()[: 2 * self.unit], self.data[: 2 * self.unit])
+
+    def test_received_units_are_write_once(self):
+        self._write(0, self.unit, self.data[: self.unit])
+        # Boshqa baytlar bilan qayta yuborish e'tiborsiz qoladi
+        self._write(0, self.unit, os.urandom(self.unit))
+        self._write(2 * self.unit, self.total - 2 * self.unit, self.data[2 * self.unit :])
+        self._write(self.unit, self.unit, self.data[self.unit : 2 * self.unit])
+        self.assertTrue(uploads.is_complete(self.path, self.total))
+        self.assertEqual(self._stored(), self.data)
+
+    def test_busy_units(self):
+        uploads._claim(self.path, self.total, self.unit, self.unit)
+        with self.assertRaises(uploads.ChunkBusy):
+            self._write(0, 2 * self.unit, self.data[: 2 * self.unit])
+        # Band blok bilan kesishmaydigan chunk yoziladi
+        self._write(0, self.unit, self.data[: self.unit])
+        self.assertEqual(
+            uploads.received_map(self.path, self.total),
+            bytes([uploads.RECEIVED, uploads.RECEIVING, 0, 0]),
+        )
+
+    def test_abandoned_claim_expires(self):
+        # Blokni egallagan so'rov o'ldi (xatoni ushlab, bo'shatib ulgurmadi)
+        _, stale = uploads._claim(self.path, self.total, 0, self.unit)
+        with self.assertRaises(uploads.ChunkBusy):
+            self._write(0, self.unit, self.data[: self.unit])
+
+        with override_settings(TEZSHARE_UPLOAD_CLAIM_TIMEOUT=0):
+            self._write(0, self.unit, self.data[: self.unit])
+        self.assertEqual(uploads.received_map(self.path, self.total)[:1], bytes([uploads.RECEIVED]))
+
+        # Eski so'rov keyinroq tugasa ham, yangi egasining belgisini o'zgartirmaydi
+        uploads._set_flags(self.path, self.total, [0], 0, stale)
+        self.assertEqual(uploads.received_map(self.path, self.total)[:1], bytes([uploads.RECEIVED]))
+        self.assertEqual(self._stored()[: self.unit], self.data[: self.unit])
+
+
+@override_settings(TEZSHARE_CODE_FILTER_CAPACITY=200)
+class CodeFilterTests(TestCase):
+    """Bloom filtri: tirik kodlar o'tadi, yo'q kodlarning deyarli hammasi kesiladi."""
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.live_codes = [shortcodes.encode(shortcodes.permute(n)) for n in range(200)]
+        self.expired_code = shortcodes.encode(shortcodes.permute(10_000))
+        batches = [
+            FileBatch(short_code=code, encryption_key=Fernet.generate_key(), expires_at=now + timezone.timedelta(days=1))
+            for code in self.live_codes
+        ]
+        batches.append(
+            FileBatch(short_code=self.expired_code, encryption_key=Fernet.generate_key(), expires_at=now - timezone.timedelta(days=1))
+        )
+        FileBatch.objects.bulk_create(batches)
+
+    @staticmethod
+    def _contains(array, code):
+        return all(array[bit >> 3] & (0x80 >> (bit & 7)) for bit in codefilter._positions(code))
+
+    def test_built_filter(self):
+        array = codefilter._build()
+        self.assertTrue(all(self._contains(array, code) for code in self.live_codes))
+        self.assertFalse(self._contains(array, self.expired_code))
+
+        absent = [shortcodes.encode(shortcodes.permute(n)) for n in range(20_000, 22_000)]
+        false_positives = sum(self._contains(array, code) for code in absent)
+        self.assertLess(false_positives / len(absent), 0.05)
+
+    def test_resolve(self):
+        batch = FileBatch.objects.get(short_code=self.live_codes[0])
+        self.assertEqual(codefilter.resolve(batch.short_code), (batch.url_uuid, False))
+        self.assertIsNone(codefilter.resolve("ZZZZZZ"))
+        self.assertIsNone(codefilter.resolve("abc"))
+
+
+class UploadClientMixin:
+    """Yuklash so'rovlari: init, raw chunk (token bilan) va finalize."""
+
+    def _init(self, upload_id, size, filename="fayl.bin"):
+        return self.client.post(
+            reverse("upload_init"),
+            json.dumps({"upload_id": upload_id, "size": size, "filename": filename}),
+            content_type="application/json",
+        )
+
+    def _put(self, upload_id, offset, body, token):
+        return self.client.put(
+            reverse("chunk_upload_raw"),
+            body,
+            content_type="application/octet-stream",
+            headers={"X-Upload-Id": upload_id, "Upload-Offset": str(offset), "X-Upload-Token": token},
+        )
+
+    def _finalize(self, upload_ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse("finalize_batch"), json.dumps({"upload_ids": upload_ids}), content_type="application/json"
+            )
+
+
+@override_settings(TEZSHARE_ENCRYPT_ON_RECEIVE=True, TEZSHARE_DEDUP=False)
+class UploadFlowTests(UploadClientMixin, TestCase):
+    """To'liq yo'l: init -> chunklar (token bilan) -> finalize -> yuklab olish."""
+
+    def setUp(self):
+        cache.clear()
+
+    def _download(self, shared_file):
+        response = self.client.get(reverse("decrypt_file", args=[shared_file.id]), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_upload_with_empty_file(self):
+        data = os.urandom(3 * uploads.unit_size() + 123)
+        chunk = 2 * uploads.unit_size()
+        token = self._init("katta", len(data)).json()["token"]
+        for offset in range(0, len(data), chunk):
+            response = self._put("katta", offset, data[offset : offset + chunk], token)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._init("bosh", 0, "bo'sh.txt").status_code, 200)
+
+        response = self._finalize(["katta", "bosh"])
+        self.assertEqual(response.status_code, 200, response.content)
+
+        batch = FileBatch.objects.get(short_code=response.json()["short_code"])
+        files = {sf.original_name: sf for sf in batch.files.all()}
+        for shared_file in files.values():
+            self.addCleanup(shared_file.file.delete, save=False)
+        self.assertEqual(self._download(files["fayl.bin"]), data)
+        self.assertEqual(self._download(files["bo'sh.txt"]), b"")
+        self.assertEqual(files["bo'sh.txt"].file_hash, TreeHasher().hexdigest())
+        self.assertFalse(os.path.exists(uploads.temp_path("bosh")))
+
+    def test_session_token(self):
+        key = Fernet.generate_key()
+        token = uploads.issue_session_token("sessiya", 1000, key)
+        self.assertEqual(uploads.read_session_token(token), uploads.UploadSession("sessiya", 1000, key))
+        self.assertIsNone(uploads.read_session_token(uploads.issue_session_token("kalitsiz", 5)).encryption_key)
+
+        tampered = token[:-3] + ("aaa" if token[-3:] != "aaa" else "bbb")
+        with self.assertRaises(uploads.ChunkError):
+            uploads.read_session_token(tampered)
+        # Muddati o'tgan token
+        with self.settings(TEZSHARE_UPLOAD_SESSION_TTL=-1), self.assertRaises(uploads.ChunkError):
+            uploads.read_session_token(token)
+
+        response = self._put("sessiya", 0, b"x" * 1000, tampered)
+        self.assertEqual(response.status_code, 403)
+
+    def test_token_chunk_without_queries(self):
+        data = os.urandom(uploads.unit_size() + 1)
+        token = self._init("bazasiz", len(data)).json()["token"]
+        self.addCleanup(uploads.discard, uploads.temp_path("bazasiz"))
+        with self.assertNumQueries(0):
+            response = self._put("bazasiz", 0, data, token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(uploads.is_complete(uploads.temp_path("bazasiz"), len(data)))
+
+    def test_init_foreign_upload(self):
+        owner = User.objects.create_user(username="egasi", password="x")
+        self.client.force_login(owner)
+        self.assertEqual(self._init("begona", 100).status_code, 200)
+        # Egasi qayta ochsa — o'sha sessiya
+        self.assertEqual(self._init("begona", 100).status_code, 200)
+
+        self.client.logout()
+        self.assertEqual(self._init("begona", 100).status_code, 404)
+        self.client.force_login(User.objects.create_user(username="boshqa", password="x"))
+        self.assertEqual(self._init("begona", 100).status_code, 404)
+
+    async def test_async_raw_chunk(self):
+        # ASGI ostida raw chunklar async ko'rinishga tushadi (main/urls.py)
+        data = os.urandom(uploads.unit_size() + 5)
+        token = uploads.issue_session_token("asinxron", len(data), Fernet.generate_key())
+        self.addCleanup(uploads.discard, uploads.temp_path("asinxron"))
+        request = AsyncRequestFactory().put(
+            "/upload/raw/", data, content_type="application/octet-stream",
+            headers={"X-Upload-Id": "asinxron", "Upload-Offset": "0", "X-Upload-Token": token},
+        )
+        response = await async_views.raw_chunk_upload_view(request)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(uploads.is_complete(uploads.temp_path("asinxron"), len(data)))
+
+
+@override_settings(TEZSHARE_DEDUP=True)
+class PrecheckTests(TestCase):
+    """upload_precheck_view: tarkib isbotlansa havola, begona yuklashga tegilmaydi."""
+
+    def setUp(self):
+        cache.clear()
+        self.data = os.urandom(3 * HASH_LEAF_SIZE + 10)
+        hasher = TreeHasher()
+        hasher.update(self.data)
+        key = Fernet.generate_key()
+        self.blob = Blob.objects.create(content_hash=hasher.hexdigest(), size=len(self.data), encryption_key=key)
+        self.blob.file.save("blob.enc", ContentFile(b"".join(encrypt_stream(key, io.BytesIO(self.data)))))
+        self.addCleanup(self.blob.file.delete, save=False)
+        self.owner = User.objects.create_user(username="egasi", password="x")
+
+    def _precheck(self, upload_id):
+        url = reverse("upload_precheck")
+        body = {"upload_id": upload_id, "size": len(self.data), "hash": self.blob.content_hash}
+        challenge = self.client.post(url, json.dumps(body), content_type="application/json").json()
+        self.assertEqual(challenge["status"], "challenge")
+        proofs = [
+            blobs.leaf_proof(challenge["nonce"], self.data[i * HASH_LEAF_SIZE : (i + 1) * HASH_LEAF_SIZE])
+            for i in challenge["leaves"]
+        ]
+        return self.client.post(
+            url, json.dumps({**body, "token": challenge["token"], "proofs": proofs}), content_type="application/json"
+        )
+
+    def test_linked(self):
+        response = self._precheck("yangi")
+        self.assertEqual(response.json()["status"], "linked")
+        self.assertEqual(ChunkedUpload.objects.get(upload_id="yangi").blob_id, self.blob.id)
+
+    def test_capabilities_advertise_dedup(self):
+        self.assertIs(self.client.get(reverse("upload_capabilities")).json()["dedup"], True)
+        with self.settings(TEZSHARE_DEDUP=False):
+            self.assertIs(self.client.get(reverse("upload_capabilities")).json()["dedup"], False)
+
+    def test_foreign_upload_untouched(self):
+        key = Fernet.generate_key()
+        ChunkedUpload.objects.create(
+            upload_id="begona", user=self.owner, filename="a.bin", total_size=len(self.data),
+            temp_file_path=uploads.temp_path("begona"), encryption_key=key,
+        )
+        uploads.write_chunk(uploads.temp_path("begona"), len(self.data), 0, self.data[:HASH_LEAF_SIZE])
+        self.addCleanup(uploads.discard, uploads.temp_path("begona"))
+
+        self.assertEqual(self._precheck("begona").status_code, 404)
+        temp_upload = ChunkedUpload.objects.get(upload_id="begona")
+        self.assertEqual((temp_upload.user_id, temp_upload.blob_id), (self.owner.id, None))
+        self.assertEqual(bytes(temp_upload.encryption_key), key)
+        self.assertEqual(uploads.received_bytes(uploads.temp_path("begona"), len(self.data)), HASH_LEAF_SIZE)
+
+        # Egasining o'zi esa bog'lay oladi
+        self.client.force_login(self.owner)
+        self.assertEqual(self._precheck("begona").json()["status"], "linked")
+
+
+@override_settings(TEZSHARE_ENCRYPT_ON_RECEIVE=True, TEZSHARE_DEDUP=False)
+class QuotaTests(UploadClientMixin, TestCase):
+    """Oylik limit: sessiya ochilganda bir marta, finalize'da esa atomar joy band qilinadi."""
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().post("/", REMOTE_ADDR="127.0.0.1")
+        self.request.user = AnonymousUser()
+
+    def _create_batches(self, count):
+        for _ in range(count):
+            FileBatch.objects.create(
+                ip_address="127.0.0.1",
+                encryption_key=Fernet.generate_key(),
+                expires_at=timezone.now() + timezone.timedelta(days=1),
+            )
+
+    def test_slot_limit(self):
+        self._create_batches(quota.GUEST_MONTHLY_BATCHES - 1)
+        with quota.batch_slot(self.request) as has_slot:
+            self.assertTrue(has_slot)
+        with quota.batch_slot(self.request) as has_slot:
+            self.assertFalse(has_slot)
+        # Rad etilgan urinish hisoblagichni oshirmaydi
+        self.assertEqual(quota.used(self.request), quota.GUEST_MONTHLY_BATCHES)
+
+    def test_slot_released_on_failure(self):
+        self._create_batches(2)
+        with self.assertRaises(RuntimeError), quota.batch_slot(self.request) as has_slot:
+            self.assertTrue(has_slot)
+            raise RuntimeError("tranzaksiya bekor bo'ldi")
+        self.assertEqual(quota.used(self.request), 2)
+
+    def test_parallel_sessions_checked_at_finalize(self):
+        self._create_batches(quota.GUEST_MONTHLY_BATCHES - 1)
+        # Limit tugamagan — ikkala sessiya ham ochiladi, chunklar esa limitni tekshirmaydi
+        for upload_id in ("birinchi", "ikkinchi"):
+            token = self._init(upload_id, 10).json()["token"]
+            self.assertEqual(self._put(upload_id, 0, os.urandom(10), token).status_code, 200)
+            self.addCleanup(uploads.discard, uploads.temp_path(upload_id))
+
+        response = self._finalize(["birinchi"])
+        self.assertEqual(response.status_code, 200)
+        for shared_file in SharedFile.objects.all():
+            self.addCleanup(shared_file.file.delete, save=False)
+        self.assertEqual(self._finalize(["ikkinchi"]).status_code, 403)
+        self.assertEqual(quota.used(self.request), quota.GUEST_MONTHLY_BATCHES)
+
+        # Yangi sessiya endi ochilmaydi
+        self.assertEqual(self._init("uchinchi", 10).status_code, 403)
+
+
+# Tez xesh: muddat sinovida urinishlar oynadan chiqib ketmasin
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class PasswordAttemptsTests(TestCase):
+    """Parolli sahifa: urinishlar soni cheklangan, hisoblagich muddati o'tgach tiklanadi."""
+
+    def setUp(self):
+        cache.clear()
+        self.batch = FileBatch.objects.create(
+            encryption_key=Fernet.generate_key(),
+            expires_at=timezone.now() + timezone.timedelta(days=1),
+        )
+        self.batch.set_batch_password("togri-parol")
+        self.batch.save()
+        self.url = reverse("download_page", args=[self.batch.url_uuid])
+
+    def _try(self, password):
+        return self.client.post(self.url, {"password": password})
+
+    def test_lockout_after_limit(self):
+        for _ in range(settings.TEZSHARE_PASSWORD_ATTEMPTS):
+            self.assertEqual(self._try("xato").status_code, 200)
+        # Limitdan keyingi urinish — hatto to'g'ri parol ham rad etiladi
+        self.assertEqual(self._try("togri-parol").status_code, 403)
+
+    def test_correct_password_resets_counter(self):
+        for _ in range(settings.TEZSHARE_PASSWORD_ATTEMPTS - 1):
+            self._try("xato")
+        self.assertEqual(self._try("togri-parol").status_code, 302)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    @override_settings(TEZSHARE_PASSWORD_LOCKOUT=1)
+    def test_counter_expires(self):
+        for _ in range(settings.TEZSHARE_PASSWORD_ATTEMPTS):
+            self._try("xato")
+        self.assertEqual(self._try("xato").status_code, 403)
+        time.sleep(1.1)
+        self.assertEqual(self._try("togri-parol").status_code, 302)
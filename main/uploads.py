@@ -0,0 +1,366 @@
+"""
+Приём чанков без блокировок.
+
+Временный файл сразу создаётся нужного размера (разреженный), каждый чанк
+пишется через os.pwrite по своему смещению, поэтому параллельные чанки
+могут приходить в любом порядке. Полученные участки отмечаются в карте
+рядом с файлом (<upload>.map): один байт на блок TEZSHARE_UPLOAD_UNIT.
+Запись одного байта по смещению атомарна, так что карта тоже не требует
+блокировок (кроме короткого flock при захвате блоков), а проверка
+полноты — это чтение нескольких килобайт. Каждый блок пишется один раз:
+повторно присланный блок отбрасывается, а блок, который сейчас пишет
+другой запрос, — ChunkBusy (повторить позже). Время захвата блоков — в
+<upload>.claims: блоки запроса, умершего посреди чанка, освобождаются
+по истечении TEZSHARE_UPLOAD_CLAIM_TIMEOUT.
+
+Рядом же лежат хеши листьев (<upload>.sums, по 32 байта на лист,
+см. main/utils.py): хеш файла собирается при финализации без повторного
+чтения данных.
+
+В режиме TEZSHARE_ENCRYPT_ON_RECEIVE чанк сразу шифруется кадрами
+(main/crypto.py) и пишется на место своих кадров в зашифрованном файле,
+так что открытый текст на диск не попадает, а финализация — это rename.
+
+Сессия загрузки (issue_session_token): лимиты проверяются один раз при
+открытии сессии, а клиент получает подписанный токен с upload_id,
+размером и ключом загрузки (ключ зашифрован ключом сервера). Чанк с
+токеном обрабатывается без базы: проверка подписи, запись, карта.
+
+Чанк может прийти и «сырым» телом запроса (application/octet-stream,
+write_chunk_stream): тогда он пишется блоками прямо из потока, без
+разбора multipart и без промежуточной копии.
+"""
+import base64
+import fcntl
+import io
+import itertools
+import os
+import struct
+import time
+from collections import namedtuple
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.crypto import salted_hmac
+
+from .crypto import HEADER_SIZE, stored_size_for
+from .utils import HASH_LEAF_SIZE, leaf_digests, tree_hash_from_leaves
+
+MAP_SUFFIX = ".map"
+# Байт блока в карте: 0 — нет, RECEIVING — пишется сейчас, RECEIVED — получен
+RECEIVING = 2
+RECEIVED = 1
+SUMS_SUFFIX = ".sums"
+# Время захвата блока (time.time_ns()), по 8 байт на блок
+CLAIMS_SUFFIX = ".claims"
+CLAIM_SIZE = 8
+_CLAIM = struct.Struct(">Q")
+DIGEST_SIZE = 32
+SESSION_SALT = "tezshare.uploads.session"
+
+UploadSession = namedtuple("UploadSession", "upload_id total_size encryption_key")
+
+
+class ChunkError(ValueError):
+    """Чанк не совпадает с границами блоков или выходит за размер файла."""
+
+    status = 400
+
+
+class ChunkBusy(ChunkError):
+    """Часть блоков чанка сейчас пишет другой запрос — повторить позже."""
+
+    status = 409
+
+
+def temp_dir():
+    return os.path.join(settings.MEDIA_ROOT, "temp_uploads")
+
+
+def temp_path(upload_id):
+    return os.path.join(temp_dir(), os.path.basename(upload_id))
+
+
+def unit_size():
+    return settings.TEZSHARE_UPLOAD_UNIT
+
+
+def unit_count(total_size):
+    return -(-total_size // unit_size())
+
+
+def sidecar_paths(path):
+    """Все файлы, относящиеся к загрузке (сам файл и служебные)."""
+    return [path, path + MAP_SUFFIX, path + SUMS_SUFFIX, path + CLAIMS_SUFFIX]
+
+
+def _session_fernet():
+    # Ключ для "обёртки" ключей загрузки в токене — производный от SECRET_KEY
+    return Fernet(base64.urlsafe_b64encode(salted_hmac(SESSION_SALT, "key", algorithm="sha256").digest()))
+
+
+def issue_session_token(upload_id, total_size, encryption_key=None):
+    wrapped = _session_fernet().encrypt(bytes(encryption_key)).decode() if encryption_key else None
+    return signing.dumps({"u": upload_id, "s": total_size, "k": wrapped}, salt=SESSION_SALT)
+
+
+def read_session_token(token):
+    """Проверяет токен (подпись и срок) и возвращает UploadSession."""
+    try:
+        data = signing.loads(token, salt=SESSION_SALT, max_age=settings.TEZSHARE_UPLOAD_SESSION_TTL)
+        key = _session_fernet().decrypt(data["k"].encode()) if data["k"] else None
+    except (signing.BadSignature, InvalidToken, KeyError, TypeError):
+        raise ChunkError("Yuklash sessiyasi yaroqsiz yoki muddati tugagan")
+    return UploadSession(os.path.basename(data["u"]), int(data["s"]), key)
+
+
+def _open_sized(path, size, flags=os.O_WRONLY):
+    fd = os.open(path, flags | os.O_CREAT, 0o600)
+    # Предвыделение: разреженный файл нужного размера, повторный вызов безвреден
+    if os.fstat(fd).st_size != size:
+        os.ftruncate(fd, size)
+    return fd
+
+
+def check_chunk(total_size, offset, length):
+    unit = unit_size()
+    if unit % HASH_LEAF_SIZE:
+        raise ChunkError(f"TEZSHARE_UPLOAD_UNIT {HASH_LEAF_SIZE} ga karrali bo'lishi kerak")
+    if length > settings.TEZSHARE_MAX_CHUNK_SIZE:
+        raise ChunkError("Chunk juda katta")
+    if offset < 0 or offset % unit:
+        raise ChunkError(f"Offset {offset} {unit} ga karrali emas")
+    end = offset + length
+    if end > total_size:
+        raise ChunkError("Chunk fayl hajmidan chiqib ketdi")
+    if length % unit and end != total_size:
+        raise ChunkError(f"Chunk hajmi {length} {unit} ga karrali emas")
+
+
+def _claim(path, total_size, offset, length):
+    """
+    Занимает ещё не полученные блоки чанка (в карте RECEIVING) и возвращает
+    (их номера, метку захвата). Уже полученные блоки пропускаются, а если
+    часть блоков пишет другой запрос — ChunkBusy. Проверка и запись — под
+    flock карты: он действует и между потоками одного процесса (у каждого
+    свой open).
+
+    Время захвата каждого блока лежит в <upload>.claims. Запрос может
+    умереть, не освободив блоки (SIGKILL, OOM, таймаут воркера); блок,
+    занятый дольше TEZSHARE_UPLOAD_CLAIM_TIMEOUT, можно захватить заново.
+    """
+    first = offset // unit_size()
+    last = unit_count(offset + length)
+    stamp = time.time_ns()
+    expired = stamp - settings.TEZSHARE_UPLOAD_CLAIM_TIMEOUT * 10**9
+    fd = _open_sized(path + MAP_SUFFIX, unit_count(total_size), os.O_RDWR)
+    claims_fd = _open_sized(path + CLAIMS_SUFFIX, unit_count(total_size) * CLAIM_SIZE, os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        current = os.pread(fd, last - first, first)
+        stamps = bytearray(os.pread(claims_fd, (last - first) * CLAIM_SIZE, first * CLAIM_SIZE))
+        claimed = []
+        for i, flag in enumerate(current):
+            if flag == RECEIVED:
+                continue
+            if flag == RECEIVING and _CLAIM.unpack_from(stamps, i * CLAIM_SIZE)[0] > expired:
+                raise ChunkBusy("Chunk boshqa so'rov orqali yozilmoqda")
+            claimed.append(first + i)
+            _CLAIM.pack_into(stamps, i * CLAIM_SIZE, stamp)
+        os.pwrite(claims_fd, stamps, first * CLAIM_SIZE)
+        os.pwrite(fd, bytes(RECEIVED if flag == RECEIVED else RECEIVING for flag in current), first)
+    finally:
+        os.close(fd)
+        os.close(claims_fd)
+    return claimed, stamp
+
+
+def _set_flags(path, total_size, units, flag, stamp):
+    """
+    Отмечает блоки, захваченные с меткой stamp. Блоки, которые после
+    истечения захвата занял другой запрос, не трогаются.
+    """
+    fd = _open_sized(path + MAP_SUFFIX, unit_count(total_size), os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        with open(path + CLAIMS_SUFFIX, "rb") as f:
+            stamps = f.read()
+        owned = [unit for unit in units if _CLAIM.unpack_from(stamps, unit * CLAIM_SIZE)[0] == stamp]
+        # Подряд идущие блоки — одной записью
+        for _, run in itertools.groupby(enumerate(sorted(owned)), lambda pair: pair[1] - pair[0]):
+            run = [index for _, index in run]
+            os.pwrite(fd, bytes([flag]) * len(run), run[0])
+    finally:
+        os.close(fd)
+
+
+def _seal_chunk(cipher, total_size, offset, data):
+    """Шифрует чанк кадрами; возвращает (байты, смещение в зашифрованном файле)."""
+    frame_size = cipher.frame_size
+    last_index = max(1, -(-total_size // frame_size)) - 1
+    first = offset // frame_size
+    view = memoryview(data)
+    sealed = b"".join(
+        cipher.seal(index, view[pos : pos + frame_size], index == last_index)
+        for index, pos in enumerate(range(0, len(data), frame_size), start=first)
+    )
+    if first == 0:
+        # Заголовок одинаков для всех процессов, его пишет первый чанк
+        return cipher.header + sealed, 0
+    return sealed, HEADER_SIZE + first * cipher.sealed_size
+
+
+def write_chunk(path, total_size, offset, data, cipher=None):
+    """
+    Пишет чанк на его место и отмечает блоки как полученные.
+    С cipher (FrameCipher.for_upload) чанк пишется уже зашифрованным.
+    """
+    write_chunk_stream(path, total_size, offset, len(data), io.BytesIO(data), cipher)
+
+
+def _read_into(stream, view):
+    """Заполняет view из stream; возвращает число прочитанных байт."""
+    filled = 0
+    while filled < len(view):
+        part = stream.read(len(view) - filled)
+        if not part:
+            break
+        view[filled : filled + len(part)] = part
+        filled += len(part)
+    return filled
+
+
+def write_chunk_stream(path, total_size, offset, length, stream, cipher=None):
+    """
+    Как write_chunk, но чанк читается из stream (тело запроса) блоками
+    TEZSHARE_UPLOAD_UNIT в один переиспользуемый буфер и сразу пишется на
+    место: целиком в памяти и во временном файле он не собирается.
+
+    Блок пишется один раз (_claim): повтор уже полученного блока читается
+    и отбрасывается. Поэтому nonce кадра никогда не шифрует два разных
+    текста, а хеш листа в .sums всегда от тех же байтов, что и данные.
+    """
+    check_chunk(total_size, offset, length)
+    unit = unit_size()
+    if cipher is not None and cipher.frame_size != unit:
+        raise ChunkError("TEZSHARE_UPLOAD_UNIT kadr hajmiga teng bo'lishi kerak")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    claimed, stamp = _claim(path, total_size, offset, length)
+    claimed = set(claimed)
+    data_size = total_size if cipher is None else stored_size_for(total_size, cipher.frame_size)
+    leaf_count = -(-total_size // HASH_LEAF_SIZE)
+    fd = _open_sized(path, data_size)
+    sums_fd = _open_sized(path + SUMS_SUFFIX, leaf_count * DIGEST_SIZE)
+    view = memoryview(bytearray(unit))
+    try:
+        for position in range(offset, offset + length, unit):
+            block = view[: min(unit, offset + length - position)]
+            if _read_into(stream, block) != len(block):
+                raise ChunkError("Chunk to'liq kelmadi")
+            if position // unit not in claimed:
+                continue
+            if cipher is None:
+                os.pwrite(fd, block, position)
+            else:
+                os.pwrite(fd, *_seal_chunk(cipher, total_size, position, block))
+            os.pwrite(sums_fd, leaf_digests(block), position // HASH_LEAF_SIZE * DIGEST_SIZE)
+    except BaseException:
+        # Блоки не записаны — освобождаем, повтор чанка запишет их заново
+        _set_flags(path, total_size, claimed, 0, stamp)
+        raise
+    finally:
+        os.close(fd)
+        os.close(sums_fd)
+    # Карта обновляется только после записи данных
+    _set_flags(path, total_size, claimed, RECEIVED, stamp)
+
+
+def create_empty(path, cipher=None):
+    """
+    Пустой файл: чанков для него не будет, поэтому файл (а с cipher —
+    заголовок и единственный пустой последний кадр) и пустые .sums пишутся
+    при открытии сессии. Карта пустая — is_complete() сразу истинно.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        if cipher is not None:
+            f.write(cipher.header + cipher.seal(0, b"", True))
+    open(path + SUMS_SUFFIX, "wb").close()
+
+
+def received_map(path, total_size):
+    try:
+        with open(path + MAP_SUFFIX, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        data = b""
+    return data.ljust(unit_count(total_size), b"\x00")
+
+
+def received_bytes(path, total_size):
+    received = received_map(path, total_size).count(RECEIVED) * unit_size()
+    return min(received, total_size)
+
+
+def received_ranges(path, total_size):
+    """Полученные участки файла: [[start, end), ...] в байтах, смежные склеены."""
+    unit = unit_size()
+    ranges = []
+    for index, flag in enumerate(received_map(path, total_size)):
+        if flag != RECEIVED:
+            continue
+        start, end = index * unit, min((index + 1) * unit, total_size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+def is_complete(path, total_size):
+    return received_map(path, total_size).count(RECEIVED) == unit_count(total_size)
+
+
+def file_hash(path, total_size):
+    """Хеш полностью полученного файла из сохранённых листьев (или None)."""
+    if not is_complete(path, total_size):
+        return None
+    try:
+        with open(path + SUMS_SUFFIX, "rb") as f:
+            leaves = f.read()
+    except FileNotFoundError:
+        return None
+    if len(leaves) != -(-total_size // HASH_LEAF_SIZE) * DIGEST_SIZE:
+        return None
+    return tree_hash_from_leaves(leaves)
+
+
+def promote(path, name):
+    """
+    Переносит готовый зашифрованный файл в хранилище (os.replace —
+    только метаданные, без копирования) и возвращает имя для FileField.
+    Перенос — после фиксации транзакции: при откате загрузка остаётся на
+    месте вместе с картой, и клиент может продолжить или повторить финализацию.
+    """
+    name = default_storage.get_available_name(name)
+    target = default_storage.path(name)
+
+    def move():
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+        discard(path)
+
+    transaction.on_commit(move)
+    return name
+
+
+def discard(path):
+    for name in sidecar_paths(path):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,18 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
     chunked_upload_view,
+    raw_chunk_upload_view,
+    upload_capabilities_view,
+    upload_init_view,
+    upload_precheck_view,
+    upload_manifest_view,
     decrypt_file_view,
     download_batch_zip,
     download_page_view,
+    batch_status_view,
+    batch_qr_view,
     finalize_batch_view,
     main_page_views,
     my_files_view,
@@ -16,6 +24,15 @@ from .views import (
     coming_soon
 )
 
+if settings.TEZSHARE_ASGI:
+    # ASGI (uvicorn): uzoq davom etadigan uzatishlar uchun async ko'rinishlar
+    from .async_views import (
+        chunked_upload_view,
+        decrypt_file_view,
+        download_batch_zip,
+        raw_chunk_upload_view,
+    )
+
 urlpatterns = [
     path("", main_page_views, name="main"),
     path('feedback/', feedback_view, name='feedback'),
@@ -27,6 +44,21 @@ urlpatterns = [
 
     path("upload/", chunked_upload_view, name="chunk_upload"),
 
+    # Chunk multipart'siz (application/octet-stream, ma'lumotlar sarlavhalarda)
+    path("upload/raw/", raw_chunk_upload_view, name="chunk_upload_raw"),
+
+    # Chunk o'lchamlari (klient moslashuvchan rejalashtirgich uchun)
+    path("upload/capabilities/", upload_capabilities_view, name="upload_capabilities"),
+
+    # Yuklash sessiyasi: limitlar bir marta, keyin chunklar token bilan (bazasiz)
+    path("upload/init/", upload_init_view, name="upload_init"),
+
+    # Xesh bo'yicha oldindan tekshirish: tarkib serverda bo'lsa, yuklash shart emas
+    path("upload/precheck/", upload_precheck_view, name="upload_precheck"),
+
+    # Qaysi chunklar serverda bor (yuklashni davom ettirish uchun)
+    path("upload/<str:upload_id>/", upload_manifest_view, name="upload_manifest"),
+
     path("verify-password/", verify_password_view, name="verify_password"),
 
     path("finalize-batch/", finalize_batch_view, name="finalize_batch"),
@@ -36,6 +68,13 @@ urlpatterns = [
     # Страница со списком (по UUID)
     path("d/<uuid:url_uuid>/", download_page_view, name="download_page"),
 
+    # Holat: fayllar fonda shifrlanayotganda download.html shu yerni so'raydi
+    path("d/<uuid:url_uuid>/status/", batch_status_view, name="batch_status"),
+
+    # QR-kod: birinchi so'rovda chiziladi, keyin keshdan (immutable, ETag)
+    path("d/<uuid:url_uuid>/qr.png", batch_qr_view, {"fmt": "png"}, name="batch_qr"),
+    path("d/<uuid:url_uuid>/qr.svg", batch_qr_view, {"fmt": "svg"}, name="batch_qr_svg"),
+
     # Скачать всё (ZIP)
     path("d/<uuid:url_uuid>/zip/", download_batch_zip, name="download_zip"),
 
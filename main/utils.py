@@ -1,37 +1,84 @@
-import base64
 import hashlib
-import io
-import secrets
-import string
 
-import qrcode
+# Хеш файла — двухуровневое дерево SHA-256: хеш каждого блока (лист)
+# и SHA-256 от склеенных хешей листьев. Листья можно считать в любом
+# порядке, поэтому хеш вычисляется по мере прихода чанков, даже параллельных.
+HASH_LEAF_SIZE = 64 * 1024
 
-import qrcode
-import os
-import io
-import base64
-from django.conf import settings
 
+def leaf_digests(data):
+    """Хеши листьев для данных, начинающихся на границе листа."""
+    view = memoryview(data)
+    return b"".join(
+        hashlib.sha256(view[pos : pos + HASH_LEAF_SIZE]).digest()
+        for pos in range(0, len(view), HASH_LEAF_SIZE)
+    )
 
-def generate_qr_code_base64(url, uuid=None): # uuid сделаем необязательным для страховки
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
 
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    # Кодируем в base64
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
+def tree_hash_from_leaves(leaves):
+    return hashlib.sha256(leaves).hexdigest()
+
+
+class TreeHasher:
+    """Потоковое вычисление хеша файла (например, при скачивании)."""
+
+    def __init__(self):
+        self._root = hashlib.sha256()
+        self._pending = bytearray()
+
+    def update(self, data):
+        view = memoryview(data)
+        if self._pending:
+            take = HASH_LEAF_SIZE - len(self._pending)
+            self._pending += view[:take]
+            view = view[take:]
+            if len(self._pending) < HASH_LEAF_SIZE:
+                return
+            self._root.update(hashlib.sha256(self._pending).digest())
+            self._pending.clear()
+        full = len(view) - len(view) % HASH_LEAF_SIZE
+        self._root.update(leaf_digests(view[:full]))
+        self._pending += view[full:]
+
+    def hexdigest(self):
+        root = self._root.copy()
+        if self._pending:
+            root.update(hashlib.sha256(self._pending).digest())
+        return root.hexdigest()
 
 
 def calculate_file_hash(data):
-    """Генерирует SHA-256 хеш для проверки целостности файла"""
-    return hashlib.sha256(data).hexdigest()
+    """Генерирует хеш для проверки целостности файла (bytes или итератор кусков)"""
+    hasher = TreeHasher()
+    for chunk in [data] if isinstance(data, (bytes, bytearray, memoryview)) else data:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range (RFC 9110) для файла размером size.
+    Возвращает (start, end) с end не включительно; None если заголовка нет,
+    он некорректен или содержит несколько диапазонов (отдаём файл целиком).
+    Бросает ValueError, если диапазон невыполним (ответ 416).
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep or "," in last or not (first or last):
+        return None
+    if not (first or "0").isdigit() or not (last or "0").isdigit():
+        return None
 
+    if not first:
+        # bytes=-500 — последние 500 байт
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size
 
-def generate_short_code(length=6):
-    """Просто генерирует строку, никого не импортируя"""
-    characters = string.ascii_uppercase + string.digits
-    return "".join(secrets.choice(characters) for _ in range(length))
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or end <= start:
+        raise ValueError("Unsatisfiable range")
+    return start, end
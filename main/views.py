@@ -1,15 +1,11 @@
-import hashlib
 import io
+import itertools
 import json
 import os
-import zipfile
-import qrcode
-import os
-import io
-import base64
 from django.conf import settings
 import mimetypes
 from django.utils.encoding import escape_uri_path
+from urllib.parse import unquote
 
 
 from cryptography.fernet import Fernet
@@ -21,58 +17,52 @@ from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.base import ContentFile
 from django.db import transaction
-from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 
 # Create your views here.
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
-
-from .models import ChunkedUpload, FileBatch, SharedFile,Feedback
-from .utils import calculate_file_hash 
-from .tasks import encrypt_files_background_task
-
-def generate_qr_code_base64(url, uuid=None):
-    """QR-kodni yaratadi va Base64 formatida qaytaradi."""
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    # Tarix uchun media/qr_codes/ papkasida jismoniy saqlash
-    if uuid:
-        qr_dir = os.path.join(settings.MEDIA_ROOT, "qr_codes")
-        os.makedirs(qr_dir, exist_ok=True)
-        img.save(os.path.join(qr_dir, f"qr_{uuid}.png"))
-
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
-
-
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+
+from .crypto import DecryptedFile, DecryptionError, FrameCipher
+from . import blobs, codefilter, pagecache, plaincache, qr, quota, uploads
+from .models import Blob, ChunkedUpload, FileBatch, SharedFile,Feedback
+from .utils import TreeHasher, parse_range_header
+from .tasks import dispatch_batch_encryption
+from .templatetags.file_filters import is_precompressed
+from .zipstream import ZipStream
 
 def main_page_views(request):
     # So'rovdan kodni olamiz
     code = request.GET.get("code", "").strip().upper()
 
     if code:
-        batch = FileBatch.objects.filter(short_code=code).first()
+        # Taxminiy kodlar bazaga yetib bormaydi: avval Bloom filtri, keyin qisqa kesh
+        found = codefilter.resolve(code)
 
-        if batch:
+        if found:
+            url_uuid, has_password = found
             # Agar faylda parol MAVJUD bo'lsa
-            if (
-                batch.password
-            ):  # Modelingizdagi maydon nomini tekshiring (password_hash bo'lishi mumkin)
+            if has_password:
                 # Parol kiritish sahifasini ko'rsatamiz, UUID ni uzatamiz
                 return render(
                     request,
                     "main/password_form.html",
-                    {"url_uuid": batch.url_uuid, "code": code},
+                    {"url_uuid": url_uuid, "code": code},
                 )
 
             # Agar parol BO'LMASA — to'g'ridan-to'g'ri yuklab olish sahifasiga
-            return redirect("download_page", url_uuid=batch.url_uuid)
+            return redirect("download_page", url_uuid=url_uuid)
         else:
             messages.error(request, f"{code} kodi topilmadi.")
             return redirect("main")
@@ -108,98 +98,402 @@ def verify_password_view(request):
 
   # Import to'g'riligiga ishonch hosil qiling
 
-def chunked_upload_view(request):
-    # 1. LIMITLAR QOLDIG'INI HISOBLASH (KO'RSATISH VA TEKSHIRISH UCHUN)
-    now = timezone.now()
-    start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    user_ip = request.META.get('REMOTE_ADDR')
-    
-    if request.user.is_authenticated:
-        max_allowed = 10
-        used = FileBatch.objects.filter(owner=request.user, created_at__gte=start_of_month).count()
-        current_limit_size = settings.TEZSHARE_USER_MAX_SIZE
-        limit_mb_text = settings.TEZSHARE_USER_LIMIT_MB
-    else:
-        max_allowed = 5
-        used = FileBatch.objects.filter(owner__isnull=True, ip_address=user_ip, created_at__gte=start_of_month).count()
-        current_limit_size = settings.TEZSHARE_GUEST_MAX_SIZE
-        limit_mb_text = settings.TEZSHARE_GUEST_LIMIT_MB
-    
-    remains = max_allowed - used
-
-    if request.method == "POST":
-        # 2. YUKLASHLAR SONINI DARHOL TEKSHIRISH
-        if remains <= 0:
-            return JsonResponse({
-                "status": "error", 
-                "message": f"Sizning oylik yuklash limitingiz ({max_allowed}) tugadi. Keyingi oyda urinib ko'ring!"
-            }, status=403)
+def _check_upload_limits(request, total_size):
+    """Limitdan oshsa xato JsonResponse qaytaradi, aks holda None."""
+    max_allowed, current_limit_size, limit_mb_text = quota.limits(request)
+    if quota.used(request) >= max_allowed:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Sizning oylik yuklash limitingiz ({max_allowed}) tugadi. Keyingi oyda urinib ko'ring!"
+        }, status=403)
+
+    if total_size > current_limit_size:
+        msg = f"Fayl juda katta. Sizning limitingiz: {limit_mb_text}."
+        if not request.user.is_authenticated:
+            msg += " Limitni 500 MB gacha oshirish uchun tizimga kiring."
+        return JsonResponse({"status": "error", "message": msg}, status=400)
+    return None
+
+
+def _new_upload_session(request, upload_id, filename, total_size):
+    """
+    Yuklash sessiyasining birinchi chunki: limitlar shu yerda bir marta
+    tekshiriladi. Xato bo'lsa (None, JsonResponse) qaytaradi.
+    """
+    if total_size is None:
+        return None, JsonResponse({"status": "error", "message": "Noto'g'ri fayl hajmi"}, status=400)
+    error = _check_upload_limits(request, total_size)
+    if error:
+        return None, error
+
+    temp_upload, created = ChunkedUpload.objects.get_or_create(
+        upload_id=upload_id,
+        defaults={
+            "user": request.user if request.user.is_authenticated else None,
+            "filename": filename,
+            "total_size": total_size,
+            "temp_file_path": uploads.temp_path(upload_id),
+            # Har bir yuklashning o'z kaliti: chunklar diskka shifrlangan holda yoziladi
+            "encryption_key": Fernet.generate_key() if settings.TEZSHARE_ENCRYPT_ON_RECEIVE else None,
+        },
+    )
+    if created and total_size == 0:
+        # Bo'sh faylga chunk kelmaydi — fayl (va yagona bo'sh kadr) shu yerda yoziladi
+        cipher = None
+        if temp_upload.encryption_key:
+            cipher = FrameCipher.for_upload(temp_upload.encryption_key)
+        uploads.create_empty(temp_upload.temp_file_path, cipher)
+    return temp_upload, None
+
+
+def _session_for_chunk(request, post, upload_id, filename):
+    """
+    Chunk qaysi sessiyaga tegishli: token bo'lsa — bazasiz (imzo tekshiriladi),
+    aks holda eski yo'l (ChunkedUpload yozuvi). (UploadSession, xato) qaytaradi.
+    """
+    token = post.get("token") or request.headers.get("X-Upload-Token")
+    if token:
+        try:
+            return uploads.read_session_token(token), None
+        except uploads.ChunkError as e:
+            return None, JsonResponse({"status": "error", "message": str(e)}, status=403)
 
+    # Limitlar har bir chunk uchun emas, sessiya boshida bir marta tekshiriladi
+    temp_upload = ChunkedUpload.objects.filter(upload_id=upload_id).first()
+    if temp_upload is None:
         try:
-            total_size = int(request.POST.get("total_size", 0))
+            total_size = int(post.get("total_size", 0))
         except (ValueError, TypeError):
-            return JsonResponse({"status": "error", "message": "Noto'g'ri fayl hajmi"}, status=400)
+            total_size = None
+        temp_upload, error = _new_upload_session(request, upload_id, filename, total_size)
+        if error:
+            return None, error
+    return uploads.UploadSession(temp_upload.upload_id, temp_upload.total_size, temp_upload.encryption_key), None
+
+
+def _store_chunk(session, offset, data):
+    """Chunk o'z joyiga yoziladi (os.pwrite) — parallel chunklar istalgan tartibda kelishi mumkin."""
+    cipher = None
+    if session.encryption_key:
+        cipher = FrameCipher.for_upload(session.encryption_key)
+    uploads.write_chunk(uploads.temp_path(session.upload_id), session.total_size, offset, data, cipher)
+
+
+def _store_chunk_stream(session, offset, length, stream):
+    cipher = None
+    if session.encryption_key:
+        cipher = FrameCipher.for_upload(session.encryption_key)
+    uploads.write_chunk_stream(
+        uploads.temp_path(session.upload_id), session.total_size, offset, length, stream, cipher
+    )
+
+
+def _raw_chunk_headers(request):
+    """
+    Multipart'siz chunk sarlavhalari: (upload_id, offset, hajm, fayl nomi)
+    yoki xato bo'lsa JsonResponse. Sinxron va async ko'rinishlar uchun umumiy.
+    """
+    upload_id = os.path.basename(request.headers.get("X-Upload-Id", ""))
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+        length = int(request.headers.get("Content-Length", ""))
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "Noto'g'ri offset yoki hajm"}, status=400)
+    if not upload_id:
+        return JsonResponse({"status": "error", "message": "Chunk topilmadi"}, status=400)
+    filename = unquote(request.headers.get("X-Upload-Filename", "")) or None
+    return upload_id, offset, length, filename
+
+
+@require_http_methods(["PUT"])
+def raw_chunk_upload_view(request):
+    """
+    Chunk multipart'siz: tana — application/octet-stream, qolgani
+    sarlavhalarda (X-Upload-Id, Upload-Offset, X-Upload-Token yoki
+    Upload-Length + X-Upload-Filename). Tana to'g'ridan-to'g'ri faylga
+    bloklab yoziladi — MultiPartParser ham, vaqtinchalik fayl ham yo'q.
+    """
+    parsed = _raw_chunk_headers(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    upload_id, offset, length, filename = parsed
+
+    session, error = _session_for_chunk(
+        request, {"total_size": request.headers.get("Upload-Length")}, upload_id, filename
+    )
+    if error:
+        return error
+
+    try:
+        _store_chunk_stream(session, offset, length, request)
+    except uploads.ChunkError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=e.status)
 
-        # 3. FAYL HAJMINI TEKSHIRISH
-        if total_size > current_limit_size:
-            msg = f"Fayl juda katta. Sizning limitingiz: {limit_mb_text}."
-            if not request.user.is_authenticated:
-                msg += " Limitni 500 MB gacha oshirish uchun tizimga kiring."
-            return JsonResponse({"status": "error", "message": msg}, status=400)
+    return JsonResponse({"status": "continue", "progress": offset + length})
 
-        # 4. CHUNK NI QAYTA ISHLASH
-        upload_id = request.POST.get("upload_id")
+
+def chunked_upload_view(request):
+    if request.method == "POST":
+        upload_id = os.path.basename(request.POST.get("upload_id", ""))
         file_chunk = request.FILES.get("chunk")
-        offset = int(request.POST.get("offset", 0))
         filename = request.POST.get("filename")
+        try:
+            offset = int(request.POST.get("offset", 0))
+        except (ValueError, TypeError):
+            return JsonResponse({"status": "error", "message": "Noto'g'ri offset"}, status=400)
 
-        temp_upload, _ = ChunkedUpload.objects.get_or_create(
-            upload_id=upload_id,
-            defaults={
-                "filename": filename,
-                "total_size": total_size,
-                "temp_file_path": os.path.join(settings.MEDIA_ROOT, "temp_uploads", upload_id),
-            },
-        )
+        if not upload_id or file_chunk is None:
+            return JsonResponse({"status": "error", "message": "Chunk topilmadi"}, status=400)
 
-        os.makedirs(os.path.dirname(temp_upload.temp_file_path), exist_ok=True)
-        with open(temp_upload.temp_file_path, "ab") as f:
-            f.seek(offset)
-            f.write(file_chunk.read())
+        session, error = _session_for_chunk(request, request.POST, upload_id, filename)
+        if error:
+            return error
 
-        temp_upload.offset = offset + file_chunk.size
-        temp_upload.save()
+        try:
+            _store_chunk(session, offset, file_chunk.read())
+        except uploads.ChunkError as e:
+            return JsonResponse({"status": "error", "message": str(e)}, status=e.status)
 
-        return JsonResponse({"status": "continue", "progress": temp_upload.offset})
+        return JsonResponse({"status": "continue", "progress": offset + file_chunk.size})
 
     # GET so'rovi uchun hisoblangan limitlar bilan sahifani beramiz
+    max_allowed = quota.limits(request)[0]
+    used = quota.used(request)
+    remains = max_allowed - used
     return render(request, "main/upload.html", {
         "remains": remains, 
         "max_allowed": max_allowed,
         "used": used
     })
 
+@require_http_methods(["GET"])
+def upload_capabilities_view(request):
+    """
+    Chunk o'lchamlari: klient shu qiymatlardan boshlaydi va o'lchovlarga
+    qarab chunk hajmi va parallel so'rovlar sonini o'zgartiradi (upload.js).
+    """
+    response = JsonResponse({
+        "unit": uploads.unit_size(),
+        "preferred_chunk_size": settings.TEZSHARE_CHUNK_SIZE,
+        "max_chunk_size": settings.TEZSHARE_MAX_CHUNK_SIZE,
+        "max_parallel": settings.TEZSHARE_UPLOAD_MAX_PARALLEL,
+        # O'chiq bo'lsa klient faylni oldindan xeshlamaydi (precheck befoyda)
+        "dedup": blobs.enabled(),
+    })
+    response["Cache-Control"] = "public, max-age=3600"
+    return response
+
+
+@require_http_methods(["POST"])
+def upload_init_view(request):
+    """
+    Yuklash sessiyasini ochadi: limitlar va hajm shu yerda bir marta
+    tekshiriladi, ChunkedUpload yoziladi va imzolangan token qaytariladi.
+    Token bilan kelgan chunklar bazaga umuman murojaat qilmaydi.
+    """
+    try:
+        data = json.loads(request.body)
+        upload_id = os.path.basename(str(data.get("upload_id", "")))
+        total_size = int(data.get("size"))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"status": "error", "message": "Noto'g'ri so'rov"}, status=400)
+    if not upload_id or total_size < 0:
+        return JsonResponse({"status": "error", "message": "Noto'g'ri so'rov"}, status=400)
+
+    temp_upload = ChunkedUpload.objects.filter(upload_id=upload_id).first()
+    owner_id = request.user.id if request.user.is_authenticated else None
+    if temp_upload is None:
+        temp_upload, error = _new_upload_session(request, upload_id, data.get("filename"), total_size)
+        if error:
+            return error
+    elif temp_upload.user_id and temp_upload.user_id != owner_id:
+        # Token yuklash kalitini beradi — begona yuklashga yozib bo'lmasin (manifestdagi kabi)
+        raise Http404("Yuklash topilmadi")
+    elif temp_upload.total_size != total_size:
+        return JsonResponse({"status": "error", "message": "Fayl hajmi sessiyaga mos emas"}, status=400)
+
+    return JsonResponse({
+        "status": "ok",
+        "token": uploads.issue_session_token(
+            temp_upload.upload_id, temp_upload.total_size, temp_upload.encryption_key
+        ),
+        "unit": uploads.unit_size(),
+    })
+
+
+@require_http_methods(["POST"])
+def upload_precheck_view(request):
+    """
+    Chunklardan oldin: mijoz fayl xeshini yuboradi. Birinchi so'rovga server
+    tasodifiy bo'laklar (leaf) bo'yicha sinov beradi, ikkinchisida mijoz
+    shu bo'laklarning xeshlarini yuboradi. Tarkib serverda bo'lsa va isbot
+    to'g'ri bo'lsa — fayl yuklanmaydi ("linked"). Boshqa har qanday holatda
+    javob bir xil: "upload" (xesh orqali begona fayllarni tekshirib bo'lmaydi).
+    """
+    try:
+        data = json.loads(request.body)
+        upload_id = os.path.basename(str(data.get("upload_id", "")))
+        total_size = int(data.get("size", 0))
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({"status": "error", "message": "Noto'g'ri so'rov"}, status=400)
+
+    error = _check_upload_limits(request, total_size)
+    if error:
+        return error
+    if not blobs.enabled() or not upload_id or total_size <= 0:
+        return JsonResponse({"status": "upload"})
+
+    token = data.get("token")
+    if not token:
+        content_hash = str(data.get("hash", "")).lower()
+        if len(content_hash) != 64:
+            return JsonResponse({"status": "upload"})
+        return JsonResponse({"status": "challenge", **blobs.issue_challenge(upload_id, content_hash, total_size)})
+
+    verified = blobs.verify_possession(token, data.get("proofs"))
+    if not verified or verified[0] != upload_id or verified[1].size != total_size:
+        return JsonResponse({"status": "upload"})
+
+    _, blob = verified
+    temp_upload = ChunkedUpload.objects.filter(upload_id=upload_id).first()
+    owner_id = request.user.id if request.user.is_authenticated else None
+    if temp_upload and temp_upload.user_id and temp_upload.user_id != owner_id:
+        # Begona yuklashni qayta yozib, chunklarini o'chirib bo'lmasin (init va manifestdagi kabi)
+        raise Http404("Yuklash topilmadi")
+    ChunkedUpload.objects.update_or_create(
+        upload_id=upload_id,
+        defaults={
+            "user": request.user if request.user.is_authenticated else None,
+            "filename": data.get("filename") or upload_id,
+            "total_size": total_size,
+            "temp_file_path": uploads.temp_path(upload_id),
+            "encryption_key": None,
+            "blob": blob,
+        },
+    )
+    # Qisman yuklangan chunklar bo'lsa, endi ular kerak emas
+    uploads.discard(uploads.temp_path(upload_id))
+    return JsonResponse({"status": "linked"})
+
+
+@require_http_methods(["GET", "HEAD"])
+def upload_manifest_view(request, upload_id):
+    """
+    Qayta davom ettirish uchun: server bu upload_id dan qaysi baytlarni
+    allaqachon olganini qaytaradi. HEAD — tus uslubidagi sarlavhalar
+    (Upload-Offset — boshidan uzluksiz olingan qism), GET — to'liq JSON.
+    """
+    temp_upload = ChunkedUpload.objects.filter(upload_id=os.path.basename(upload_id)).first()
+    owner_id = request.user.id if request.user.is_authenticated else None
+    if not temp_upload or (temp_upload.user_id and temp_upload.user_id != owner_id):
+        raise Http404("Yuklash topilmadi")
+
+    if temp_upload.blob_id:
+        # Tarkib xesh orqali bog'langan — hammasi "olingan"
+        ranges, complete = [[0, temp_upload.total_size]], True
+    else:
+        ranges = uploads.received_ranges(temp_upload.temp_file_path, temp_upload.total_size)
+        complete = uploads.is_complete(temp_upload.temp_file_path, temp_upload.total_size)
+    contiguous = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+    if request.method == "HEAD":
+        response = HttpResponse()
+    else:
+        response = JsonResponse({
+            "upload_id": temp_upload.upload_id,
+            "filename": temp_upload.filename,
+            "total_size": temp_upload.total_size,
+            "unit": uploads.unit_size(),
+            "received": ranges,
+            "complete": complete,
+        })
+    response["Upload-Offset"] = contiguous
+    response["Upload-Length"] = temp_upload.total_size
+    response["Cache-Control"] = "no-store"
+    return response
+
+
 from django.utils.html import strip_tags, escape # Tozalash vositalarini import qilamiz
 
 
+def _commit_linked_upload(batch, temp_upload):
+    """Tarkibi serverda bor fayl (upload_precheck_view): faqat blobga havola."""
+    shared_file = SharedFile(
+        batch=batch,
+        original_name=temp_upload.filename,
+        file_size=temp_upload.total_size,
+        file_hash=temp_upload.blob.content_hash,
+    )
+    try:
+        blobs.attach(shared_file, temp_upload.blob)
+    except Blob.DoesNotExist:
+        # Blob shu orada o'chirildi (oxirgi havola muddati tugadi)
+        raise uploads.ChunkError(f"{temp_upload.filename} serverda topilmadi, qaytadan yuklang")
+    shared_file.save()
+    temp_upload.delete()
+    return shared_file
+
+
+def _commit_encrypted_upload(batch, temp_upload):
+    """
+    Qabul paytida shifrlangan faylni batchga biriktiradi. Dedup yoqilgan
+    bo'lsa, xuddi shunday tarkib allaqachon saqlangan bo'lsa — faqat havola.
+    """
+    shared_file = SharedFile(
+        batch=batch,
+        original_name=temp_upload.filename,
+        file_size=temp_upload.total_size,
+        file_hash=uploads.file_hash(temp_upload.temp_file_path, temp_upload.total_size),
+        encryption_key=temp_upload.encryption_key,
+    )
+    if blobs.enabled() and shared_file.file_hash:
+        blobs.store_encrypted(
+            shared_file,
+            temp_upload.temp_file_path,
+            shared_file.file_hash,
+            temp_upload.total_size,
+            temp_upload.encryption_key,
+        )
+    else:
+        shared_file.file.name = uploads.promote(
+            temp_upload.temp_file_path,
+            shared_file.file.field.generate_filename(shared_file, f"{temp_upload.upload_id}.enc"),
+        )
+    shared_file.save()
+    temp_upload.delete()
+    return shared_file
+
+
 # @transaction.atomic ni funksiyaning o'zidan OLIB TASHLAYMIZ
 def finalize_batch_view(request):
     if request.method == "POST":
         try:
-            # 1. LIMITLARNI TEKSHIRISH
-            now = timezone.now()
-            start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            user_ip = request.META.get('REMOTE_ADDR')
-            
-            # ... (sizning limitlarni tekshirish kodingiz) ...
+            # 1. LIMITLARNI TEKSHIRISH: sessiya ochilganda tekshirilgan, lekin parallel
+            # sessiyalar uchun bu yerda yana — batch joyi atomar band qilinadi
+            user_ip = quota.client_ip(request)
 
             # transaction.atomic blokini faqat ma'lumotlar bazasiga yozuvlar yaratish uchun ishlatamiz
-            with transaction.atomic():
+            with quota.batch_slot(request) as has_slot, transaction.atomic():
+                if not has_slot:
+                    max_allowed = quota.limits(request)[0]
+                    return JsonResponse({
+                        "status": "error",
+                        "message": f"Sizning oylik yuklash limitingiz ({max_allowed}) tugadi. Keyingi oyda urinib ko'ring!"
+                    }, status=403)
+
                 # 2. MA'LUMOTLARNI OLISH
                 data = json.loads(request.body)
                 upload_ids = data.get("upload_ids", [])
                 raw_password = data.get("password", "")
 
+                # Hamma fayl to'liq kelganini birinchi yozuvdan OLDIN tekshiramiz
+                temp_uploads = ChunkedUpload.objects.in_bulk(upload_ids, field_name="upload_id")
+                for temp_upload in temp_uploads.values():
+                    if not temp_upload.blob_id and not uploads.is_complete(
+                        temp_upload.temp_file_path, temp_upload.total_size
+                    ):
+                        raise uploads.ChunkError(f"{temp_upload.filename} to'liq yuklanmagan")
+
                 # 3. BATCH YARATISH
                 batch = FileBatch.objects.create(
                     owner=request.user if request.user.is_authenticated else None,
@@ -208,8 +502,7 @@ def finalize_batch_view(request):
                     comment=escape(strip_tags(data.get("comment", "")))[:300],
                     expires_at=timezone.now() + timezone.timedelta(days=1),
                 )
-                
-                batch.short_code = str(batch.url_uuid)[:6].upper()
+
                 if raw_password:
                     batch.set_batch_password(raw_password)
                 batch.save()
@@ -219,11 +512,22 @@ def finalize_batch_view(request):
                 upload_ids_data = []
                 for up_id in upload_ids:
                     # Muhim: aniq upload_id bo'yicha olamiz
-                    temp_upload = ChunkedUpload.objects.filter(upload_id=up_id).first()
+                    temp_upload = temp_uploads.get(up_id)
                     
+                    if temp_upload and temp_upload.blob_id:
+                        # Tarkib serverda bor: chunklar yuborilmagan, faqat havola
+                        _commit_linked_upload(batch, temp_upload)
+                        continue
+
                     if temp_upload:
                         # Agar chunklarda yozuv topsak, asl nomni olamiz (masalan "referat.docx")
                         real_name = temp_upload.filename
+
+                        if temp_upload.encryption_key:
+                            # Fayl qabul paytida shifrlangan: faqat joyini o'zgartiramiz (rename), Celery kerak emas.
+                            # Rename tranzaksiya tasdiqlangach bajariladi (uploads.promote)
+                            _commit_encrypted_upload(batch, temp_upload)
+                            continue
                     else:
                         # Agar topilmasa, boricha qoldiramiz
                         real_name = up_id
@@ -233,60 +537,71 @@ def finalize_batch_view(request):
                         'real_name': real_name
                     })
 
+                # Fonda shifrlanadigan fayllar bo'lsa, batch "processing" holatida
+                batch.expected_files = len(upload_ids)
+                if upload_ids_data:
+                    batch.status = FileBatch.Status.PROCESSING
+                batch.save(update_fields=["expected_files", "status"])
+
             # <--- TRANZAKSIYA SHU YERDA TUGADI. Ma'lumotlar bazada tasdiqlangan. --->
 
-            # ENDI Celery ni ishga tushiramiz. Endi u batch.id va to'g'ri nomlarni ko'radi.
-            encrypt_files_background_task.delay(batch.id, upload_ids_data)
+            # ENDI Celery ni ishga tushiramiz: har bir fayl alohida vazifa, parallel
+            if upload_ids_data:
+                dispatch_batch_encryption(batch.id, upload_ids_data)
 
             # 5. JAVOB (DARHOL sodir bo'ladi)
-            download_url = request.build_absolute_uri(reverse("download_page", args=[batch.url_uuid]))
-            qr_base64 = generate_qr_code_base64(download_url, batch.url_uuid)
+            download_url = _batch_download_url(request, batch.url_uuid)
 
             return JsonResponse({
                 "status": "success", 
                 "download_url": download_url, 
-                "qr_code": qr_base64,
+                # Rasm emas, manzil: QR birinchi so'rovda chiziladi va keshlanadi
+                "qr_code": reverse("batch_qr", args=[batch.url_uuid]),
                 "short_code": batch.short_code,
                 "info": "Fayllar fonda qayta ishlanmoqda" 
             })
             
+        except uploads.ChunkError as e:
+            return JsonResponse({"status": "error", "message": str(e)}, status=400)
         except Exception as e:
             return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
 
 # ----------------------------------------------------------------------------------
+@cache_control(private=True, no_cache=True)
 def download_page_view(request, url_uuid):
-    batch = get_object_or_404(FileBatch, url_uuid=url_uuid)
-
-    # --- QO'SHILDI: XATONI TUZATISH UCHUN LIMITLARNI HISOBLASH ---
-    now = timezone.now()
-    start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    user_ip = request.META.get('REMOTE_ADDR')
-
-    if request.user.is_authenticated:
-        used = FileBatch.objects.filter(owner=request.user, created_at__gte=start_of_month).count()
-        remains = 10 - used
-    else:
-        used = FileBatch.objects.filter(owner__isnull=True, ip_address=user_ip, created_at__gte=start_of_month).count()
-        remains = 5 - used
-    # -----------------------------------------------------
+    # Sahifa ma'lumoti keshdan (main/pagecache.py): issiq havola bazaga bormaydi
+    page = pagecache.get(url_uuid)
+    if page is None:
+        raise Http404
 
     # 1. Amal qilish muddatini tekshirish
-    if batch.expires_at < now:
+    if page["expires_at"] < timezone.now():
         return HttpResponse("Havola muddati tugadi", status=410)
 
-    session_key = f"auth_batch_{batch.id}"
+    session_key = f"auth_batch_{page['id']}"
 
     # 2. Agar parol mavjud bo'lsa va sessiyada hali tasdiqlanmagan bo'lsa
-    if batch.password and not request.session.get(session_key):
+    if page["has_password"] and not request.session.get(session_key):
         if request.method == "POST":
-            cache_key = f"brute_force_{user_ip}_{batch.id}"
-            attempts = cache.get(cache_key, 0)
+            # Umumiy kesh (Redis): urinishlar barcha workerlar bo'yicha sanaladi
+            cache_key = f"auth:brute:{page['id']}:{quota.client_ip(request)}"
+            # Avval hisoblagichni oshiramiz (add + incr — atomar), keyin parolni tekshiramiz:
+            # parallel so'rovlar ham limitdan o'ta olmaydi
+            lockout = settings.TEZSHARE_PASSWORD_LOCKOUT
+            cache.add(cache_key, 0, lockout)
+            try:
+                attempts = cache.incr(cache_key)
+            except ValueError:
+                # Kalit shu orada o'chdi (muddati tugadi)
+                attempts = 1
+                cache.set(cache_key, attempts, lockout)
 
-            if attempts >= 5:
-                return HttpResponseForbidden("Juda ko'p urinishlar. 1 daqiqa kuting.")
+            if attempts > settings.TEZSHARE_PASSWORD_ATTEMPTS:
+                return HttpResponseForbidden(f"Juda ko'p urinishlar. {lockout} soniya kuting.")
 
             input_pass = request.POST.get("password")
+            batch = get_object_or_404(FileBatch, pk=page["id"])
 
             if batch.check_batch_password(input_pass):
                 cache.delete(cache_key)
@@ -294,63 +609,202 @@ def download_page_view(request, url_uuid):
                 request.session.modified = True
                 return redirect("download_page", url_uuid=url_uuid)
             else:
-                attempts += 1
-                cache.set(cache_key, attempts, 60)
                 return render(
                     request,
                     "main/password_form.html",
                     {
-                        "batch": batch,
-                        "remains": remains, # Har ehtimolga qarshi bu yerga ham qo'shamiz
-                        "error": f"Noto'g'ri parol. Qolgan urinishlar: {5 - attempts}",
+                        "batch": page,
+                        "error": f"Noto'g'ri parol. Qolgan urinishlar: {settings.TEZSHARE_PASSWORD_ATTEMPTS - attempts}",
                     },
                 )
 
-        return render(request, "main/password_form.html", {"batch": batch, "remains": remains})
+        return render(request, "main/password_form.html", {"batch": page})
+
+    # 3. Agar parol bo'lmasa yoki allaqachon kiritilgan bo'lsa — fayllarni ko'rsatamiz.
+    # Sahifada foydalanuvchi menyusi ham bor, shuning uchun ETag foydalanuvchiga bog'liq
+    etag = f'"{page["etag"]}-{request.user.pk or 0}"'
+    last_modified = page["modified"].timestamp()
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
 
-    # 3. Agar parol bo'lmasa yoki allaqachon kiritilgan bo'lsa — fayllarni ko'rsatamiz
-    # ENDI BU YERDA remains MAVJUD VA XATO BO'LMAYDI
-    return render(request, "main/download.html", {
-        "batch": batch, 
-        "remains": remains
+    response = render(request, "main/download.html", {"batch": page, "files": page["files"]})
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
+
+@require_http_methods(["GET"])
+def batch_status_view(request, url_uuid):
+    """Yengil JSON: batch tayyormi va qaysi fayllar allaqachon yuklab olinishi mumkin."""
+    batch = get_object_or_404(FileBatch, url_uuid=url_uuid)
+
+    if batch.password and not request.session.get(f"auth_batch_{batch.id}"):
+        return JsonResponse({"status": "error", "message": "Parol kerak"}, status=403)
+
+    files = [
+        {
+            "id": sf.id,
+            "name": sf.original_name,
+            "size": sf.file_size,
+            "url": reverse("decrypt_file", args=[sf.id]),
+        }
+        for sf in batch.files.all()
+    ]
+    response = JsonResponse({
+        "status": batch.status,
+        "files_total": max(batch.expected_files, len(files)),
+        "files_ready": len(files),
+        "files": files,
     })
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def _batch_download_url(request, url_uuid):
+    return request.build_absolute_uri(reverse("download_page", args=[url_uuid]))
+
+
+def _qr_etag(request, url_uuid, fmt):
+    return qr.etag(_batch_download_url(request, url_uuid), fmt)
+
+
+@require_http_methods(["GET", "HEAD"])
+@cache_control(public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+@condition(etag_func=_qr_etag)
+def batch_qr_view(request, url_uuid, fmt):
+    """
+    Batch havolasining QR-kodi (PNG yoki SVG). ETag mos kelsa — 304,
+    rasm keshda bo'lsa — bazaga ham murojaat qilinmaydi.
+    """
+    download_url = _batch_download_url(request, url_uuid)
+    data = qr.lookup(download_url, fmt)
+    if data is None:
+        # Faqat mavjud batchlar uchun chizamiz
+        if not FileBatch.objects.filter(url_uuid=url_uuid).exists():
+            raise Http404("Batch topilmadi")
+        data = qr.fill(download_url, fmt)
+    return HttpResponse(data, content_type=qr.CONTENT_TYPES[fmt])
 
 # -----------------------------------------------------------------------------
 
 
+def _stream_plaintext(f, chunks, expected_hash=None):
+    """
+    Faylni kadrma-kadr uzatadi. Har bir kadr AES-GCM tegi bilan tekshiriladi;
+    to'liq fayl so'ralganda hash ham oqim davomida hisoblanadi.
+    """
+    try:
+        digest = TreeHasher() if expected_hash else None
+        for chunk in chunks:
+            if digest:
+                digest.update(chunk)
+            yield chunk
+        if digest and digest.hexdigest() != expected_hash:
+            # Javob allaqachon yuborilmoqda — ulanishni uzamiz, mijoz to'liq bo'lmagan faylni oladi
+            raise DecryptionError("Fayl buzilgan!")
+    finally:
+        f.close()
+
+
+def _accel_response(name, content_type, filename):
+    """
+    Baytlarni nginx beradi (sendfile): Django faqat ruxsatni tekshirdi.
+    Range, Content-Length va 206/416 ni ham nginx o'zi boshqaradi.
+    """
+    response = HttpResponse(content_type=content_type)
+    response["X-Accel-Redirect"] = plaincache.accel_path(name)
+    response["Content-Disposition"] = f"attachment; filename*=UTF-8''{escape_uri_path(filename)}"
+    return response
+
+
 def decrypt_file_view(request, file_id):
-    shared_file = get_object_or_404(SharedFile, id=file_id)
+    shared_file = get_object_or_404(SharedFile.objects.select_related("batch"), id=file_id)
     batch = shared_file.batch
 
+    if batch.expires_at < timezone.now():
+        return HttpResponse("Muddat tugadi", status=410)
+
     if batch.password and not request.session.get(f"auth_batch_{batch.id}"):
         return HttpResponse("Kirish taqiqlangan. Parolni kiriting.", status=403)
 
-    cipher = Fernet(batch.encryption_key)
-    
+    return _file_response(request, shared_file)
+
+
+def _file_response(request, shared_file):
+    """
+    Ruxsat tekshirilgandan keyingi qism: X-Accel yoki Range bilan oqim.
+    Bazaga murojaat qilmaydi (shared_file.batch oldindan yuklangan bo'lishi kerak),
+    shuning uchun async_views uni alohida oqimda (thread) chaqira oladi.
+    """
+    batch = shared_file.batch
+    cache_name = plaincache.file_entry(shared_file.id)
+    if plaincache.enabled() and plaincache.lookup(cache_name):
+        content_type = mimetypes.guess_type(shared_file.original_name)[0] or "application/octet-stream"
+        return _accel_response(cache_name, content_type, shared_file.original_name)
+    # Keshda yo'q — odatdagidek oqim bilan beramiz (butun fayl bo'lsa, yo'l-yo'lakay keshga ham)
+
     # --- MUHIM: O'qishdan oldin faylni binary rejimda ochamiz ---
     try:
-        with shared_file.file.open('rb') as f:
-            encrypted_data = f.read()
+        f = shared_file.file.open('rb')
+        stored_size = shared_file.file.size
     except Exception as e:
         return HttpResponse(f"Faylni o'qishda xatolik: {e}", status=500)
 
-    # Shifrni ochamiz
+    # Shifrni ochamiz (yangi kadrli format yoki eski Fernet)
     try:
-        decrypted_data = cipher.decrypt(encrypted_data)
-    except Exception:
+        plaintext = DecryptedFile(shared_file.key, f, stored_size)
+    except DecryptionError:
+        f.close()
         return HttpResponse("Shifrni ochishda xatolik. Kalit noto'g'ri bo'lishi mumkin.", status=400)
 
-    # Hash ni tekshirish
-    current_hash = hashlib.sha256(decrypted_data).hexdigest()
-    if shared_file.file_hash and current_hash != shared_file.file_hash:
-        return HttpResponse("Fayl buzilgan!", status=400)
+    # Range / If-Range: faqat kerakli kadrlarni ochamiz (video, davom ettirilgan yuklab olish)
+    etag = f'"{shared_file.id}-{stored_size}"'
+    last_modified = http_date(batch.created_at.timestamp())
+    start, end, status = 0, plaintext.size, 200
+
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range in (etag, last_modified):
+        try:
+            byte_range = parse_range_header(request.headers.get("Range"), plaintext.size)
+        except ValueError:
+            f.close()
+            response = HttpResponse("Noto'g'ri diapazon", status=416)
+            response["Content-Range"] = f"bytes */{plaintext.size}"
+            return response
+        if byte_range:
+            start, end = byte_range
+            status = 206
 
     # Turi (MIME) ni aniqlash
     content_type, _ = mimetypes.guess_type(shared_file.original_name)
     if not content_type:
         content_type = "application/octet-stream"
 
-    response = HttpResponse(decrypted_data, content_type=content_type)
+    if request.method == "HEAD":
+        f.close()
+        response = HttpResponse(content_type=content_type, status=status)
+    else:
+        chunks = plaintext.iter_range(start, end)
+        # Birinchi kadrni oldindan ochamiz: kalit xato bo'lsa, 400 qaytarish mumkin
+        try:
+            first = next(chunks, b"")
+        except DecryptionError:
+            f.close()
+            return HttpResponse("Shifrni ochishda xatolik. Kalit noto'g'ri bo'lishi mumkin.", status=400)
+        whole = (start, end) == (0, plaintext.size)
+        expected_hash = shared_file.file_hash if whole else None
+        stream = _stream_plaintext(f, itertools.chain([first], chunks), expected_hash)
+        if whole and plaincache.enabled():
+            # Xesh mos kelmasa, _stream_plaintext xato beradi va kesh yozilmaydi
+            stream = plaincache.tee(cache_name, stream)
+        response = StreamingHttpResponse(stream, content_type=content_type, status=status)
+
+    response["Content-Length"] = end - start
+    if status == 206:
+        response["Content-Range"] = f"bytes {start}-{end - 1}/{plaintext.size}"
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
     
     # Nomni kodlash (fayl up_177... deb atalmasdan, asl nomiga ega bo'lishi uchun)
     filename = shared_file.original_name
@@ -360,6 +814,32 @@ def decrypt_file_view(request, file_id):
     
     return response
 
+def _zip_batch_chunks(batch, files=None, skipped=None):
+    """
+    ZIP ni oqim sifatida yaratadi: har bir fayl kadrma-kadr ochiladi va darhol
+    arxivga yoziladi. Xotira bitta kadr bilan cheklangan.
+    files — oldindan olingan fayllar ro'yxati (async ko'rinishda bazaga oqimdan murojaat qilmaslik uchun).
+    skipped — ro'yxat berilsa, ochilmagan (arxivga kirmagan) fayllar nomi shunga yoziladi.
+    """
+    zip_stream = ZipStream()
+    for sf in batch.files.all() if files is None else files:
+        with sf.file.open("rb") as f:
+            try:
+                plaintext = DecryptedFile(sf.key, f, sf.file.size)
+            except DecryptionError:
+                if skipped is not None:
+                    skipped.append(sf.original_name)
+                continue
+            yield from zip_stream.add(
+                sf.original_name,
+                plaintext,
+                size=plaintext.size,
+                compress=not is_precompressed(sf.original_name),
+                date_time=batch.created_at,
+            )
+    yield from zip_stream.finish()
+
+
 # -------------------------------------------------------------------------
 def download_batch_zip(request, url_uuid):
     batch = get_object_or_404(FileBatch, url_uuid=url_uuid)
@@ -371,19 +851,22 @@ def download_batch_zip(request, url_uuid):
     if batch.password and not request.session.get(f"auth_batch_{batch.id}"):
         return HttpResponse("Kirish taqiqlangan. Parolni kiriting.", status=403)
 
-    buffer = io.BytesIO()
-    cipher = Fernet(batch.encryption_key)
+    return _zip_response(batch)
 
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for sf in batch.files.all():
-            try:
-                decrypted_data = cipher.decrypt(sf.file.read())
-                zip_file.writestr(sf.original_name, decrypted_data)
-            except:
-                continue
 
-    buffer.seek(0)
-    response = HttpResponse(buffer.getvalue(), content_type="application/zip")
+def _zip_response(batch, files=None):
+    # Tayyor batch arxivi o'zgarmaydi: bir marta keshga yozib, nginx orqali beramiz
+    name = plaincache.zip_entry(batch.id)
+    cacheable = plaincache.enabled() and batch.status == FileBatch.Status.READY
+    if cacheable and plaincache.lookup(name):
+        return _accel_response(name, "application/zip", f"tezshare_{batch.short_code}.zip")
+
+    skipped = []
+    stream = _zip_batch_chunks(batch, files, skipped)
+    if cacheable:
+        # Birinchi yuklab oluvchiga oqim, yo'l-yo'lakay keshga; fayli tushib qolgan arxiv keshlanmaydi
+        stream = plaincache.tee(name, stream, complete=lambda: not skipped)
+    response = StreamingHttpResponse(stream, content_type="application/zip")
     response["Content-Disposition"] = (
         f'attachment; filename="tezshare_{batch.short_code}.zip"'
     )
@@ -393,35 +876,38 @@ def download_batch_zip(request, url_uuid):
 from django.db.models import Count, Q
 
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
 from django.db.models import Count, Sum
 from django.shortcuts import render
 from .models import FileBatch
 
 
+MY_FILES_PAGE_SIZE = 20
+
+
 @login_required
 def my_files_view(request):
-    # 1. Batchlarni olamiz (tekshiring: owner yoki user?)
-    batches = FileBatch.objects.filter(owner=request.user).order_by("-created_at")
-    
-    # 2. Havolalarni hisoblaymiz
-    total_batches = batches.count()
-    
-    # 3. Barcha fayllarni ishonchlilik uchun qo'lda hisoblaymiz
-    total_files = 0
-    for b in batches:
-        total_files += b.files.count()
-        
-    # 4. Parollarni hisoblaymiz
-    p_count = 0
-    for b in batches:
-        if b.password: # Maydon nomini tekshiring: password yoki password_hash
-            p_count += 1
+    # 1. Batchlar: fayllar soni va hajmi bitta so'rovda (har bir batch uchun COUNT emas)
+    batches = FileBatch.objects.filter(owner=request.user)
+    page = Paginator(
+        batches.annotate(file_count=Count("files"), total_size=Sum("files__file_size"))
+        .order_by("-created_at", "-id"),
+        MY_FILES_PAGE_SIZE,
+    ).get_page(request.GET.get("page"))
+
+    # 2. Umumiy statistika — bitta agregat so'rov
+    totals = batches.aggregate(
+        total_batches=Count("id", distinct=True),
+        total_files=Count("files"),
+        password_count=Count("id", distinct=True, filter=Q(password__isnull=False) & ~Q(password="")),
+    )
 
     return render(request, "main/my_files.html", {
-        "batches": batches,
-        "total_batches": total_batches,
-        "total_files_count": total_files,
-        "password_count": p_count
+        "batches": page,
+        "page_obj": page,
+        "total_batches": totals["total_batches"],
+        "total_files_count": totals["total_files"],
+        "password_count": totals["password_count"],
     })
 
 
@@ -0,0 +1,183 @@
+"""
+Потоковая запись ZIP-архива (с поддержкой ZIP64).
+
+Записи пишутся с дескриптором данных (флаг 3): CRC и размеры идут после
+данных, поэтому архив отдаётся клиенту по мере расшифровки файлов, без
+буфера в памяти. Центральный каталог пишется в конце.
+"""
+import struct
+import zlib
+
+from django.utils import timezone
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+# Запас на случай, если deflate увеличит несжимаемые данные
+_DEFLATE_SLACK = 1 << 20
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_DATA_DESCRIPTOR64 = struct.Struct("<IIQQ")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+_END_LOCATOR64 = struct.Struct("<IIQI")
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_STORED = 0
+_DEFLATED = 8
+
+
+def _dos_datetime(value):
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    year = max(value.year, 1980)
+    date = ((year - 1980) << 9) | (value.month << 5) | value.day
+    time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    return time, date
+
+
+class ZipStream:
+    """
+    Генерирует ZIP по кускам.
+
+    Использование:
+        zs = ZipStream()
+        yield from zs.add("a.txt", chunks, size=123)
+        yield from zs.finish()
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._offset = 0
+
+    def _emit(self, data):
+        self._offset += len(data)
+        return data
+
+    def add(self, name, chunks, size=None, compress=True, date_time=None):
+        """
+        Записывает один файл. size — известный заранее размер открытого
+        текста (нужен, чтобы не включать ZIP64 для маленьких файлов).
+        """
+        encoded_name = name.encode("utf-8")
+        method = _DEFLATED if compress else _STORED
+        dos_time, dos_date = _dos_datetime(date_time or timezone.now())
+        zip64 = size is None or size + _DEFLATE_SLACK > _ZIP32_LIMIT
+        header_offset = self._offset
+
+        extra = b""
+        if zip64:
+            # Размеры неизвестны заранее — нули, настоящие будут в дескрипторе
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+        yield self._emit(
+            _LOCAL_HEADER.pack(
+                0x04034B50,
+                45 if zip64 else 20,
+                _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+                method,
+                dos_time,
+                dos_date,
+                0,
+                _ZIP32_LIMIT if zip64 else 0,
+                _ZIP32_LIMIT if zip64 else 0,
+                len(encoded_name),
+                len(extra),
+            )
+            + encoded_name
+            + extra
+        )
+
+        crc = 0
+        raw_size = 0
+        compressed_size = 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+        for chunk in chunks:
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            raw_size += len(chunk)
+            data = compressor.compress(chunk) if compressor else chunk
+            if data:
+                compressed_size += len(data)
+                yield self._emit(data)
+        if compressor:
+            data = compressor.flush()
+            compressed_size += len(data)
+            yield self._emit(data)
+
+        if zip64:
+            descriptor = _DATA_DESCRIPTOR64.pack(0x08074B50, crc, compressed_size, raw_size)
+        elif compressed_size > _ZIP32_LIMIT or raw_size > _ZIP32_LIMIT:
+            raise ValueError(f"{name}: размер превысил заявленный, нужен ZIP64")
+        else:
+            descriptor = _DATA_DESCRIPTOR.pack(0x08074B50, crc, compressed_size, raw_size)
+        yield self._emit(descriptor)
+
+        self._entries.append(
+            (encoded_name, method, dos_time, dos_date, crc, compressed_size, raw_size, header_offset, zip64)
+        )
+
+    def finish(self):
+        """Центральный каталог и завершающие записи."""
+        directory_offset = self._offset
+        for name, method, dos_time, dos_date, crc, compressed_size, raw_size, offset, zip64 in self._entries:
+            extra_fields = []
+            if raw_size >= _ZIP32_LIMIT:
+                extra_fields.append(raw_size)
+            if compressed_size >= _ZIP32_LIMIT:
+                extra_fields.append(compressed_size)
+            if offset >= _ZIP32_LIMIT:
+                extra_fields.append(offset)
+            extra = b""
+            if extra_fields:
+                extra = struct.pack(f"<HH{len(extra_fields)}Q", 0x0001, 8 * len(extra_fields), *extra_fields)
+            needs_zip64 = zip64 or bool(extra_fields)
+
+            yield self._emit(
+                _CENTRAL_HEADER.pack(
+                    0x02014B50,
+                    45 if needs_zip64 else 20,
+                    45 if needs_zip64 else 20,
+                    _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+                    method,
+                    dos_time,
+                    dos_date,
+                    crc,
+                    min(compressed_size, _ZIP32_LIMIT),
+                    min(raw_size, _ZIP32_LIMIT),
+                    len(name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0,
+                    min(offset, _ZIP32_LIMIT),
+                )
+                + name
+                + extra
+            )
+
+        directory_size = self._offset - directory_offset
+        count = len(self._entries)
+        if count >= _ZIP16_LIMIT or directory_offset >= _ZIP32_LIMIT or directory_size >= _ZIP32_LIMIT:
+            end64_offset = self._offset
+            yield self._emit(
+                _END_RECORD64.pack(
+                    0x06064B50, 44, 45, 45, 0, 0, count, count, directory_size, directory_offset
+                )
+            )
+            yield self._emit(_END_LOCATOR64.pack(0x07064B50, 0, end64_offset, 1))
+
+        yield self._emit(
+            _END_RECORD.pack(
+                0x06054B50,
+                0,
+                0,
+                min(count, _ZIP16_LIMIT),
+                min(count, _ZIP16_LIMIT),
+                min(directory_size, _ZIP32_LIMIT),
+                min(directory_offset, _ZIP32_LIMIT),
+                0,
+            )
+        )
@@ -11,6 +11,41 @@ class DownloadPage {
         this.initDownloadTracking();
         this.initFileIcons();
         this.checkExpiration();
+        this.initStatusPolling();
+    }
+
+    // ============================================
+    // Batch Status Polling (файлы ещё шифруются)
+    // ============================================
+    initStatusPolling() {
+        const container = document.querySelector('.download-container');
+        if (!container || container.dataset.batchStatus !== 'processing') return;
+
+        const statusUrl = container.dataset.statusUrl;
+        const statusText = document.getElementById('batchStatusText');
+        let knownReady = document.querySelectorAll('.file-item').length;
+
+        const poll = async () => {
+            try {
+                const response = await fetch(statusUrl, { credentials: 'same-origin' });
+                if (!response.ok) return;
+                const data = await response.json();
+
+                // Новый файл готов — перерисовываем страницу, он сразу доступен
+                if (data.files_ready > knownReady || data.status !== 'processing') {
+                    window.location.reload();
+                    return;
+                }
+                knownReady = data.files_ready;
+                if (statusText) {
+                    statusText.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Fayllar shifrlanmoqda: ${data.files_ready} / ${data.files_total} tayyor`;
+                }
+            } catch (e) {
+                console.warn('Status check failed:', e);
+            }
+            setTimeout(poll, 2000);
+        };
+        setTimeout(poll, 2000);
     }
 
     // ============================================
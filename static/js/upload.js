@@ -15,10 +15,31 @@ const CSRF_TOKEN = document.getElementById('csrfToken')?.value || '';
 // Get URLs
 const CHUNK_UPLOAD_URL = document.getElementById('chunkUploadUrl')?.value || '';
 const FINALIZE_BATCH_URL = document.getElementById('finalizeBatchUrl')?.value || '';
+const UPLOAD_INIT_URL = document.getElementById('uploadInitUrl')?.value || '';
+const PRECHECK_URL = document.getElementById('precheckUrl')?.value || '';
+const CAPABILITIES_URL = document.getElementById('uploadCapabilitiesUrl')?.value || '';
+const RAW_UPLOAD_URL = document.getElementById('rawUploadUrl')?.value || '';
+
+// Параллельная загрузка: значения по умолчанию, сервер присылает свои (upload/capabilities/)
+const DEFAULT_CAPABILITIES = {
+    unit: 64 * 1024,                          // смещения и размеры кратны этому блоку
+    preferred_chunk_size: 1024 * 1024,        // 1MB — стартовый размер чанка
+    max_chunk_size: 8 * 1024 * 1024,
+    max_parallel: 6,
+    dedup: false                              // сервер хранит одинаковое содержимое один раз (precheck)
+};
+const INITIAL_WINDOW = 3;         // Сколько чанков в полёте на старте
+const TARGET_CHUNK_SECONDS = 2;   // Чанк должен идти ~2 сек: накладные расходы запроса малы,
+const RTT_FACTOR = 8;             // ...и не меньше 8 RTT
+const CHUNK_RETRIES = 3;
+
+// Проверка хеша до загрузки: для файлов меньше этого размера быстрее просто загрузить
+const PRECHECK_MIN_SIZE = 4 * 1024 * 1024;
+const HASH_LEAF_SIZE = 64 * 1024; // как HASH_LEAF_SIZE в main/utils.py
+const HASH_READ_SIZE = 8 * 1024 * 1024;
 
-// Константы для параллельной загрузки
-const CHUNK_SIZE = 1024 * 1024; // 1MB
-const PARALLEL_CHUNKS = 3; // Количество одновременных чанков
+// Ключ localStorage: отпечаток файла → upload_id (для продолжения после перезапуска браузера)
+const RESUME_STORAGE_KEY = 'tezshare_resumable_uploads';
 
 // Настройки сжатия изображений
 const IMAGE_COMPRESSION_OPTIONS = {
@@ -32,7 +53,6 @@ console.log('🔍 Upload Configuration:');
 console.log('CSRF Token:', CSRF_TOKEN ? '✅ Found' : '❌ Missing');
 console.log('Upload URL:', CHUNK_UPLOAD_URL || '❌ Missing');
 console.log('Finalize URL:', FINALIZE_BATCH_URL || '❌ Missing');
-console.log('Parallel chunks:', PARALLEL_CHUNKS);
 console.log('Max file size:', formatFileSize ? formatFileSize(MAX_SIZE) : MAX_SIZE);
 
 if (!CSRF_TOKEN) {
@@ -148,16 +168,16 @@ async function processFile(file) {
     totalFiles++;
     updateStats();
 
-    // Генерируем уникальный ID
-    const upId = 'up_' + Date.now() + '_' + Math.random().toString(36).substr(2, 5);
-    const rowId = 'row_' + upId;
-    const queue = document.getElementById('fileQueue');
-
     // Сжимаем изображение если нужно (только если < 50MB)
     let processedFile = file;
     if (file.size < 50 * 1024 * 1024) { // Сжимаем только файлы < 50MB
         processedFile = await compressImageIfNeeded(file);
     }
+
+    // ID загрузки: тот же файл после обрыва связи или перезапуска браузера получает прежний ID
+    const upId = getResumableUploadId(file, processedFile);
+    const rowId = 'row_' + upId;
+    const queue = document.getElementById('fileQueue');
     
     const originalSize = file.size;
     const processedSize = processedFile.size;
@@ -203,8 +223,11 @@ async function processFile(file) {
         file: processedFile
     });
 
+    // Если такое содержимое уже есть на сервере — чанки не отправляем
+    const linked = await tryInstantUpload(processedFile, upId, rowId);
+
     // Start upload with parallel chunks
-    const success = await uploadInChunksParallel(processedFile, upId, rowId);
+    const success = linked || await uploadInChunksParallel(processedFile, upId, rowId);
 
     if (success) {
         uploadedFiles.get(upId).status = 'completed';
@@ -219,13 +242,290 @@ async function processFile(file) {
 }
 
 
+// ============================================
+// Resumable Uploads (продолжение прерванной загрузки)
+// ============================================
+
+function loadResumableUploads() {
+    try {
+        return JSON.parse(localStorage.getItem(RESUME_STORAGE_KEY)) || {};
+    } catch (e) {
+        return {};
+    }
+}
+
+function saveResumableUploads(map) {
+    try {
+        localStorage.setItem(RESUME_STORAGE_KEY, JSON.stringify(map));
+    } catch (e) {
+        console.warn('⚠️ localStorage недоступен, продолжение загрузки отключено');
+    }
+}
+
+function getResumableUploadId(originalFile, processedFile) {
+    const base = [
+        originalFile.name, originalFile.size, originalFile.lastModified, processedFile.size
+    ].join(':');
+    const map = loadResumableUploads();
+
+    // Тот же файл, добавленный в батч ещё раз, — отдельная загрузка со своим ID
+    // (номер копии), иначе обе строки писали бы в один upId
+    let copy = 0;
+    while (map[`${base}:${copy}`] && uploadedFiles.has(map[`${base}:${copy}`])) copy++;
+    const fingerprint = `${base}:${copy}`;
+
+    if (!map[fingerprint]) {
+        map[fingerprint] = 'up_' + Date.now() + '_' + Math.random().toString(36).substr(2, 10);
+        saveResumableUploads(map);
+    }
+    return map[fingerprint];
+}
+
+function forgetResumableUpload(upId) {
+    const map = loadResumableUploads();
+    for (const [fingerprint, id] of Object.entries(map)) {
+        if (id === upId) delete map[fingerprint];
+    }
+    saveResumableUploads(map);
+}
+
+// RTT до сервера: время до заголовков ответа у маленьких запросов (сессия,
+// манифест). Длительность чанка не подходит — в ней ещё и передача данных.
+let observedRtt = Infinity;
+
+function noteRtt(started) {
+    observedRtt = Math.min(observedRtt, (performance.now() - started) / 1000);
+}
+
+// Открываем сессию загрузки: лимиты проверяются один раз, чанки идут с токеном (без БД на сервере)
+async function openUploadSession(file, upId) {
+    if (!UPLOAD_INIT_URL) return null;
+
+    const started = performance.now();
+    const response = await fetch(UPLOAD_INIT_URL, {
+        method: 'POST',
+        body: JSON.stringify({ upload_id: upId, filename: file.name, size: file.size }),
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': CSRF_TOKEN,
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        credentials: 'same-origin'
+    });
+    noteRtt(started);
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        throw new Error(data.message || `Server error ${response.status}`);
+    }
+    return data.token;
+}
+
+// Размеры чанков от сервера (один запрос на страницу)
+let capabilitiesPromise = null;
+
+function getUploadCapabilities() {
+    if (!capabilitiesPromise) {
+        capabilitiesPromise = (CAPABILITIES_URL
+            ? fetch(CAPABILITIES_URL, { credentials: 'same-origin' })
+                .then(response => response.ok ? response.json() : {})
+                .catch(() => ({}))
+            : Promise.resolve({})
+        ).then(caps => ({ ...DEFAULT_CAPABILITIES, ...caps }));
+    }
+    return capabilitiesPromise;
+}
+
+// Спрашиваем сервер, какие байты он уже получил. Возвращает [[start, end), ...].
+async function fetchReceivedRanges(upId, file) {
+    try {
+        const started = performance.now();
+        const response = await fetch(`${CHUNK_UPLOAD_URL}${encodeURIComponent(upId)}/`, {
+            credentials: 'same-origin',
+            headers: { 'X-Requested-With': 'XMLHttpRequest' }
+        });
+        noteRtt(started);
+        if (!response.ok) return []; // 404 — новая загрузка
+
+        const manifest = await response.json();
+        if (manifest.total_size !== file.size) return [];
+        return manifest.received;
+    } catch (e) {
+        console.warn('⚠️ Не удалось получить состояние загрузки, начинаем с нуля:', e);
+        return [];
+    }
+}
+
+// Недостающие участки файла: дополнение к полученным
+function missingRanges(received, size) {
+    const missing = [];
+    let position = 0;
+    for (const [start, end] of [...received].sort((a, b) => a[0] - b[0])) {
+        if (start > position) missing.push([position, start]);
+        position = Math.max(position, end);
+    }
+    if (position < size) missing.push([position, size]);
+    return missing;
+}
+
+// ============================================
+// Adaptive Chunk Scheduler (скользящее окно)
+// ============================================
+
+// Держит в полёте `window` запросов: как только чанк загружен, сразу уходит
+// следующий. Раз в «раунд» (window завершённых чанков) сравнивает общую
+// скорость с прошлым раундом: растёт — окно +1, падает — окно −1.
+// Размер чанка — столько, сколько один запрос передаёт за
+// max(TARGET_CHUNK_SECONDS, RTT_FACTOR × RTT). Ошибка — окно и чанк вдвое меньше.
+class ChunkScheduler {
+    constructor(caps, ranges, rtt) {
+        this.unit = caps.unit;
+        this.maxChunk = caps.max_chunk_size;
+        this.maxWindow = caps.max_parallel;
+        this.chunkSize = this.align(caps.preferred_chunk_size);
+        this.window = Math.min(INITIAL_WINDOW, this.maxWindow);
+        this.ranges = ranges.map(range => [...range]);
+        this.retries = []; // [start, end, попыток осталось]
+        this.rtt = Number.isFinite(rtt) ? rtt : 0;
+        this.roundBytes = 0;
+        this.roundDone = 0;
+        this.roundStart = performance.now();
+        this.lastRate = 0;
+    }
+
+    align(size) {
+        const aligned = Math.floor(size / this.unit) * this.unit;
+        return Math.min(this.maxChunk, Math.max(this.unit, aligned));
+    }
+
+    hasWork() {
+        return this.retries.length > 0 || this.ranges.length > 0;
+    }
+
+    // Следующий участок: сначала повторы, затем отрезаем chunkSize от первого недостающего
+    next() {
+        if (this.retries.length) return this.retries.shift();
+        const range = this.ranges[0];
+        const end = Math.min(range[0] + this.chunkSize, range[1]);
+        const piece = [range[0], end, CHUNK_RETRIES];
+        range[0] = end;
+        if (range[0] >= range[1]) this.ranges.shift();
+        return piece;
+    }
+
+    onSuccess(bytes) {
+        this.roundBytes += bytes;
+        if (++this.roundDone < this.window) return;
+
+        const elapsed = Math.max((performance.now() - this.roundStart) / 1000, 0.001);
+        const rate = this.roundBytes / elapsed;
+        if (rate > this.lastRate * 1.1 && this.window < this.maxWindow) {
+            this.window++;
+        } else if (rate < this.lastRate * 0.7 && this.window > 1) {
+            this.window--;
+        }
+        const chunkSeconds = Math.max(TARGET_CHUNK_SECONDS, RTT_FACTOR * this.rtt);
+        this.chunkSize = this.align(rate / this.window * chunkSeconds);
+
+        this.lastRate = rate;
+        this.roundBytes = 0;
+        this.roundDone = 0;
+        this.roundStart = performance.now();
+    }
+
+    onError(piece) {
+        this.window = Math.max(1, Math.floor(this.window / 2));
+        this.chunkSize = this.align(this.chunkSize / 2);
+        this.retries.push([piece[0], piece[1], piece[2] - 1]);
+    }
+}
+
+// ============================================
+// Instant Upload (проверка хеша до загрузки)
+// ============================================
+
+function toHex(buffer) {
+    return Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Хеш как calculate_file_hash на сервере: SHA-256 от SHA-256 листьев по 64 KB
+async function computeTreeHash(file) {
+    const leafCount = Math.max(1, Math.ceil(file.size / HASH_LEAF_SIZE));
+    const leaves = new Uint8Array(leafCount * 32);
+
+    for (let offset = 0; offset < file.size; offset += HASH_READ_SIZE) {
+        const buffer = await file.slice(offset, offset + HASH_READ_SIZE).arrayBuffer();
+        const digests = [];
+        for (let pos = 0; pos < buffer.byteLength; pos += HASH_LEAF_SIZE) {
+            digests.push(crypto.subtle.digest('SHA-256', buffer.slice(pos, pos + HASH_LEAF_SIZE)));
+        }
+        (await Promise.all(digests)).forEach((digest, i) => {
+            leaves.set(new Uint8Array(digest), ((offset / HASH_LEAF_SIZE) + i) * 32);
+        });
+    }
+    return toHex(await crypto.subtle.digest('SHA-256', leaves));
+}
+
+// Доказательство владения: SHA-256(nonce + лист) для листьев, выбранных сервером
+async function computeLeafProofs(file, nonce, leafIndexes) {
+    const prefix = new TextEncoder().encode(nonce);
+    return Promise.all(leafIndexes.map(async index => {
+        const leaf = new Uint8Array(
+            await file.slice(index * HASH_LEAF_SIZE, (index + 1) * HASH_LEAF_SIZE).arrayBuffer()
+        );
+        const message = new Uint8Array(prefix.length + leaf.length);
+        message.set(prefix);
+        message.set(leaf, prefix.length);
+        return toHex(await crypto.subtle.digest('SHA-256', message));
+    }));
+}
+
+async function postPrecheck(payload) {
+    const response = await fetch(PRECHECK_URL, {
+        method: 'POST',
+        body: JSON.stringify(payload),
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': CSRF_TOKEN,
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        credentials: 'same-origin'
+    });
+    return response.ok ? response.json() : { status: 'upload' };
+}
+
+async function tryInstantUpload(file, upId, rowId) {
+    // crypto.subtle есть только в защищённом контексте (HTTPS)
+    if (!PRECHECK_URL || !window.crypto?.subtle || file.size < PRECHECK_MIN_SIZE) return false;
+    // Без дедупликации сервер всегда ответит "upload" — не читаем и не хешируем файл зря
+    if (!(await getUploadCapabilities()).dedup) return false;
+
+    try {
+        const payload = { upload_id: upId, filename: file.name, size: file.size };
+        const challenge = await postPrecheck({ ...payload, hash: await computeTreeHash(file) });
+        if (challenge.status !== 'challenge') return false;
+
+        const proofs = await computeLeafProofs(file, challenge.nonce, challenge.leaves);
+        const result = await postPrecheck({ ...payload, token: challenge.token, proofs });
+        if (result.status !== 'linked') return false;
+
+        console.log(`⚡ ${file.name} уже есть на сервере — загрузка не нужна`);
+        const loader = document.getElementById(`loader_${rowId}`);
+        const check = document.getElementById(`check_${rowId}`);
+        if (loader) loader.style.display = 'none';
+        if (check) check.style.display = 'flex';
+        return true;
+    } catch (e) {
+        console.warn('⚠️ Проверка хеша не удалась, загружаем обычным способом:', e);
+        return false;
+    }
+}
+
 // ============================================
 // Parallel Chunk Upload (С ЗАЩИТОЙ ОТ СБОЕВ СЕТИ)
 // ============================================
 
 async function uploadInChunksParallel(file, upId, rowId) {
-    const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
-    let uploadedChunks = 0;
+    let uploadedBytes = 0;
 
     const progressDiv = document.getElementById(`progress_${rowId}`);
     const progressBar = document.getElementById(`progress_bar_${rowId}`);
@@ -236,58 +536,115 @@ async function uploadInChunksParallel(file, upId, rowId) {
         loader.style.display = 'none';
     }
 
-    // Внутренняя функция загрузки одного чанка с логикой RE-TRY
-    const uploadChunkWithRetry = async (chunkIndex, retries = 3) => {
-        const offset = chunkIndex * CHUNK_SIZE;
-        const chunk = file.slice(offset, offset + CHUNK_SIZE);
-        const fd = new FormData();
-        
-        fd.append('chunk', chunk);
-        fd.append('upload_id', upId);
-        fd.append('offset', offset);
-        fd.append('total_size', file.size);
-        fd.append('filename', file.name);
+    const showProgress = () => {
+        const progress = file.size ? Math.round((uploadedBytes / file.size) * 100) : 100;
+        if (progressBar) progressBar.style.width = progress + '%';
+    };
 
-        try {
-            const response = await fetch(CHUNK_UPLOAD_URL, {
-                method: 'POST',
-                body: fd,
+    let sessionToken = null;
+
+    // Загрузка одного участка [start, end). С токеном сессии — «сырым» телом
+    // (PUT upload/raw/, без multipart), иначе — как раньше, FormData
+    const chunkRequest = (start, end) => {
+        const headers = {
+            'X-CSRFToken': CSRF_TOKEN,
+            'X-Requested-With': 'XMLHttpRequest'
+        };
+        if (RAW_UPLOAD_URL && sessionToken) {
+            return fetch(RAW_UPLOAD_URL, {
+                method: 'PUT',
+                body: file.slice(start, end),
                 headers: {
-                    'X-CSRFToken': CSRF_TOKEN,
-                    'X-Requested-With': 'XMLHttpRequest'
+                    ...headers,
+                    'Content-Type': 'application/octet-stream',
+                    'X-Upload-Id': upId,
+                    'X-Upload-Token': sessionToken,
+                    'Upload-Offset': String(start)
                 },
                 credentials: 'same-origin'
             });
+        }
 
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({}));
-                throw new Error(errorData.message || `Server error ${response.status}`);
-            }
+        const fd = new FormData();
+        fd.append('chunk', file.slice(start, end));
+        fd.append('upload_id', upId);
+        fd.append('offset', start);
+        fd.append('total_size', file.size);
+        fd.append('filename', file.name);
+        if (sessionToken) fd.append('token', sessionToken);
 
-            // Успешно загружено
-            uploadedChunks++;
-            const progress = Math.round((uploadedChunks / totalChunks) * 100);
-            if (progressBar) progressBar.style.width = progress + '%';
-
-        } catch (err) {
-            // Если произошла ошибка сети (как ERR_NETWORK_CHANGED)
-            if (retries > 0) {
-                console.warn(`⚠️ Ошибка на чанке ${chunkIndex}. Повтор через 2 сек... (Осталось попыток: ${retries})`);
-                await new Promise(r => setTimeout(r, 2000));
-                return uploadChunkWithRetry(chunkIndex, retries - 1); // Рекурсивный повтор
-            }
-            throw err; // Если попытки кончились, пробрасываем ошибку выше
+        return fetch(CHUNK_UPLOAD_URL, {
+            method: 'POST',
+            body: fd,
+            headers,
+            credentials: 'same-origin'
+        });
+    };
+
+    const uploadChunk = async (start, end) => {
+        const response = await chunkRequest(start, end);
+
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            const error = new Error(errorData.message || `Server error ${response.status}`);
+            // 4xx — ошибка запроса (лимит, токен), повтор не поможет;
+            // 409 — эти блоки сейчас пишет другой запрос, повторяем
+            error.fatal = response.status >= 400 && response.status < 500 && response.status !== 409;
+            throw error;
         }
     };
 
     try {
-        // Загружаем чанки пачками (PARALLEL_CHUNKS)
-        for (let i = 0; i < totalChunks; i += PARALLEL_CHUNKS) {
-            const chunkPromises = [];
-            for (let j = 0; j < PARALLEL_CHUNKS && (i + j) < totalChunks; j++) {
-                chunkPromises.push(uploadChunkWithRetry(i + j));
+        const [caps, token, received] = await Promise.all([
+            getUploadCapabilities(),
+            openUploadSession(file, upId),
+            fetchReceivedRanges(upId, file)
+        ]);
+        sessionToken = token;
+
+        // Пропускаем байты, которые сервер уже получил (продолжение загрузки)
+        uploadedBytes = received.reduce((sum, [start, end]) => sum + end - start, 0);
+        if (uploadedBytes > 0) {
+            console.log(`↩️ Продолжаем ${file.name}: ${formatFileSize(uploadedBytes)} уже на сервере`);
+            showProgress();
+        }
+
+        const scheduler = new ChunkScheduler(caps, missingRanges(received, file.size), observedRtt);
+        const inFlight = new Set();
+        let failure = null;
+
+        const launch = () => {
+            const piece = scheduler.next();
+            const task = uploadChunk(piece[0], piece[1])
+                .then(() => {
+                    uploadedBytes += piece[1] - piece[0];
+                    showProgress();
+                    scheduler.onSuccess(piece[1] - piece[0]);
+                })
+                .catch(async err => {
+                    // Ошибка сети (например, ERR_NETWORK_CHANGED) — повторяем этот участок
+                    if (err.fatal || piece[2] <= 0) {
+                        failure = failure || err;
+                        return;
+                    }
+                    console.warn(`⚠️ Ошибка на участке ${piece[0]}–${piece[1]}. Повтор через 2 сек... (Осталось попыток: ${piece[2]})`);
+                    await new Promise(r => setTimeout(r, 2000));
+                    scheduler.onError(piece);
+                })
+                .finally(() => inFlight.delete(task));
+            inFlight.add(task);
+        };
+
+        // Скользящее окно: держим в полёте scheduler.window запросов
+        while (!failure && (scheduler.hasWork() || inFlight.size > 0)) {
+            while (!failure && scheduler.hasWork() && inFlight.size < scheduler.window) {
+                launch();
             }
-            await Promise.all(chunkPromises); // Ждём выполнения текущей пачки
+            if (inFlight.size > 0) await Promise.race(inFlight);
+        }
+        if (failure) {
+            await Promise.allSettled(inFlight);
+            throw failure;
         }
 
         // Всё готово
@@ -334,6 +691,7 @@ function removeFile(upId) {
             }
             totalFiles--;
             uploadedFiles.delete(upId);
+            forgetResumableUpload(upId);
             
             updateStats();
             updateFinishButton();
@@ -443,6 +801,9 @@ async function finishBatch() {
             // Show success notification
             showNotification('Ссылка успешно создана! Файлы шифруются в фоновом режиме.', 'success');
             
+            // Загрузки завершены — продолжать больше нечего
+            completedFiles.forEach(([upId]) => forgetResumableUpload(upId));
+
             // Очищаем Map
             uploadedFiles.clear();
             
@@ -823,7 +1184,6 @@ document.addEventListener('DOMContentLoaded', () => {
     
     console.log('✅ Upload page initialized');
     console.log('📦 Max file size:', formatFileSize(MAX_SIZE));
-    console.log('⚡ Parallel chunks:', PARALLEL_CHUNKS);
     console.log('🛡️ Absolute max (safety): 2 GB');
     
     // Проверка доступности библиотеки сжатия
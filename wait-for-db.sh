@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# Для воркеров Celery и beat: только ждём базу. Миграции, фильтр коротких
+# кодов и статика — разовые шаги, их выполняет web (entrypoint.sh)
+echo "Waiting for postgres..."
+while ! nc -z db 5432; do
+  sleep 0.1
+done
+echo "PostgreSQL started"
+
+exec "$@"